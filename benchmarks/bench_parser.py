@@ -0,0 +1,80 @@
+"""
+TerminalParser throughput and memory on the transcripts in transcripts.py.
+
+Each transcript is fed in the 1024-byte chunks the I/O loop reads, to a parser
+sized like a HEIGHT x WIDTH terminal. Throughput is the best of `--runs` runs;
+memory is measured with tracemalloc on a separate run, as the peak while
+parsing and what the parser still holds afterwards.
+
+    python benchmarks/bench_parser.py [--runs N] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from aishell.terminal_parser import TerminalParser  # noqa: E402
+from transcripts import HEIGHT, TRANSCRIPTS, WIDTH  # noqa: E402
+
+CHUNK_SIZE = 1024
+
+
+def parse(chunks):
+    term = TerminalParser(height=HEIGHT, width=WIDTH)
+    for chunk in chunks:
+        term.feed(chunk)
+    return term
+
+
+def bench_transcript(data, runs):
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(chunks)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    term = parse(chunks)
+    retained, peak = tracemalloc.get_traced_memory()
+    retained_blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    del term
+    return {
+        "bytes": len(data),
+        "mb_per_second": len(data) / min(timings) / 1e6,
+        "peak_kib": peak / 1024,
+        "retained_kib": retained / 1024,
+        "retained_blocks": retained_blocks,
+    }
+
+
+def run(runs):
+    results = {}
+    for name, make_transcript in TRANSCRIPTS.items():
+        results[name] = result = bench_transcript(make_transcript(), runs)
+        print(f"{name:<18} {result['bytes'] / 1e6:6.1f} MB {result['mb_per_second']:7.2f} MB/s "
+              f"peak {result['peak_kib']:9.0f} KiB, retained {result['retained_kib']:9.0f} KiB")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure TerminalParser throughput and memory use")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per transcript (default: 3)")
+    parser.add_argument("--output", "-o", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"parser": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
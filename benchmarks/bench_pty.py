@@ -0,0 +1,220 @@
+"""
+End-to-end cost of running a shell inside AIShell.
+
+The shell is started on a pseudo-terminal, once directly and once inside
+`aishell` (with and without `--parse-thread`), and driven like a user would:
+
+- echo latency: time from typing a character until its echo comes back,
+  at an idle prompt and while a burst of `cat` output is scrolling past
+- cat throughput: time for `cat` on a large file to scroll past
+- socket round trip: time for a legacy GET_SCREEN_STATE request and a framed
+  `screen` request, with the screen full of the cat output
+
+    python benchmarks/bench_pty.py [--runs N] [--output results.json]
+"""
+import argparse
+import json
+import os
+import pty
+import re
+import select
+import signal
+import socket
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import fcntl
+import termios
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from aishell.protocol import send_request  # noqa: E402
+from transcripts import HEIGHT, WIDTH, cat_large  # noqa: E402
+
+SHELL = "/bin/sh"
+PROMPT = b"PROMPT> "
+# Typed during the burst; it never appears in the cat output
+PROBE = b"#"
+TIMEOUT = 30
+
+
+class Session:
+    def __init__(self, argv):
+        env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"), PS1=PROMPT.decode(), SHELL=SHELL)
+        for var in ("AISHELL_SOCKET", "AISHELL_ACTIVE", "AISHELL_SESSION_LOG"):
+            env.pop(var, None)
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.execvpe(argv[0], argv, env)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack("HHHH", HEIGHT, WIDTH, 0, 0))
+        self.output = bytearray()
+        self.wait_for(PROMPT)
+
+    def read(self, timeout):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return b""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            raise RuntimeError("The session exited") from None
+        self.output += data
+        return data
+
+    def drain(self):
+        """Discard output that has already arrived."""
+        while self.read(0):
+            pass
+        self.output.clear()
+
+    def wait_for(self, marker, timeout=TIMEOUT):
+        """Read until `marker` shows up in the output, then consume the output up to and including it."""
+        deadline = time.perf_counter() + timeout
+        start = 0
+        # Only search what arrived since the last look, so waiting on a flood of output stays linear
+        while self.output.find(marker, start) == -1:
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Timed out waiting for {marker!r}")
+            start = max(0, len(self.output) - len(marker) + 1)
+            self.read(0.1)
+        end = self.output.find(marker, start) + len(marker)
+        consumed = bytes(self.output[:end])
+        del self.output[:end]
+        return consumed
+
+    def run(self, command, marker):
+        os.write(self.fd, command.encode() + b"\n")
+        return self.wait_for(marker)
+
+    def close(self):
+        try:
+            os.write(self.fd, b"exit\n")
+            time.sleep(0.2)
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        os.waitpid(self.pid, 0)
+        os.close(self.fd)
+
+
+def echo_latency(session, runs):
+    timings = []
+    for _ in range(runs):
+        session.drain()
+        start = time.perf_counter()
+        os.write(session.fd, b"x")
+        session.wait_for(b"x")
+        timings.append(time.perf_counter() - start)
+    # Ctrl-U: discard the typed characters
+    os.write(session.fd, b"\x15")
+    session.run("", PROMPT)
+    return statistics.median(timings)
+
+
+def echo_latency_during_burst(session, path, runs):
+    # Ten times the file, so the burst outlasts the probes
+    session.drain()
+    os.write(session.fd, f"for i in 1 2 3 4 5 6 7 8 9 10; do cat {path}; done; echo BURST_''DONE\n".encode())
+    session.wait_for(b"00000000: ")
+    timings = []
+    done = False
+    while len(timings) < runs and not done:
+        start = time.perf_counter()
+        os.write(session.fd, PROBE)
+        done = b"BURST_DONE" in session.wait_for(PROBE)
+        timings.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    if not done:
+        session.wait_for(b"BURST_DONE")
+    os.write(session.fd, b"\x15")
+    session.run("", PROMPT)
+    return statistics.median(timings)
+
+
+def cat_throughput(session, path):
+    # The quotes keep the marker out of the echoed command line
+    start = time.perf_counter()
+    session.run(f"cat {path}; echo CAT_''DONE", b"CAT_DONE")
+    elapsed = time.perf_counter() - start
+    session.wait_for(PROMPT)
+    return os.path.getsize(path) / elapsed / 1e6
+
+
+def legacy_screen_state(socket_file):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.settimeout(TIMEOUT)
+        client_socket.connect(socket_file)
+        client_socket.sendall(b"GET_SCREEN_STATE")
+        data = b""
+        while len(data) < 4 or len(data) < 4 + int.from_bytes(data[:4], "big"):
+            chunk = client_socket.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        client_socket.sendall(b"END")
+    return data
+
+
+def round_trips(session, runs):
+    output = session.run('echo SOCKET=""$AISHELL_SOCKET', PROMPT).decode(errors="replace")
+    socket_file = re.search(r"SOCKET=(/[^\s\x1b]+)", output).group(1)
+    results = {}
+    for name, request in (("get_screen_state_ms", lambda: legacy_screen_state(socket_file)),
+                          ("screen_op_ms", lambda: send_request(socket_file, {"op": "screen"}))):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            request()
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings) * 1000
+    return results
+
+
+def run(runs):
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+        f.write(cat_large(size=4 * 1024 * 1024))
+        path = f.name
+    configurations = {
+        "direct": [SHELL, "-i"],
+        "aishell": [sys.executable, "-m", "aishell.main", "-s", SHELL],
+        "aishell_parse_thread": [sys.executable, "-m", "aishell.main", "-s", SHELL, "--parse-thread"],
+    }
+    results = {}
+    try:
+        for name, argv in configurations.items():
+            session = Session(argv)
+            try:
+                result = {
+                    "echo_latency_ms": echo_latency(session, runs * 20) * 1000,
+                    "echo_during_cat_ms": echo_latency_during_burst(session, path, runs * 20) * 1000,
+                    "cat_mb_per_second": max(cat_throughput(session, path) for _ in range(runs)),
+                }
+                if name != "direct":
+                    result.update(round_trips(session, runs * 10))
+            finally:
+                session.close()
+            results[name] = result
+            print(f"{name:<22} " + ", ".join(f"{key} {value:.3f}" for key, value in result.items()))
+    finally:
+        os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure echo latency, throughput and socket round trips through aishell")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions of each measurement (default: 3)")
+    parser.add_argument("--output", "-o", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"pty": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
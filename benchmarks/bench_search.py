@@ -0,0 +1,79 @@
+"""
+Search index build rate and query latency.
+
+A `cat_large` transcript followed by the `compiler_output` one, over 200,000
+lines in all, is parsed by a HEIGHT x WIDTH parser, most of it scrolling out of
+the scrollback into the search index. Reported are how fast the waiting lines
+are indexed (as the I/O loop does while the session is idle) and the best of
+`--runs` times of each query, from selective literals to patterns no trigram
+can narrow down.
+
+    python benchmarks/bench_search.py [--runs N] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from aishell.terminal_parser import TerminalParser  # noqa: E402
+from transcripts import HEIGHT, WIDTH, cat_large, compiler_output  # noqa: E402
+
+CHUNK_SIZE = 65536
+
+# name -> (pattern, ignore_case)
+QUERIES = {
+    "literal_rare": ("00123456:", False),
+    "literal_common": ("gamma delta", False),
+    "regex_warning": (r"module_\d+\.c:\d+:\d+: warning", False),
+    "ignore_case": ("LIBAPP_19900", True),
+    "no_match": ("no such line", False),
+    "no_trigrams": (r"\d{8}: omega$", False),
+}
+
+
+def build():
+    term = TerminalParser(height=HEIGHT, width=WIDTH)
+    data = cat_large(12 * 1024 * 1024) + compiler_output()
+    for i in range(0, len(data), CHUNK_SIZE):
+        term.feed(data[i:i + CHUNK_SIZE])
+    return term
+
+
+def run(runs):
+    term = build()
+    start = time.perf_counter()
+    while term.catch_up_search_index():
+        pass
+    elapsed = time.perf_counter() - start
+    lines = len(term.search_index)
+    results = {"lines": lines, "index_lines_per_second": lines / elapsed, "queries_ms": {}}
+    print(f"indexed {lines} lines at {lines / elapsed:,.0f} lines/s")
+    for name, (pattern, ignore_case) in QUERIES.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            matches = term.search(pattern, limit=100, context=2, ignore_case=ignore_case)
+            timings.append(time.perf_counter() - start)
+        results["queries_ms"][name] = min(timings) * 1000
+        print(f"{name:<16} {min(timings) * 1000:8.2f} ms  {len(matches):3d} matches  {pattern!r}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure search index build rate and query latency")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per query (default: 3)")
+    parser.add_argument("--output", "-o", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"search": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Startup time of every console script declared in pyproject.toml.
+
+Each script is run in a fresh interpreter with `--help`, outside of AIShell and
+with the offline fake backend, which exercises its fast path: parse arguments
+and exit, or fail early because no AIShell socket exists.
+
+    python benchmarks/bench_startup.py [--runs N] [--output results.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def console_scripts():
+    with open(os.path.join(ROOT, "pyproject.toml")) as f:
+        text = f.read()
+    section = re.search(r'^\[project\.scripts\]\n(.*?)(?:^\[|\Z)', text, re.MULTILINE | re.DOTALL).group(1)
+    return dict(re.findall(r'^([\w-]+)\s*=\s*"([\w.]+:\w+)"', section, re.MULTILINE))
+
+
+def time_script(name, entry_point, runs):
+    module, function = entry_point.split(':')
+    code = f"import sys; sys.argv = [{name!r}, '--help']; from {module} import {function}; {function}()"
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"), AISHELL_BACKEND="fake")
+    for var in ("AISHELL_SOCKET", "AISHELL_ACTIVE", "AISHELL_SESSION_LOG"):
+        env.pop(var, None)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def baseline(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(runs):
+    results = {"python": statistics.median(baseline(runs))}
+    print(f"{'bare interpreter':<22} {results['python'] * 1000:7.1f} ms")
+    for name, entry_point in console_scripts().items():
+        results[name] = statistics.median(time_script(name, entry_point, runs))
+        print(f"{name:<22} {results[name] * 1000:7.1f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the aishell console scripts")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per script (default: 10)")
+    parser.add_argument("--output", "-o", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"startup_seconds": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Run every benchmark and save the results, optionally comparing them with an earlier run.
+
+Results are written as JSON to benchmarks/results/ (or `--output`), named after
+the time and the git commit, so runs before and after a change can be compared:
+
+    python benchmarks/run_all.py [--runs N] [--output results.json] [--compare earlier.json]
+
+With `--compare`, every metric is printed next to its earlier value, and
+changes for the worse by more than `--threshold` percent are flagged.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import bench_parser
+import bench_pty
+import bench_search
+import bench_startup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+BENCHMARKS = {
+    "startup_seconds": lambda runs: bench_startup.run(runs * 3),
+    "parser": bench_parser.run,
+    "pty": bench_pty.run,
+    "search": bench_search.run,
+}
+# Metrics where a bigger number is better; for everything else (times, memory) smaller is better
+HIGHER_IS_BETTER = ("mb_per_second", "lines_per_second")
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def flatten(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            metrics[prefix + key] = value
+    return metrics
+
+
+def compare(results, earlier, threshold):
+    current, previous = flatten(results), flatten(earlier)
+    regressions = 0
+    for name, value in current.items():
+        # Sizes of the inputs aren't measurements
+        if name not in previous or not previous[name] or name.endswith((".bytes", ".lines")):
+            continue
+        change = (value - previous[name]) / previous[name] * 100
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > threshold:
+            flag = "  <-- regression"
+            regressions += 1
+        print(f"{name:<55} {previous[name]:12.3f} -> {value:12.3f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the aishell benchmarks and save the results")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions of each measurement (default: 3)")
+    parser.add_argument("--output", "-o", type=str, help="Write the results to this file instead of benchmarks/results/")
+    parser.add_argument("--compare", "-c", type=str, help="Compare with the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percentage by which a metric may get worse before it is flagged (default: 10)")
+    parser.add_argument("--only", choices=BENCHMARKS, action="append", help="Run only this benchmark (repeatable)")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+    for name in args.only or BENCHMARKS:
+        print(f"== {name}")
+        results["results"][name] = BENCHMARKS[name](args.runs)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+        print(f"== compared with {earlier.get('commit')} ({earlier.get('date')})")
+        if compare(results["results"], earlier["results"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Synthetic pty transcripts for the benchmarks.
+
+Each function returns the raw bytes a terminal would receive for a typical
+session, built the way the real programs write their output, so runs are
+repeatable without recording anything on the machine running them:
+
+- `cat_large`: plain text scrolling past, as from `cat` on a big file
+- `compiler_output`: colored compiler diagnostics and build progress lines
+- `vim_session`: a full-screen editor on the alternate screen, redrawing and scrolling with scroll regions
+- `less_session`: a pager paging forward and back with reverse index
+- `fish_prompts`: fish prompts with SCS sequences, OSC 133 markers, right prompts and autosuggestions
+"""
+HEIGHT = 50
+WIDTH = 200
+
+WORDS = ("alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "lambda", "sigma", "omega")
+
+
+def text_line(i):
+    words = " ".join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(i % 12 + 3))
+    return f"{i:08d}: {words}"
+
+
+def cat_large(size=8 * 1024 * 1024):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = text_line(i) + "\r\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "".join(lines).encode()
+
+
+def compiler_output(units=20000):
+    out = []
+    for i in range(units):
+        percent = i * 100 // units
+        out.append(f"[{percent:3d}%] \x1b[32mBuilding C object src/CMakeFiles/app.dir/module_{i}.c.o\x1b[0m\r\n")
+        if i % 5 == 0:
+            out.append(f"\x1b[01m\x1b[Ksrc/module_{i}.c:{i % 300 + 1}:{i % 40 + 1}:\x1b[m\x1b[K "
+                       f"\x1b[01;35m\x1b[Kwarning: \x1b[m\x1b[Kunused variable '\x1b[01m\x1b[Ktmp_{i}\x1b[m\x1b[K' "
+                       f"[\x1b[01;35m\x1b[K-Wunused-variable\x1b[m\x1b[K]\r\n")
+            out.append(f"   {i % 300 + 1} |   int \x1b[01;35m\x1b[Ktmp_{i}\x1b[m\x1b[K = compute({i});\r\n")
+            out.append("      |       \x1b[01;35m\x1b[K^~~~~~\x1b[m\x1b[K\r\n")
+        if i % 100 == 0:
+            # A progress counter redrawn in place
+            for step in range(0, 101, 10):
+                out.append(f"\rLinking shared library libapp_{i}.so {step:3d}%\x1b[K")
+            out.append("\r\n")
+    return "".join(out).encode()
+
+
+def vim_session(redraws=400):
+    out = ["\x1b[?1049h\x1b[22;0;0t\x1b[?1h\x1b=\x1b[H\x1b[2J"]
+    for redraw in range(redraws):
+        # Full redraw of the text area, then the status line
+        out.append(f"\x1b[1;{HEIGHT - 1}r\x1b[H")
+        for row in range(HEIGHT - 1):
+            line = text_line(redraw + row)
+            out.append(f"\x1b[{row + 1};1H\x1b[33m{row + 1:4d} \x1b[m{line}\x1b[K")
+        out.append(f"\x1b[{HEIGHT};1H\x1b[7mfile_{redraw}.txt [+]\x1b[27m\x1b[K\x1b[{HEIGHT};{WIDTH - 20}H{redraw},1  Top")
+        # Scroll a few lines with the scroll region, as Ctrl-E does
+        for step in range(5):
+            out.append(f"\x1b[{HEIGHT - 1};1H\n\x1b[{HEIGHT - 1};1H\x1b[33m{step:4d} \x1b[m{text_line(step)}\x1b[K")
+        # Insert and delete lines, as `o` and `dd` do
+        out.append("\x1b[10;1H\x1b[L\x1b[34m~\x1b[m\x1b[20;1H\x1b[M\x1b[r")
+        # Type a word in insert mode
+        out.append("\x1b[15;6H\x1b[4@word")
+    out.append("\x1b[?1l\x1b>\x1b[?1049l")
+    return "".join(out).encode()
+
+
+def less_session(pages=300):
+    out = ["\x1b[?1049h\x1b[?1h\x1b=\r"]
+    for page in range(pages):
+        # Page forward: clear and redraw the screen
+        out.append("\x1b[H\x1b[2J")
+        for row in range(HEIGHT - 1):
+            out.append(text_line(page * HEIGHT + row) + "\r\n")
+        out.append("\x1b[7m:\x1b[27m\x1b[K")
+        # Scroll back a few lines, one reverse index each
+        for step in range(5):
+            out.append(f"\r\x1b[K\x1b[H\x1bM{text_line(page * HEIGHT - step)}\r\x1b[{HEIGHT};1H\x1b[7m:\x1b[27m\x1b[K")
+    out.append("\r\x1b[K\x1b[?1l\x1b>\x1b[?1049l")
+    return "".join(out).encode()
+
+
+def fish_prompts(commands=3000):
+    out = []
+    for i in range(commands):
+        command = f"git log --oneline -n {i % 50}"
+        out.append("\x1b]133;A\x07\x1b]0;fish ~/project\x07")
+        out.append("\x1b(B\x1b[m\x1b[32muser\x1b(B\x1b[m@host \x1b[32m~/project\x1b(B\x1b[m (main)> ")
+        # Right prompt, then back to the input position
+        out.append(f"\x1b[{WIDTH - 10}G\x1b[90m{i:02d}:00:00\x1b(B\x1b[m\r\x1b[27C\x1b]133;B\x07")
+        # Each keystroke redraws the input with the rest of the autosuggestion in grey
+        for end in range(1, len(command) + 1, 3):
+            out.append(f"\r\x1b[27C{command[:end]}\x1b[90m{command[end:]}\x1b(B\x1b[m\x1b[{len(command) - end}D")
+        out.append(f"\r\x1b[27C{command}\x1b[K\r\n\x1b]133;C\x07")
+        for line in range(i % 8):
+            out.append(f"\x1b[33m{i:07x}{line}\x1b[m {text_line(i + line)}\r\n")
+        out.append(f"\x1b]133;D;{1 if i % 3 == 0 else 0}\x07")
+    return "".join(out).encode()
+
+
+TRANSCRIPTS = {
+    "cat_large": cat_large,
+    "compiler_output": compiler_output,
+    "vim_session": vim_session,
+    "less_session": less_session,
+    "fish_prompts": fish_prompts,
+}
@@ -1,35 +1,75 @@
 import argparse
+import os
 import textwrap
+import threading
 import sys
-from .get_screen import get_screen_context
+from bisect import bisect_left, bisect_right
+from .get_screen import get_command, get_commands, get_screen_context, get_screen_lines, get_socket_file
+from .context import DEFAULT_TOKEN_BUDGET, build_context
+from .backends import describe_backend, get_backend
+from .cache import ResponseCache
 
-from openai import OpenAI
-client = OpenAI()
+SYSTEM_PROMPT = textwrap.dedent("""
+    You are a shell assistant that analyzes shell screen context and provides help.
+    Keep your response concise.
+    If the most recent commands failed, provide a one-line summary of the error message if the error is not obvious. And then provide a fix or debugging hints.
+    If there is no error and you are not sure what to do, wait for the next prompt.
+    Note: the lastest command in the context is the command that triggered this conversation. Ignore it.
+""").strip()
 
+# Runs of these are in the command history too, but they are never what the user is asking about
+HELP_COMMANDS = ('aishell-help', 'aishell-quick-help')
 
-def chat(message, interactive=True):
-    system_content = textwrap.dedent("""
-        You are a shell assistant that analyzes shell screen context and provides help.
-        Keep your response concise.
-        If the most recent commands failed, provide a one-line summary of the error message if the error is not obvious. And then provide a fix or debugging hints.
-        If there is no error and you are not sure what to do, wait for the next prompt.
-        Note: the lastest command in the context is the command that triggered this conversation. Ignore it.
-    """).strip()
 
+def print_stream(chunks):
+    """Print chunks as they arrive and return the whole response."""
+    response = []
+    for chunk in chunks:
+        print(chunk, end="", flush=True)
+        response.append(chunk)
+    print()
+    return "".join(response)
+
+
+async def aprint_stream(chunks):
+    response = []
+    async for chunk in chunks:
+        print(chunk, end="", flush=True)
+        response.append(chunk)
+    print()
+    return "".join(response)
+
+
+def chat(message, interactive=True, backend=None, cache=None, cache_subject=None):
+    """
+    Ask about `message`, optionally continuing as a conversation.
+
+    `backend` is a Backend or a function returning one, which is only called once the
+    backend is needed. If a ResponseCache is given, the first answer is looked up in
+    and saved to it, keyed on `cache_subject` (by default the message itself).
+    """
     messages=[
-        {"role": "system", "content": system_content},
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": message},
     ]
-    while True:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
-        assistant_response = completion.choices[0].message.content
+    cache_key = cache.key(cache_subject or message, SYSTEM_PROMPT, describe_backend()) if cache else None
+    assistant_response = cache.get(cache_key) if cache else None
+    if assistant_response is not None:
         print(assistant_response)
+    while True:
+        if assistant_response is None:
+            if backend is None:
+                backend = get_backend()
+            elif callable(backend):
+                backend = backend()
+            assistant_response = print_stream(backend.stream(messages))
+            if cache_key:
+                cache.put(cache_key, assistant_response)
+                cache_key = None
         if not interactive:
             break
         messages.append({"role": "assistant", "content": assistant_response})
+        assistant_response = None
         try:
             next_prompt = input("> ")
             messages.append({"role": "user", "content": next_prompt})
@@ -38,21 +78,113 @@ def chat(message, interactive=True):
             break
 
 
+async def achat(message, interactive=True, backend=None):
+    """Async version of `chat`, for use from an event loop."""
+    import asyncio
+    backend = backend or get_backend()
+    loop = asyncio.get_running_loop()
+    messages=[
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": message},
+    ]
+    while True:
+        assistant_response = await aprint_stream(backend.astream(messages))
+        if not interactive:
+            break
+        messages.append({"role": "assistant", "content": assistant_response})
+        try:
+            next_prompt = await loop.run_in_executor(None, input, "> ")
+            messages.append({"role": "user", "content": next_prompt})
+        except (EOFError, KeyboardInterrupt):
+            print("\nExiting chat...")
+            break
+
+
+def is_help_command(command):
+    # Skip environment assignments like `AISHELL_MODEL=... aishell-help`
+    words = [word for word in (command or '').split() if '=' not in word]
+    return bool(words) and os.path.basename(words[0]) in HELP_COMMANDS
+
+
+def get_focus_command():
+    """The most recent finished command other than aishell-help, with its output, or None."""
+    for command in reversed(get_commands()):
+        if command['output_end'] is not None and not is_help_command(command['command']):
+            return get_command(command['id'])
+    return None
+
+
+def get_budgeted_context(line_limit, budget, command=None):
+    """Fit the last `line_limit` lines of the screen into `budget` tokens, keeping `command` and its output first."""
+    numbers, lines = get_screen_lines(line_limit)
+    focus = None
+    if command and command['output_end'] is not None:
+        # Row numbers are absolute; the command line sits just above its output, and may have wrapped
+        start = max(bisect_right(numbers, command['output_start'] - 1) - 1, 0)
+        focus = (start, bisect_left(numbers, command['output_end']))
+    return build_context(lines, budget, focus)
+
+
+def load_backend_in_background():
+    """
+    Create the chat backend (importing its SDK and building the client) on another thread.
+
+    Returns a function that waits for the backend and returns it, so the caller can
+    fetch the screen context in the meantime.
+    """
+    result = {}
+
+    def load():
+        try:
+            result['backend'] = get_backend()
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+
+    def wait():
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['backend']
+    return wait
+
+
 def main():
     """
     Look at shell context and provide a fix
     """
     parser = argparse.ArgumentParser(description="Analyze AIShell screen context and provide help")
-    parser.add_argument("--lines", type=int, default=20,
-                        help="Last N lines to feed to the AI. Default: 20. Set <=0 to disable.\n"
+    parser.add_argument("--lines", type=int, default=200,
+                        help="Last N lines to choose the context from. Default: 200. Set <=0 to disable.\n"
                         "Aishell only has context up till the most recent ctrl+L (clear screen).")
+    parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f"Approximate number of tokens of context to send. Default: {DEFAULT_TOKEN_BUDGET}.\n"
+                        "Repeated and progress lines are collapsed, and the most recent command and errors are kept first.\n"
+                        "Set <=0 to send the last --lines lines as they are.")
     parser.add_argument("--interactive", "-i", action="store_true", help="Interactive mode. Default: False.")
+    parser.add_argument("--no-cache", action="store_true", help="Always ask the AI, even if the same context was answered before.")
     args = parser.parse_args()
 
 
     try:
-        context = get_screen_context(args.lines)
-        chat(f'command to that triggered this conversation: {" ".join(sys.argv)} Shell context:\n{context}', args.interactive)
+        # Fail fast outside AIShell, before paying for loading the backend
+        get_socket_file()
+        wait_for_backend = load_backend_in_background()
+        command = get_focus_command()
+        if args.budget > 0:
+            context = get_budgeted_context(args.lines, args.budget, command)
+        else:
+            context = get_screen_context(args.lines)
+        cache = None if args.no_cache else ResponseCache()
+        # Asking again puts the previous run and its answer on the screen, so the answer is cached
+        # on the command it is about rather than on the whole context
+        cache_subject = None
+        if command:
+            cache_subject = f"$ {command['command']}\n[exit status {command['exit_status']}]\n{command['output']}"
+        chat(f'command to that triggered this conversation: {" ".join(sys.argv)} Shell context:\n{context}', args.interactive,
+             wait_for_backend, cache, cache_subject)
     except Exception as e:
         print(f"Error: {e}")
 
@@ -66,10 +198,11 @@ def quick_help():
     shell might complain if you have quotes or double quotes in your question.
     You can avoid this by running this command without a <question> argument to start a session.
     """
+    wait_for_backend = load_backend_in_background()
     message = " ".join(sys.argv[1:])
     if not message:
         message = input("Enter your message: ")
-    chat(message, interactive=False)
+    chat(message, interactive=False, backend=wait_for_backend())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
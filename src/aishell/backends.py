@@ -0,0 +1,123 @@
+"""
+Chat completion backends used by aishell-help.
+
+A backend turns a list of chat messages into a stream of text chunks, both
+synchronously (`stream`) and asynchronously (`astream`). Pick one with the
+AISHELL_BACKEND environment variable (default: openai).
+
+Backend SDKs are imported when a backend is created, not when this module is,
+so commands that never reach a backend don't pay for importing them.
+"""
+import os
+import time
+
+BACKEND_ENV_VAR = "AISHELL_BACKEND"
+MODEL_ENV_VAR = "AISHELL_MODEL"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+class Backend:
+    def __init__(self, model=None):
+        self.model = model or os.environ.get(MODEL_ENV_VAR, DEFAULT_MODEL)
+
+    def stream(self, messages):
+        """Yield the response to `messages` as text chunks as soon as they are generated."""
+        raise NotImplementedError
+
+    async def astream(self, messages):
+        """Async version of `stream`. By default runs `stream` on a worker thread."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        chunks = iter(self.stream(messages))
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+
+
+class OpenAIBackend(Backend):
+    def __init__(self, model=None):
+        super().__init__(model)
+        from openai import OpenAI
+        self.client = OpenAI()
+        self.async_client = None
+
+    def stream(self, messages):
+        response = self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def astream(self, messages):
+        if self.async_client is None:
+            from openai import AsyncOpenAI
+            self.async_client = AsyncOpenAI()
+        response = await self.async_client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeBackend(Backend):
+    """
+    Offline backend that streams a canned answer word by word, for tests and development.
+
+    The answer and the delay between words can be set with AISHELL_FAKE_RESPONSE and AISHELL_FAKE_DELAY.
+    """
+    def __init__(self, model=None, response=None, delay=None):
+        super().__init__(model or "fake")
+        self.response = response or os.environ.get("AISHELL_FAKE_RESPONSE")
+        self.delay = float(os.environ.get("AISHELL_FAKE_DELAY", 0)) if delay is None else delay
+        self.requests = []
+
+    def answer(self, messages):
+        self.requests.append(messages)
+        if self.response:
+            return self.response
+        return f"You said: {messages[-1]['content']}"
+
+    def words(self, messages):
+        text = self.answer(messages)
+        start = 0
+        while start < len(text):
+            end = text.find(' ', start + 1)
+            end = len(text) if end == -1 else end
+            yield text[start:end]
+            start = end
+
+    def stream(self, messages):
+        for word in self.words(messages):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word
+
+    async def astream(self, messages):
+        import asyncio
+        for word in self.words(messages):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeBackend,
+}
+
+
+def get_backend_name(name=None):
+    return name or os.environ.get(BACKEND_ENV_VAR, "openai")
+
+
+def describe_backend(name=None, model=None):
+    """Name the backend and model `get_backend` would use, without creating it."""
+    return f"{get_backend_name(name)}:{model or os.environ.get(MODEL_ENV_VAR, DEFAULT_MODEL)}"
+
+
+def get_backend(name=None, model=None):
+    name = get_backend_name(name)
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown backend {name!r}, expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model)
@@ -0,0 +1,383 @@
+"""
+Broker: one local process that knows every AIShell session started with `--daemon`.
+
+Each session connects to the broker socket, registers itself and keeps the
+connection open. The broker then uses that connection to pass requests on to
+the session's own server, so it never opens connections of its own and a
+session disappears from the registry as soon as its connection closes.
+
+Requests to the broker use the framed protocol (see protocol.py):
+
+- `{"op": "sessions"}` - the registered sessions
+- `{"op": "search", "pattern": P, "context": N}` - search every session's screen and scrollback
+- any session request with a `"session": ID` field - passed on to that session and answered by it
+
+    aishell-broker [--socket PATH] [--exit-when-idle SECONDS]
+    aishell-sessions [--screen ID] [--search PATTERN]
+"""
+import argparse
+import fcntl
+import os
+import select
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from .protocol import FrameReader, ProtocolError, check_response, decode_frame, encode_frame, send_request
+from .search import format_match
+from .server import ClientConnection, start_socket_server
+
+BROKER_SOCKET_ENV_VAR = "AISHELL_BROKER_SOCKET"
+SESSION_ID_ENV_VAR = "AISHELL_SESSION_ID"
+# A broker started by a session exits once it has had no sessions for this many seconds
+AUTO_EXIT_SECONDS = 60
+START_TIMEOUT = 3
+# Seconds a search of every session waits for answers; sessions that haven't answered by then are reported as timed out
+FAN_OUT_TIMEOUT = 5
+
+
+def default_broker_socket():
+    if os.environ.get(BROKER_SOCKET_ENV_VAR):
+        return os.environ[BROKER_SOCKET_ENV_VAR]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "aishell", "broker.sock")
+    return os.path.join(tempfile.gettempdir(), f"aishell-{os.getuid()}", "broker.sock")
+
+
+def check_socket_directory(socket_file):
+    """
+    Create the directory of `socket_file` if needed and make sure it is private to this user.
+
+    The broker relays every session's screen, so a directory that someone else owns or can
+    write to (say a `/tmp/aishell-UID` created by another user first) is refused.
+    """
+    directory = os.path.dirname(os.path.abspath(socket_file))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise RuntimeError(f"Refusing to use {directory} for the broker socket: "
+                           f"it must be a directory owned by you with mode 0700")
+
+
+class SessionLink:
+    """A registered session, and the callbacks waiting for its responses, which arrive in request order."""
+    def __init__(self, client, info):
+        self.client = client
+        self.info = info
+        self.waiting = []
+
+
+class FanOut:
+    """
+    Collects one response per session and answers the client once all of them are in,
+    or at `deadline`, with a timeout error for the sessions still missing.
+    """
+    def __init__(self, broker, client, sessions):
+        self.broker = broker
+        self.client = client
+        # session id -> info of the sessions that haven't answered yet
+        self.pending = dict(sessions)
+        self.results = []
+        self.deadline = time.monotonic() + FAN_OUT_TIMEOUT
+        self.done = False
+        if not self.pending:
+            self.finish()
+
+    def add(self, session_id, info, response):
+        if self.done:
+            # Too late, the client already has its answer
+            return
+        self.results.append({'session': session_id, 'info': info, **response})
+        self.pending.pop(session_id, None)
+        if not self.pending:
+            self.finish()
+
+    def expire(self, now):
+        if not self.done and now >= self.deadline:
+            for session_id, info in list(self.pending.items()):
+                self.add(session_id, info, {'ok': False, 'error': 'timeout'})
+
+    def finish(self):
+        self.done = True
+        self.results.sort(key=lambda result: result['info'].get('started', 0))
+        self.broker.reply(self.client, {'ok': True, 'results': self.results})
+
+
+class Broker:
+    def __init__(self, socket_file, exit_when_idle=None):
+        self.socket_file = socket_file
+        self.exit_when_idle = exit_when_idle
+        check_socket_directory(socket_file)
+        # Only one broker per socket: a second one would take the socket over from the first
+        self.lock_file = open(socket_file + ".lock", "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise RuntimeError(f"A broker is already running on {socket_file}") from None
+        self.server_socket = start_socket_server(socket_file)
+        self.clients = {}
+        self.sessions = {}
+        self.fan_outs = []
+        self.idle_since = time.monotonic()
+
+    def serve_forever(self):
+        try:
+            while True:
+                writers = [sock for sock, client in self.clients.items() if client.outbuf]
+                timeout = 1.0 if self.exit_when_idle else None
+                if self.fan_outs:
+                    until = max(min(fan_out.deadline for fan_out in self.fan_outs) - time.monotonic(), 0)
+                    timeout = until if timeout is None else min(timeout, until)
+                readable, writable, _ = select.select([self.server_socket, *self.clients], writers, [], timeout)
+                for sock in readable:
+                    if sock is self.server_socket:
+                        self.accept()
+                    elif sock in self.clients:
+                        self.read(self.clients[sock])
+                for sock in writable:
+                    if sock in self.clients:
+                        self.write(self.clients[sock])
+                self.expire_fan_outs()
+                if self.sessions:
+                    self.idle_since = time.monotonic()
+                elif self.exit_when_idle and time.monotonic() - self.idle_since > self.exit_when_idle:
+                    return
+        finally:
+            self.shutdown()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            client = ClientConnection(sock)
+            # Set once the client registers as a session
+            client.link = None
+            self.clients[sock] = client
+
+    def read(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close(client)
+            return
+        client.inbuf += data
+        while client.sock in self.clients:
+            try:
+                _, message, client.inbuf = decode_frame(client.inbuf)
+                if message is None:
+                    break
+                link = client.link
+                if link:
+                    # A response from a session, to the oldest request still waiting on it
+                    if link.waiting:
+                        link.waiting.pop(0)(message)
+                elif isinstance(message, dict):
+                    self.handle_request(client, message)
+                else:
+                    self.reply(client, {'ok': False, 'error': "Request must be a JSON object"})
+            except Exception as e:
+                # Bad frames, deeply nested JSON, odd field types: drop this client, keep serving the rest
+                client.inbuf = b""
+                client.send(encode_frame({'ok': False, 'error': f"Request failed: {type(e).__name__}: {e}"}), close=True)
+                break
+        self.write(client)
+
+    def handle_request(self, client, request):
+        op = request.get('op')
+        if op == 'register':
+            session_id = str(request.get('session') or f"{request.get('pid')}")
+            if session_id in self.sessions:
+                self.reply(client, {'ok': False, 'error': f"Session {session_id} is already registered"})
+                return
+            info = {key: value for key, value in request.items() if key != 'op'}
+            info['session'] = session_id
+            client.link = SessionLink(client, info)
+            self.sessions[session_id] = client.link
+            self.reply(client, {'ok': True, 'session': session_id})
+        elif op == 'sessions':
+            self.reply(client, {'ok': True, 'sessions': [link.info for link in self.sessions.values()]})
+        elif op == 'search' and 'session' not in request:
+            self.fan_out(client, request)
+        elif 'session' in request:
+            link = self.sessions.get(str(request['session']))
+            if link is None:
+                self.reply(client, {'ok': False, 'error': f"No session {request['session']}"})
+            elif op == 'subscribe':
+                self.reply(client, {'ok': False, 'error': "Subscribe to the session's own socket instead"})
+            else:
+                forwarded = {key: value for key, value in request.items() if key != 'session'}
+                self.forward(link, forwarded, lambda response: self.reply(client, response))
+        else:
+            self.reply(client, {'ok': False, 'error': f"Unknown op: {op} (pass a session to query one)"})
+
+    def forward(self, link, request, callback):
+        link.waiting.append(callback)
+        link.client.send(encode_frame(request))
+        self.write(link.client)
+
+    def fan_out(self, client, request):
+        fan_out = FanOut(self, client, {session_id: link.info for session_id, link in self.sessions.items()})
+        for session_id, link in list(self.sessions.items()):
+            self.forward(link, request, lambda response, session_id=session_id, info=link.info:
+                         fan_out.add(session_id, info, response))
+        if not fan_out.done:
+            self.fan_outs.append(fan_out)
+
+    def expire_fan_outs(self):
+        now = time.monotonic()
+        for fan_out in self.fan_outs:
+            fan_out.expire(now)
+        self.fan_outs = [fan_out for fan_out in self.fan_outs if not fan_out.done]
+
+    def reply(self, client, response):
+        if client.sock in self.clients:
+            client.send(encode_frame(response))
+            self.write(client)
+
+    def write(self, client):
+        if client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.close(client)
+                return
+            del client.outbuf[:sent]
+        if client.close_when_sent and not client.outbuf:
+            self.close(client)
+
+    def close(self, client):
+        if self.clients.pop(client.sock, None) is None:
+            return
+        client.sock.close()
+        link = client.link
+        if link:
+            self.sessions.pop(link.info['session'], None)
+            for callback in link.waiting:
+                callback({'ok': False, 'error': f"Session {link.info['session']} ended"})
+            link.waiting.clear()
+
+    def shutdown(self):
+        for client in list(self.clients.values()):
+            self.close(client)
+        self.server_socket.close()
+        if os.path.exists(self.socket_file):
+            os.remove(self.socket_file)
+        self.lock_file.close()
+
+
+def start_broker(socket_file):
+    """Start a broker in the background that exits when it has had no sessions for a while."""
+    subprocess.Popen([sys.executable, "-m", "aishell.broker", "--socket", socket_file,
+                      "--exit-when-idle", str(AUTO_EXIT_SECONDS)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def connect(socket_file, start=False):
+    deadline = time.monotonic() + START_TIMEOUT
+    started = False
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_file)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if not start or time.monotonic() > deadline:
+                raise
+            if not started:
+                start_broker(socket_file)
+                started = True
+            time.sleep(0.05)
+
+
+def register_session(info, socket_file=None):
+    """
+    Register a session with the broker, starting one if none is running.
+
+    Returns the connected socket, which the session's ScreenServer must then adopt
+    to answer the requests the broker passes on.
+    """
+    socket_file = socket_file or default_broker_socket()
+    check_socket_directory(socket_file)
+    sock = connect(socket_file, start=True)
+    sock.settimeout(START_TIMEOUT)
+    try:
+        sock.sendall(encode_frame({'op': 'register', **info}))
+        check_response(FrameReader(sock).read())
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def broker_request(request, socket_file=None, timeout=10):
+    socket_file = socket_file or default_broker_socket()
+    check_socket_directory(socket_file)
+    return send_request(socket_file, request, timeout=timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the broker that AIShell sessions started with --daemon register with")
+    parser.add_argument("--socket", default=default_broker_socket(), help="Socket to listen on (default: %(default)s)")
+    parser.add_argument("--exit-when-idle", type=float, metavar="SECONDS",
+                        help="Exit after having had no sessions for this long (default: run until killed)")
+    args = parser.parse_args()
+    try:
+        broker = Broker(args.socket, exit_when_idle=args.exit_when_idle)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def format_session(info):
+    started = time.strftime("%H:%M:%S", time.localtime(info.get('started', 0)))
+    return f"{info['session']:>8}  {started}  {info.get('tty') or '-':<12} {info.get('shell', ''):<12} {info.get('cwd', '')}"
+
+
+def sessions_main():
+    parser = argparse.ArgumentParser(description="List and query the AIShell sessions registered with the broker")
+    parser.add_argument("--screen", metavar="ID", help="Print the screen of this session")
+    parser.add_argument("--lines", "-n", type=int, default=50, help="Lines to print with --screen (default: 50)")
+    parser.add_argument("--search", metavar="PATTERN", help="Search the output of every session for a regular expression")
+    parser.add_argument("--context", "-C", type=int, default=0, help="Lines of context to show around search matches")
+    parser.add_argument("--ignore-case", "-i", action="store_true", help="Search case-insensitively")
+    args = parser.parse_args()
+
+    try:
+        if args.screen:
+            print(broker_request({'op': 'screen', 'session': args.screen, 'lines': args.lines})['text'])
+        elif args.search:
+            response = broker_request({'op': 'search', 'pattern': args.search, 'context': args.context,
+                                       'ignore_case': args.ignore_case})
+            for result in response['results']:
+                if not result.get('ok'):
+                    print(f"{result['session']}: Error: {result.get('error')}")
+                    continue
+                for match in reversed(result['matches']):
+                    print(format_match(match, prefix=f"{result['session']}:"))
+        else:
+            for info in broker_request({'op': 'sessions'})['sessions']:
+                print(format_session(info))
+    except (OSError, RuntimeError, ProtocolError) as e:
+        print(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+On-disk cache of aishell-help answers.
+
+Entries are keyed on a hash of what was asked about (normalized), the system
+prompt and the backend/model, and stored one JSON file per entry. Reading an entry
+refreshes its modification time, which is what least-recently-used eviction
+goes by; entries older than the TTL are never served.
+"""
+import hashlib
+import json
+import os
+import time
+
+CACHE_DIR_ENV_VAR = "AISHELL_CACHE_DIR"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+
+def default_cache_dir():
+    if os.environ.get(CACHE_DIR_ENV_VAR):
+        return os.path.expanduser(os.environ[CACHE_DIR_ENV_VAR])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "aishell", "responses")
+
+
+def normalize_context(text):
+    """Drop trailing whitespace and blank lines, which don't change the question."""
+    return "\n".join(line.rstrip() for line in text.splitlines() if line.strip())
+
+
+class ResponseCache:
+    def __init__(self, directory=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def key(self, context, system_prompt, model):
+        payload = json.dumps([normalize_context(context), system_prompt, model])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('created', 0) > self.ttl:
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get('response')
+
+    def put(self, key, response):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'created': time.time(), 'response': response}, f)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until the cache fits its limits."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self.remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop()
+            total_bytes -= size
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
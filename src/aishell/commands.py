@@ -0,0 +1,127 @@
+import re
+import time
+from collections import deque
+
+DEFAULT_COMMAND_HISTORY = 1000
+
+# Everything up to the end of a typical prompt ("user@host:~$ ", "% ", "❯ ", ...) on a command line
+PROMPT_REGEX = re.compile(r'^.*?[$#%>❯»] ')
+# A line holding nothing but a prompt
+BARE_PROMPT_REGEX = re.compile(r'[$#%>❯»]\s*$')
+# Output that suggests a command failed, for shells that don't report exit statuses
+ERROR_REGEX = re.compile(r'error|failed|fatal|traceback|exception|not found|no such file|permission denied', re.IGNORECASE)
+
+
+class CommandRecord:
+    def __init__(self, command_id, command, output_start):
+        self.id = command_id
+        # Without shell integration the command is read back from the row above the output,
+        # since typed input may not have been echoed yet when Enter is pressed
+        self.command = command
+        # Absolute row numbers of the command's output, `output_end` is exclusive and None while it runs
+        self.output_start = output_start
+        self.output_end = None
+        self.exit_status = None
+        self.failed = None
+        self.started = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'command': self.command,
+            'output_start': self.output_start,
+            'output_end': self.output_end,
+            'exit_status': self.exit_status,
+            'failed': self.failed,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class CommandHistory:
+    """
+    Segments the output stream into commands.
+
+    With shell integration (OSC 133 prompt markers, as emitted by fish, VS Code,
+    iTerm2 and WezTerm shell integration scripts) the boundaries and exit statuses
+    come from the shell. Otherwise every Enter typed at the terminal starts a new
+    command, and a command counts as failed when its output looks like an error.
+
+    Records are kept in submission order with an index by id and a pointer to
+    the most recent failure, so looking up "the last failed command" is O(1).
+    """
+    def __init__(self, limit=DEFAULT_COMMAND_HISTORY):
+        self.records = deque(maxlen=limit)
+        self.by_id = {}
+        self.last_id = 0
+        self.current = None
+        self.last_failed = None
+        self.shell_integration = False
+        self.input_start = None
+        # Called as listener(event, record) with event 'start' or 'finish'
+        self.listeners = []
+
+    def start(self, command, output_start):
+        self.last_id += 1
+        record = CommandRecord(self.last_id, command, output_start)
+        if len(self.records) == self.records.maxlen:
+            del self.by_id[self.records[0].id]
+        self.records.append(record)
+        self.by_id[record.id] = record
+        self.current = record
+        self.notify('start', record)
+        return record
+
+    def finish(self, output_end, exit_status=None, output=None):
+        record = self.current
+        if record is None:
+            return None
+        self.current = None
+        record.output_end = max(output_end, record.output_start)
+        record.finished = time.time()
+        record.exit_status = exit_status
+        if exit_status is not None:
+            record.failed = exit_status != 0
+        elif output is not None:
+            record.failed = any(ERROR_REGEX.search(line) for line in output)
+        if record.failed:
+            self.last_failed = record
+        self.notify('finish', record)
+        return record
+
+    def notify(self, event, record):
+        for listener in self.listeners:
+            listener(event, record)
+
+    def get(self, which):
+        """Look up a record by id, or by one of the names 'last', 'last_finished' and 'last_failed'."""
+        if which == 'last':
+            return self.records[-1] if self.records else None
+        if which == 'last_finished':
+            for record in reversed(self.records):
+                if record.finished is not None:
+                    return record
+            return None
+        if which == 'last_failed':
+            if self.last_failed and self.last_failed.id in self.by_id:
+                return self.last_failed
+            return None
+        return self.by_id.get(int(which))
+
+    def finished_since(self, command_id):
+        """Return the finished records with an id greater than `command_id`, oldest first."""
+        records = []
+        for record in reversed(self.records):
+            if record.id <= command_id:
+                break
+            if record.finished is not None:
+                records.append(record)
+        return records[::-1]
+
+    def strip_prompt(self, line):
+        match = PROMPT_REGEX.match(line + ' ')
+        return (line + ' ')[match.end():].strip() if match else line.strip()
+
+    def is_bare_prompt(self, line):
+        return bool(BARE_PROMPT_REGEX.search(line))
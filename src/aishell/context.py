@@ -0,0 +1,128 @@
+"""
+Build the shell context sent to the AI within a token budget.
+
+Lines are cleaned and compressed first: control characters are stripped, runs
+of repeated or near-identical lines (progress bars, download counters, the same
+warning over and over) collapse to their first and last line, and very long
+lines are cut in the middle. Then lines are picked by priority until the budget
+is spent: the most recent command and its output first, error lines next, and
+otherwise the most recent lines. The picked lines are shown in their original
+order, with markers where lines were left out.
+"""
+import re
+
+from .commands import ERROR_REGEX
+
+DEFAULT_TOKEN_BUDGET = 1000
+# Rough size of a token in characters, for English text and shell output
+CHARS_PER_TOKEN = 4
+# Runs of at least this many similar lines are collapsed
+MIN_COLLAPSED_RUN = 3
+
+CONTROL_REGEX = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+DIGITS_REGEX = re.compile(r'\d+')
+# Characters progress bars are drawn with
+BAR_REGEX = re.compile(r'[#=*>█▉▊▋▌▍▎▏░▒▓━─-]+')
+SPACES_REGEX = re.compile(r'\s+')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def line_shape(line):
+    # Lines that only differ in numbers, bars and spacing (counters, percentages, timings) share a shape
+    return SPACES_REGEX.sub(' ', BAR_REGEX.sub('', DIGITS_REGEX.sub('0', line))).strip()
+
+
+def truncate_line(line, max_chars):
+    if len(line) <= max_chars:
+        return line
+    keep = max(max_chars // 2 - 10, 1)
+    return f"{line[:keep]} …[{len(line) - 2 * keep} chars]… {line[-keep:]}"
+
+
+def compress_lines(lines, max_line_chars):
+    """
+    Clean and compress `lines`, returning `(index, text)` entries.
+
+    `index` is the position of the (first) original line an entry stands for, so
+    callers can still tell which entries came from which lines.
+    """
+    entries = []
+    i = 0
+    while i < len(lines):
+        line = CONTROL_REGEX.sub('', lines[i]).rstrip()
+        if not line.strip():
+            i += 1
+            continue
+        shape = line_shape(line)
+        end = i + 1
+        while end < len(lines) and line_shape(CONTROL_REGEX.sub('', lines[end])) == shape:
+            end += 1
+        if end - i >= MIN_COLLAPSED_RUN:
+            last = CONTROL_REGEX.sub('', lines[end - 1]).rstrip()
+            entries.append((i, truncate_line(line, max_line_chars)))
+            if last == line:
+                entries.append((i + 1, f"[line repeated {end - i - 1} more times]"))
+            else:
+                entries.append((i + 1, f"[... {end - i - 2} similar lines ...]"))
+                entries.append((end - 1, truncate_line(last, max_line_chars)))
+            i = end
+        else:
+            entries.append((i, truncate_line(line, max_line_chars)))
+            i += 1
+    return entries
+
+
+def build_context(lines, budget=DEFAULT_TOKEN_BUDGET, focus=None):
+    """
+    Select from `lines` (oldest first) what fits in `budget` tokens and return it as text.
+
+    `focus` is an optional `(start, end)` range of indices into `lines` holding the
+    most recent command (its command line first) and its output, which is kept first.
+    """
+    entries = compress_lines(lines, max_line_chars=max(budget * CHARS_PER_TOKEN // 4, 80))
+    if not entries:
+        return ""
+
+    def priority(position):
+        index, text = entries[position]
+        score = position / len(entries)
+        if focus and focus[0] <= index < focus[1]:
+            score += 2
+            if index == focus[0]:
+                score += 2
+        if ERROR_REGEX.search(text):
+            score += 1
+        return score
+
+    chosen = set()
+    seen = set()
+    used = 0
+    for position in sorted(range(len(entries)), key=priority, reverse=True):
+        index, text = entries[position]
+        in_focus = focus and focus[0] <= index < focus[1]
+        cost = estimate_tokens(text)
+        # An exact repeat of a line already picked adds nothing, unless it belongs to the focused command
+        if used + cost > budget or (text in seen and not in_focus):
+            continue
+        chosen.add(position)
+        seen.add(text)
+        used += cost
+
+    # An entry stands for the original lines from its index up to the next entry's; the last one, up to the last line with text
+    end = len(lines)
+    while not CONTROL_REGEX.sub('', lines[end - 1]).strip():
+        end -= 1
+    starts = [index for index, _ in entries] + [end]
+
+    output = []
+    previous = -1
+    for position in sorted(chosen) + [len(entries)]:
+        if position != previous + 1:
+            output.append(f"[... {starts[position] - starts[previous + 1]} lines omitted ...]")
+        if position < len(entries):
+            output.append(entries[position][1])
+        previous = position
+    return "\n".join(output)
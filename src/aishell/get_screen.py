@@ -1,51 +1,178 @@
 import os
-import socket
 import argparse
 
-def get_screen_context(line_limit=None):
+from .protocol import send_request, subscribe
+
+def get_socket_file():
     socket_file = os.environ.get("AISHELL_SOCKET")
     if not socket_file:
         raise RuntimeError("AIShell socket not found. Make sure AIShell is running.")
+    return socket_file
+
+def get_screen_context(line_limit=None):
+    socket_file = get_socket_file()
+    request = {'op': 'screen'}
+    if line_limit and line_limit > 0:
+        # Let the server cut the screen down so only the requested lines are transferred
+        request['lines'] = line_limit
+    try:
+        return send_request(socket_file, request)['text']
+    except Exception as e:
+        raise RuntimeError(f"Error connecting to AIShell socket: {e}")
 
+def get_screen_lines(line_limit=None):
+    """
+    Return `(numbers, lines)` for the last `line_limit` rows of the screen (or all of them), with rows
+    that wrapped joined back into the lines that were printed, and the absolute row number each line starts on.
+    """
+    request = {'op': 'rows', 'last': line_limit} if line_limit and line_limit > 0 else {'op': 'rows', 'start': 0}
     try:
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect(socket_file)
-            client_socket.sendall(b"GET_SCREEN_STATE")
-            client_socket.settimeout(5)
-
-            length_bytes = client_socket.recv(4)
-            length = int.from_bytes(length_bytes, byteorder='big')
-
-            response = b""
-            while len(response) < length:
-                try:
-                    chunk = client_socket.recv(min(4096, length - len(response)))
-                    if not chunk:
-                        break
-                    response += chunk
-                except socket.timeout:
-                    raise TimeoutError("Timeout while receiving data")
-
-            response_text = response.decode('utf-8')
-            client_socket.sendall(b"END")
-
-            if line_limit and line_limit > 0:
-                lines = response_text.split('\n')
-                return '\n'.join(lines[-line_limit:])
-            return response_text
+        response = send_request(get_socket_file(), request)
+    except Exception as e:
+        raise RuntimeError(f"Error connecting to AIShell socket: {e}")
+    return join_wrapped_rows(response['first'], response['rows'], response.get('wrapped', []))
+
+def join_wrapped_rows(first, rows, wrapped):
+    """Join `rows`, numbered from `first`, with the rows they continue on; `wrapped` holds the numbers of rows that continue."""
+    wrapped = set(wrapped)
+    numbers = []
+    lines = []
+    for number, row in enumerate(rows, first):
+        if number - 1 in wrapped and lines:
+            lines[-1] += row
+        else:
+            numbers.append(number)
+            lines.append(row)
+    return numbers, lines
+
+def get_command(which='last'):
+    """
+    Return a recorded command with its output: `which` is a command id, 'last', 'last_finished' or 'last_failed'.
+
+    Returns None if there is no such command.
+    """
+    try:
+        return send_request(get_socket_file(), {'op': 'command', 'which': which})['command']
+    except Exception as e:
+        raise RuntimeError(f"Error connecting to AIShell socket: {e}")
 
+def get_commands(limit=20):
+    """Return the last `limit` recorded commands, oldest first, without their output."""
+    try:
+        return send_request(get_socket_file(), {'op': 'commands', 'limit': limit})['commands']
     except Exception as e:
         raise RuntimeError(f"Error connecting to AIShell socket: {e}")
 
+def open_session_log(path=None):
+    # Imported here: it pulls in the terminal parser, which reading the live screen doesn't need
+    from .session_log import SESSION_LOG_ENV_VAR, SessionLogReader
+    path = path or os.environ.get(SESSION_LOG_ENV_VAR)
+    if not path:
+        raise RuntimeError("No session log. Start AIShell with --session-log or pass --log-file.")
+    return SessionLogReader(os.path.expanduser(path))
+
+def format_command(command):
+    status = command['exit_status']
+    header = f"$ {command['command']}" + (f"  [exit status {status}]" if status is not None else "")
+    return f"{header}\n{command['output']}" if command['output'] else header
+
+class ScreenMirror:
+    """
+    Local copy of the AIShell screen kept up to date with delta requests.
+
+    Each `update()` only transfers the rows that changed since the previous one,
+    so polling the screen stays cheap however large the scrollback is.
+    """
+    def __init__(self, socket_file=None):
+        self.socket_file = socket_file or get_socket_file()
+        self.seq = 0
+        self.first = 0
+        self.cursor = 0
+        self.rows = {}
+
+    def update(self):
+        """Fetch changes from the server and return the numbers of the rows that changed."""
+        changes = send_request(self.socket_file, {'op': 'changes', 'since': self.seq})
+        return self.apply(changes)
+
+    def apply(self, changes):
+        if changes['full']:
+            self.rows.clear()
+        self.seq = changes['seq']
+        self.first = changes['first']
+        self.cursor = changes['cursor']
+        total = changes['total']
+        for number in [number for number in self.rows if not self.first <= number < total]:
+            del self.rows[number]
+        changed = []
+        for number, text in changes['rows']:
+            self.rows[number] = text
+            changed.append(number)
+        return changed
+
+    def follow(self):
+        """Subscribe to the server and yield the numbers of the changed rows after each pushed update."""
+        for event in subscribe(self.socket_file, {'op': 'subscribe', 'since': self.seq}):
+            if event.get('event') == 'changes':
+                yield self.apply(event)
+
+    def lines(self):
+        return [self.rows[number] for number in sorted(self.rows)]
+
+def follow_screen(line_limit=None):
+    """
+    Yield screen lines as they are completed, like `tail -f`.
+
+    Starts with the last `line_limit` lines. The row the cursor is on is only
+    yielded once the shell moves past it.
+    """
+    mirror = ScreenMirror()
+    printed = None
+    for _ in mirror.follow():
+        # Rows above the cursor are complete; the cursor row is still being written to, and the rows below it are blank
+        complete = sorted(number for number in mirror.rows if number < mirror.cursor)
+        if printed is None:
+            start = len(complete) - line_limit if line_limit and line_limit > 0 else 0
+            complete = complete[max(start, 0):]
+        else:
+            complete = [number for number in complete if number > printed]
+        for number in complete:
+            yield mirror.rows[number]
+            printed = number
+        if printed is None:
+            printed = -1
+
 def main():
     parser = argparse.ArgumentParser(description="Get AIShell screen state and save it to a file. Helpful for debugging or when you want to see what's captured by the AIShell.")
     parser.add_argument("--print", "-p", action="store_true", help="Print the log to stdout instead of writing to a file. Warning: This can get messy if done repeatedly.")
     parser.add_argument("--lines", "-n", type=int, default=20, help="Number of lines to print (default: 20)")
     parser.add_argument("--output", "-o", type=str, default="~/.aishell_get_screen", help="Output file path (default: ~/.aishell_get_screen)")
+    parser.add_argument("--follow", "-f", action="store_true", help="Keep printing new lines as they appear, like tail -f (implies --print)")
+    parser.add_argument("--command", "-c", type=str, choices=["last", "last_failed"], help="Get a single command and its output instead of the screen")
+    parser.add_argument("--from-log", action="store_true", help="Read from the session log on disk instead of asking the running AIShell")
+    parser.add_argument("--log-file", type=str, default=None, help="Session log to read with --from-log (default: $AISHELL_SESSION_LOG)")
     args = parser.parse_args()
 
     try:
-        context = get_screen_context(args.lines)
+        if args.follow:
+            try:
+                for line in follow_screen(args.lines):
+                    print(f"| {line}", flush=True)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        session_log = open_session_log(args.log_file) if args.from_log else None
+        if args.command:
+            command = session_log.get_command(args.command) if session_log else get_command(args.command)
+            if command is None:
+                print(f"No {args.command.replace('_', ' ')} command recorded.")
+                return
+            context = format_command(command)
+        elif session_log:
+            context = session_log.get_last_lines(args.lines)
+        else:
+            context = get_screen_context(args.lines)
 
         if args.print:
             for line in context.split('\n'):
@@ -7,14 +7,26 @@ import tty
 import signal
 import fcntl
 import struct
-import socket
 import tempfile
 import argparse
+import time
+from contextlib import nullcontext
 
-from .terminal_parser import TerminalParser
+from .search import DEFAULT_INDEX_LINES
+from .terminal_parser import TerminalParser, DEFAULT_SCROLLBACK
+from .broker import SESSION_ID_ENV_VAR, register_session
+from .server import ScreenServer
+from .session_log import SESSION_LOG_ENV_VAR, SessionLog, default_session_log_path
+from .stats import SessionStats
+from .worker import CHUNK_BYTES, ParseQueue, ParserWorker
 
 AISHELL_ENV_VAR = "AISHELL_ACTIVE"
 SOCKET_ENV_VAR = "AISHELL_SOCKET"
+# pty output is read with a size between these, doubled while reads come back full and halved while they don't
+MIN_READ_SIZE = 1024
+MAX_READ_SIZE = 64 * 1024
+INPUT_READ_SIZE = 4096
+PARSE_THREAD_SWITCH_INTERVAL = 0.0005
 
 def set_winsize(fd, rows, cols):
     winsize = struct.pack("HHHH", rows, cols, 0, 0)
@@ -25,54 +37,63 @@ def get_winsize(fd):
     rows, cols, _, _ = struct.unpack("HHHH", winsize)
     return rows, cols
 
+def write_all(fd, data):
+    """Write all of `data` to `fd`; os.write may write only part of it."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+class OutputReader:
+    """
+    Reads pty output into one preallocated buffer.
+
+    `read` returns a memoryview of the buffer, which is only valid until the next
+    read: copy it to keep it. The read size adapts to the output rate, so bursts
+    like `cat` of a large file take few large reads and interactive output stays cheap.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray(MAX_READ_SIZE)
+        self.view = memoryview(self.buffer)
+        self.read_size = MIN_READ_SIZE
+
+    def read(self):
+        count = os.readv(self.fd, [self.view[:self.read_size]])
+        if count == self.read_size:
+            self.read_size = min(self.read_size * 2, MAX_READ_SIZE)
+        elif count < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, MIN_READ_SIZE)
+        return self.view[:count]
+
 def get_terminal_settings(fd):
     return termios.tcgetattr(fd)
 
 def set_terminal_settings(fd, settings):
     termios.tcsetattr(fd, termios.TCSANOW, settings)
 
-def handle_client_connection(client_socket, term, shell_state):
-    shell_state['print_count'] = shell_state.get('print_count', 0) + 1
-    try:
-        request = client_socket.recv(1024).decode('utf-8')
-        if request == "GET_SCREEN_STATE":
-            screen_state, _ = term.get_screen_state()
-            screen_state_bytes = screen_state.encode('utf-8')
-            length_bytes = len(screen_state_bytes).to_bytes(4, byteorder='big')
-            client_socket.sendall(length_bytes + screen_state_bytes)
-
-            # Wait for the "END" message or timeout after 5 seconds
-            client_socket.settimeout(5)
-            try:
-                end_message = client_socket.recv(1024).decode('utf-8')
-                if end_message != "END":
-                    print("Unexpected end message from client")
-            except socket.timeout:
-                print("Client connection timed out")
-        elif request == "GET_PRINT_COUNT":
-            count = shell_state['print_count']
-            message = f"aishell-print has been called {count} times."
-            client_socket.sendall(message.encode('utf-8'))
-    finally:
-        client_socket.close()
-
-def start_socket_server(socket_file):
-    if os.path.exists(socket_file):
-        os.remove(socket_file)
-
-    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    server_socket.bind(socket_file)
-    server_socket.listen(1)
-    return server_socket
-
 def run_shell():
     parser = argparse.ArgumentParser(description="AIShell - An AI-enhanced shell")
     parser.add_argument('--shell', "-s", default=os.environ.get('SHELL', '/bin/bash'),
                         help="Specify the shell to use (default: $SHELL or /bin/bash)")
+    parser.add_argument('--scrollback', type=int, default=DEFAULT_SCROLLBACK,
+                        help=f"Number of lines of output kept in memory (default: {DEFAULT_SCROLLBACK}). Set <=0 for unlimited.")
+    parser.add_argument('--index-lines', type=int, default=DEFAULT_INDEX_LINES,
+                        help=f"Number of lines of output kept in the search index, including lines gone from the "
+                             f"scrollback (default: {DEFAULT_INDEX_LINES}). Set 0 to search only the scrollback.")
+    parser.add_argument('--debug-log', action="store_true",
+                        help="Keep a (capped) debug log of the terminal parser.")
+    parser.add_argument('--session-log', nargs='?', const=default_session_log_path(), default=None, metavar="PATH",
+                        help="Record the session's raw output and a line/command index to PATH "
+                             "(default: a new file in ~/.aishell/sessions) so it can be read back later.")
+    parser.add_argument('--parse-thread', action="store_true",
+                        help="Parse output on a background thread so parsing never delays echoing it.")
+    parser.add_argument('--daemon', action="store_true",
+                        help="Register the session with the local broker (started if needed), so tools can list, "
+                             "query and search all sessions. Sessions can be nested in this mode.")
     args = parser.parse_args()
 
-    if os.environ.get(AISHELL_ENV_VAR):
-        print("AISHELL_ENV_VAR is set. You appear to be already in an AIShell session. Nested sessions are not supported. Exit with ctrl-d or exit")
+    if os.environ.get(AISHELL_ENV_VAR) and not args.daemon:
+        print("AISHELL_ENV_VAR is set. You appear to be already in an AIShell session. Nested sessions are only supported with --daemon. Exit with ctrl-d or exit")
         return
 
     shell = args.shell
@@ -85,8 +106,21 @@ def run_shell():
     socket_file = temp_socket.name
     temp_socket.close()
     os.environ[SOCKET_ENV_VAR] = socket_file
-
-    shell_state = {}
+    parent_session = os.environ.get(SESSION_ID_ENV_VAR)
+    session_id = str(os.getpid())
+    os.environ[SESSION_ID_ENV_VAR] = session_id
+
+    session_log = None
+    if args.session_log:
+        session_log = SessionLog(os.path.expanduser(args.session_log))
+        os.environ[SESSION_LOG_ENV_VAR] = session_log.path
+
+    stats = SessionStats()
+    shell_state = {'stats': stats}
+    parse_queue = None
+    worker = None
+    server = None
+    broker_link = None
     try:
         pid, fd = pty.fork()
 
@@ -94,17 +128,43 @@ def run_shell():
             os.environ[AISHELL_ENV_VAR] = "1"
             os.execvp(shell, [shell, "-i"])
         else:  # Parent process
-            term = TerminalParser()
-            buffer = b""
+            rows, cols = get_winsize(sys.stdin.fileno())
+            term = TerminalParser(scrollback=args.scrollback if args.scrollback > 0 else None, debug=args.debug_log,
+                                  session_log=session_log, height=rows, width=cols,
+                                  index_lines=max(args.index_lines, 0))
+            # Parsing is handed output through a queue, so echoing it never waits for the parser
+            parse_queue = ParseQueue(term, parse_times=stats.parse)
+            feed, mark_command_submitted, resize, lock = parse_queue.feed, parse_queue.mark_command_submitted, parse_queue.resize, nullcontext()
+            if args.parse_thread:
+                # The worker holds the GIL while parsing; by default the I/O loop could wait 5 ms for it
+                # after every read and write, which throttles echo far more than parsing itself
+                sys.setswitchinterval(PARSE_THREAD_SWITCH_INTERVAL)
+                worker = ParserWorker(term, parse_times=stats.parse)
+                worker.start()
+                parse_queue = worker.queue
+                feed, mark_command_submitted, resize, lock = worker.feed, worker.mark_command_submitted, worker.resize, worker.lock
+            stats.parse_queue = parse_queue
+            # The signal can arrive in the middle of parsing, so the new size is only applied from the main loop
+            pending_size = []
 
             def sigwinch_handler(signum, frame):
                 rows, cols = get_winsize(sys.stdin.fileno())
                 set_winsize(fd, rows, cols)
+                pending_size[:] = [rows, cols]
                 os.kill(pid, signal.SIGWINCH)
 
             signal.signal(signal.SIGWINCH, sigwinch_handler)
             sigwinch_handler(None, None)  # Initial size setup
 
+            if args.daemon:
+                info = {'session': session_id, 'pid': os.getpid(), 'shell_pid': pid, 'shell': shell, 'socket': socket_file,
+                        'cwd': os.getcwd(), 'tty': os.ttyname(sys.stdin.fileno()), 'started': time.time(),
+                        'parent': parent_session}
+                try:
+                    broker_link = register_session(info)
+                except Exception as e:
+                    print(f"Error: could not register with the broker, continuing without it: {e}")
+
             tty.setraw(sys.stdin.fileno())
             tty.setcbreak(fd)
 
@@ -115,50 +175,81 @@ def run_shell():
             new_fd_settings[3] = new_fd_settings[3] | termios.ECHO | termios.ICANON
             set_terminal_settings(fd, new_fd_settings)
 
-            server_socket = start_socket_server(socket_file)
-
-            def handle_terminal_and_buffer(buffer, term):
-                buffer_utf8 = buffer.decode('utf-8', errors='ignore')
-                if '\n' in buffer_utf8:
-                    lines = buffer_utf8.split('\n')
-                    for line in lines[:-1]:
-                        term.process_line(line)
-                    buffer = lines[-1].encode('utf-8')
-                return buffer, term
+            server = ScreenServer(socket_file, term, lock, shell_state)
+            if broker_link:
+                server.adopt(broker_link)
+            output_reader = OutputReader(fd)
 
             while True:
                 try:
-                    r, w, e = select.select([sys.stdin, fd, server_socket], [], [])
+                    # Output is echoed as it is read and parsed when there is nothing else to do, a slice at
+                    # a time, so a burst of output is never slowed down to the parser's pace; then the
+                    # search index is caught up on the same way
+                    parse_behind = not worker and bool(parse_queue)
+                    index_behind = term.search_index_behind()
+                    r, w, e = select.select([sys.stdin, fd, *server.readers()], server.writers(), [],
+                                            0 if parse_behind or index_behind else server.timeout())
+                    if not r and not w:
+                        if parse_behind:
+                            parse_queue.apply(parse_queue.take(CHUNK_BYTES))
+                        elif index_behind:
+                            with lock:
+                                term.catch_up_search_index()
+                    if pending_size:
+                        resize(*pending_size)
+                        pending_size.clear()
 
                     if sys.stdin in r:
                         # sys.stdin is the terminal
-                        data = os.read(sys.stdin.fileno(), 1024)
+                        data = os.read(sys.stdin.fileno(), INPUT_READ_SIZE)
                         if not data:
                             break
-                        os.write(fd, data)
+                        write_all(fd, data)
+                        stats.bytes_in += len(data)
+                        if b'\r' in data or b'\n' in data:
+                            mark_command_submitted()
 
                     if fd in r:
                         # fd is the pty output
-                        data = os.read(fd, 1024)
+                        try:
+                            data = output_reader.read()
+                        except OSError:
+                            # EIO: the shell has exited
+                            break
                         if not data:
                             break
-                        os.write(sys.stdout.fileno(), data)
-                        sys.stdout.flush()
-
-                        buffer += data
+                        write_all(sys.stdout.fileno(), data)
 
-                        if len(buffer) > 10000:
-                            buffer, term = handle_terminal_and_buffer(buffer, term)
+                        # Time the I/O loop spends parsing (or handing off to the worker) before it can echo more output
+                        start = time.perf_counter()
+                        feed(data)
+                        stats.feed.record(time.perf_counter() - start)
+                        stats.bytes_out += len(data)
+                        stats.reads_out += 1
 
-                    if server_socket in r:
-                        client_socket, _ = server_socket.accept()
-                        buffer, term = handle_terminal_and_buffer(buffer, term)
-                        handle_client_connection(client_socket, term, shell_state)
+                    if not worker and parse_queue and any(sock in server.clients or sock is server.server_socket for sock in r):
+                        # Answer clients from a little more of what was echoed; at most one slice is parsed first, so a
+                        # client polling during a burst can't hold up echo. The stats op reports the backlog left.
+                        parse_queue.apply(parse_queue.take(CHUNK_BYTES))
+                    server.process(r, w)
 
                 except (OSError, IOError):
                     pass
 
     finally:
+        if server:
+            server.shutdown()
+        # Both leave the session log complete before it is closed below
+        if worker:
+            worker.stop()
+        elif parse_queue:
+            # Output that was never parsed is skipped rather than parsed now, but still reaches the session log
+            parse_queue.skip(0)
+            parse_queue.apply(parse_queue.take(parse_queue.max_bytes))
+        if stats.profiler:
+            stats.profiler.stop()
+        if session_log:
+            session_log.close()
         # Restore the original terminal settings
         termios.tcsetattr(sys.stdin, termios.TCSAFLUSH, old_tty)
         if os.path.exists(socket_file):
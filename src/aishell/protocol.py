@@ -0,0 +1,93 @@
+"""
+Framed request/response protocol spoken over the AIShell socket.
+
+Every message is a header (magic, protocol version, payload length) followed by
+a UTF-8 JSON payload. Requests carry an `op` and its arguments; responses carry
+`ok` and either the result fields or an `error` message.
+
+The bare-string requests of the original protocol (`GET_SCREEN_STATE`,
+`GET_PRINT_COUNT`) are still understood by the server.
+"""
+import json
+import socket
+import struct
+
+MAGIC = b"AISH"
+VERSION = 1
+HEADER = struct.Struct(">4sBI")
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(message, version=VERSION):
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(MAGIC, version, len(payload)) + payload
+
+
+def decode_frame(buffer):
+    """
+    Decode the first frame in `buffer`.
+
+    Returns `(version, message, rest)`, or `(None, None, buffer)` if the frame is not complete yet.
+    """
+    if len(buffer) < HEADER.size:
+        return None, None, buffer
+    magic, version, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ProtocolError("Not an AIShell frame")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    end = HEADER.size + length
+    if len(buffer) < end:
+        return None, None, buffer
+    message = json.loads(bytes(buffer[HEADER.size:end]).decode('utf-8'))
+    return version, message, buffer[end:]
+
+
+class FrameReader:
+    """Read consecutive frames from a blocking socket, keeping any bytes received past the current frame."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def read(self):
+        while True:
+            version, message, self.buffer = decode_frame(self.buffer)
+            if message is not None:
+                return message
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ProtocolError("Connection closed before the response was complete")
+            self.buffer += chunk
+
+
+def check_response(response):
+    if not response.get('ok'):
+        raise RuntimeError(response.get('error', 'Unknown error'))
+    return response
+
+
+def send_request(socket_file, request, timeout=5):
+    """Send one request to the AIShell socket and return its response, raising RuntimeError on errors."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.settimeout(timeout)
+        client_socket.connect(socket_file)
+        client_socket.sendall(encode_frame(request))
+        response = FrameReader(client_socket).read()
+    return check_response(response)
+
+
+def subscribe(socket_file, request):
+    """Send a subscription request and yield the events the server pushes until the connection closes."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.connect(socket_file)
+        client_socket.sendall(encode_frame(request))
+        reader = FrameReader(client_socket)
+        while True:
+            try:
+                yield check_response(reader.read())
+            except ProtocolError:
+                return
@@ -0,0 +1,338 @@
+"""
+Full-text search over the output of an AIShell session.
+
+SearchIndex keeps the text of the last `max_lines` lines of the main screen,
+including lines long gone from the scrollback, in a trigram index. Parsing only
+copies out the text of rows as they leave the scrollback. Those, and the rows
+changed on the screen (found through its damage tracking), are indexed in
+batches by the I/O loop while the session is idle, and a search first indexes
+whatever is still waiting.
+
+Lines are kept in segments of SEGMENT_ROWS consecutive rows, each with its own
+trigram postings, so old lines are dropped a whole segment at a time. Postings
+point at blocks of BLOCK_ROWS rows rather than single rows, which makes them
+several times cheaper to build. A search takes the trigrams every match must
+contain from the literal parts of the pattern, intersects their postings to
+find candidate blocks, and checks only the rows in those against the regular
+expression.
+
+    aishell-search [-i] [-F] [-C N] [--limit N] [--all] PATTERN
+"""
+import argparse
+import re
+from collections import deque
+
+DEFAULT_INDEX_LINES = 200000
+SEGMENT_ROWS = 8192
+# Rows per posting: a trigram is recorded once per block it appears in, not once per row.
+# Block numbers are stored as bytes, so a segment has at most 256 blocks
+BLOCK_ROWS = 32
+# Rows indexed per call to `catch_up` while the session is idle
+INDEX_BATCH = 2048
+
+PATTERN_METACHARACTERS = set('.^$*+?{}[]\\|()')
+# What follows the backslash of an escape that isn't a literal punctuation character: \x20, \u00e9, \N{...},
+# octal escapes and backreferences, or a single letter like \d
+ESCAPE_REGEX = re.compile(r'x[0-9a-fA-F]{0,2}|u[0-9a-fA-F]{0,4}|U[0-9a-fA-F]{0,8}|N\{[^}]*\}?|[0-7]{1,3}|\d+|.', re.DOTALL)
+
+
+def trigrams(text):
+    """The set of lowercase trigrams of `text`, as tuples of three characters."""
+    text = text.lower()
+    return set(zip(text, text[1:], text[2:]))
+
+
+def required_trigrams(pattern):
+    """
+    Trigrams (lowercase) that every line matching the regular expression `pattern` contains.
+
+    Only literal runs outside of groups, classes and optional characters are used; patterns
+    with groups or alternatives yield no trigrams at all, which means every line is a candidate.
+    """
+    if '|' in pattern or '(' in pattern:
+        return set()
+    runs = []
+    current = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            if pattern[i + 1].isalnum():
+                # \d, \x20, \101, ...: not the literal characters, so the run ends, and the escape's
+                # argument is skipped with it
+                runs.append(current)
+                current = []
+                i = ESCAPE_REGEX.match(pattern, i + 1).end()
+            else:
+                current.append(pattern[i + 1])
+                i += 2
+            continue
+        if char in '*?{':
+            # The previous character may be left out
+            if current:
+                current.pop()
+            runs.append(current)
+            current = []
+            if char == '{':
+                end = pattern.find('}', i)
+                i = end if end != -1 else len(pattern)
+        elif char == '[':
+            runs.append(current)
+            current = []
+            # Skip to the closing bracket; a `]` right after `[` or `[^`, or escaped, doesn't close the class
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif char in PATTERN_METACHARACTERS:
+            runs.append(current)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    runs.append(current)
+    required = set()
+    for run in runs:
+        required |= trigrams(''.join(run))
+    return required
+
+
+class Segment:
+    def __init__(self, start):
+        self.start = start
+        self.texts = []
+        # trigram -> numbers of the blocks containing it. A block is appended again when it is re-indexed
+        # (unless it is the last entry already); stale entries are weeded out by checking the text
+        self.postings = {}
+        # Blocks with rows changed since they were last indexed
+        self.dirty = set()
+        self.indexed = set()
+        # Blocks re-indexed since the postings were last built from scratch
+        self.rewrites = 0
+
+    def add(self, row, text):
+        offset = row - self.start
+        if offset >= len(self.texts):
+            self.texts.extend([''] * (offset + 1 - len(self.texts)))
+        if self.texts[offset] != text:
+            self.texts[offset] = text
+            self.dirty.add(offset // BLOCK_ROWS)
+
+    def flush(self):
+        self.rewrites += len(self.dirty & self.indexed)
+        if self.rewrites > SEGMENT_ROWS // BLOCK_ROWS:
+            # Rows rewritten over and over (a progress bar, a clock) would otherwise keep adding stale
+            # entries and trigrams; start over once as many blocks were rewritten as the segment holds
+            self.postings = {}
+            self.dirty = set(range((len(self.texts) - 1) // BLOCK_ROWS + 1))
+            self.rewrites = 0
+        postings = self.postings
+        for block in self.dirty:
+            for trigram in trigrams("\n".join(self.texts[block * BLOCK_ROWS:(block + 1) * BLOCK_ROWS])):
+                blocks = postings.get(trigram)
+                if blocks is None:
+                    postings[trigram] = bytearray((block,))
+                elif blocks[-1] != block:
+                    blocks.append(block)
+        self.indexed |= self.dirty
+        self.dirty.clear()
+
+    def text(self, row):
+        offset = row - self.start
+        return self.texts[offset] if 0 <= offset < len(self.texts) else ''
+
+    def candidates(self, required):
+        """Rows that may match, newest first."""
+        if required:
+            blocks = None
+            for trigram in required:
+                found = self.postings.get(trigram)
+                if found is None:
+                    return
+                blocks = set(found) if blocks is None else blocks.intersection(found)
+        else:
+            blocks = range((len(self.texts) - 1) // BLOCK_ROWS + 1)
+        for block in sorted(blocks, reverse=True):
+            first = self.start + block * BLOCK_ROWS
+            yield from range(min(first + BLOCK_ROWS, self.start + len(self.texts)) - 1, first - 1, -1)
+
+
+class SearchIndex:
+    def __init__(self, max_lines=DEFAULT_INDEX_LINES):
+        self.max_lines = max_lines
+        self.segments = {}
+        # Rows changed up to this sequence number are indexed
+        self.seq = 0
+        # One past the last row of the screen at the last update
+        self.end = 0
+        # `(row, text)` of rows that left the screen buffer and aren't indexed yet
+        self.pending = deque(maxlen=max_lines)
+        # Rows of the screen that had changed at sequence number `stale_seq`, being indexed a batch at a time
+        self.stale = None
+        self.stale_seq = 0
+
+    def __len__(self):
+        return sum(len(segment.texts) for segment in self.segments.values())
+
+    def discard(self, number, seq, text):
+        """ScreenBuffer hook: a row is about to be evicted or cleared."""
+        if seq > self.seq:
+            self.pending.append((number, text))
+
+    def behind(self, screen):
+        """Whether any rows of `screen`, or rows that left it, are waiting to be indexed."""
+        return bool(self.pending) or self.stale is not None or screen.last_seq > self.seq
+
+    def catch_up(self, screen, max_lines=INDEX_BATCH):
+        """
+        Index up to `max_lines` of the rows waiting to be indexed: first the rows that left `screen`,
+        then the rows changed in it. Returns whether any are still waiting.
+        """
+        budget = max_lines
+        while self.pending and budget:
+            self.add(*self.pending.popleft())
+            budget -= 1
+        if budget and not self.pending:
+            if self.stale is None:
+                # Rows changed after this are left for the next round, so `seq` only moves on once all are done
+                self.stale_seq = screen.last_seq
+                self.stale = deque(screen.dropped + index for index, _ in screen.changed_since(self.seq))
+            while self.stale and budget:
+                number = self.stale.popleft()
+                if 0 <= number - screen.dropped < len(screen):
+                    self.add_row(screen, number - screen.dropped)
+                budget -= 1
+            if not self.stale:
+                self.seq = self.stale_seq
+                self.end = screen.dropped + len(screen)
+                self.stale = None
+        self.flush()
+        return self.behind(screen)
+
+    def update(self, screen):
+        """Index the rows that left `screen` or changed in it since the last update."""
+        while self.pending:
+            self.add(*self.pending.popleft())
+        # Rows come in order, so the row a line starts on comes before the rows it continues on
+        starts = set()
+        for index, _ in screen.changed_since(self.seq):
+            if screen.is_continuation(index):
+                self.add(screen.dropped + index, '')
+                index = screen.line_start(index)
+                if index in starts or screen.is_continuation(index):
+                    continue
+            starts.add(index)
+            self.add(screen.dropped + index, screen.line(index)[1])
+        self.flush()
+        self.seq = screen.last_seq
+        self.end = screen.dropped + len(screen)
+        self.stale = None
+
+    def add_row(self, screen, index):
+        """
+        Index row `index` of the ScreenBuffer `screen`. A line that wrapped is indexed as a whole
+        at the row it starts on, and the rows it continues on are indexed as empty.
+        """
+        if screen.is_continuation(index):
+            self.add(screen.dropped + index, '')
+            index = screen.line_start(index)
+            if screen.is_continuation(index):
+                # The row the line starts on was evicted, and indexed with the rest of the line then
+                return
+        self.add(screen.dropped + index, screen.line(index)[1])
+
+    def add(self, row, text):
+        number = row // SEGMENT_ROWS
+        segment = self.segments.get(number)
+        if segment is None:
+            if self.segments and number < min(self.segments):
+                # Older than anything kept
+                return
+            segment = self.segments[number] = Segment(number * SEGMENT_ROWS)
+            # Drop whole segments once the rest still hold `max_lines` lines
+            while len(self.segments) > 1 and (number - min(self.segments)) * SEGMENT_ROWS >= self.max_lines:
+                del self.segments[min(self.segments)]
+        segment.add(row, text)
+
+    def flush(self):
+        for segment in self.segments.values():
+            if segment.dirty:
+                segment.flush()
+
+    def text(self, row):
+        segment = self.segments.get(row // SEGMENT_ROWS)
+        return segment.text(row) if segment else ''
+
+    def search(self, regex, limit=100, context=0):
+        """Return up to `limit` lines matching the compiled `regex`, newest first, like TerminalParser.search."""
+        required = required_trigrams(regex.pattern)
+        matches = []
+        for number in sorted(self.segments, reverse=True):
+            segment = self.segments[number]
+            for row in segment.candidates(required):
+                text = segment.text(row)
+                if text and regex.search(text):
+                    matches.append({
+                        'row': row,
+                        'line': text,
+                        'before': [self.text(other) for other in range(max(row - context, 0), row)],
+                        'after': [self.text(other) for other in range(row + 1, min(row + 1 + context, self.end))],
+                    })
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+
+def format_match(match, prefix=''):
+    """Render a match grep-style: `row:line` for the matching line and `row-line` for its context."""
+    first = match['row'] - len(match['before'])
+    lines = []
+    for offset, line in enumerate(match['before'] + [match['line']] + match['after']):
+        separator = ':' if first + offset == match['row'] else '-'
+        lines.append(f"{prefix}{first + offset}{separator} {line}")
+    return "\n".join(lines)
+
+
+def main():
+    from .broker import broker_request
+    from .get_screen import get_socket_file
+    from .protocol import send_request
+
+    parser = argparse.ArgumentParser(description="Search the output of the current AIShell session")
+    parser.add_argument("pattern", help="Regular expression to search for")
+    parser.add_argument("--ignore-case", "-i", action="store_true", help="Search case-insensitively")
+    parser.add_argument("--fixed-strings", "-F", action="store_true", help="Treat the pattern as a plain string")
+    parser.add_argument("--context", "-C", type=int, default=0, help="Lines of context to show around matches")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum number of matches (default: 100)")
+    parser.add_argument("--all", action="store_true", help="Search every session registered with the broker")
+    args = parser.parse_args()
+
+    request = {
+        'op': 'search',
+        'pattern': re.escape(args.pattern) if args.fixed_strings else args.pattern,
+        'ignore_case': args.ignore_case,
+        'context': args.context,
+        'limit': args.limit,
+    }
+    try:
+        if args.all:
+            results = broker_request(request)['results']
+        else:
+            results = [{'ok': True, 'session': None, **send_request(get_socket_file(), request)}]
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+    blocks = []
+    for result in results:
+        prefix = f"{result['session']}:" if result['session'] else ''
+        if not result.get('ok'):
+            print(f"{result['session']}: Error: {result.get('error')}")
+            continue
+        # Oldest first, like grep
+        blocks.extend(format_match(match, prefix) for match in reversed(result['matches']))
+    print("\n--\n".join(blocks) if args.context else "\n".join(blocks))
+
+
+if __name__ == "__main__":
+    main()
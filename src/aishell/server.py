@@ -0,0 +1,367 @@
+import json
+import os
+import re
+import socket
+import time
+
+from .protocol import MAGIC, VERSION, decode_frame, encode_frame
+
+LEGACY_REQUESTS = ("GET_SCREEN_STATE", "GET_PRINT_COUNT", "GET_STATS")
+# Seconds a client may stay idle (e.g. before sending END) before it is disconnected
+CLIENT_TIMEOUT = 5
+# Minimum seconds between two updates pushed to a subscriber; changes in between are coalesced
+SUBSCRIBE_INTERVAL = 0.05
+# Updates are held back while a subscriber has this many bytes unread, until it catches up
+SUBSCRIBER_MAX_PENDING = 1024 * 1024
+
+
+class ClientConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b""
+        self.outbuf = bytearray()
+        self.last_active = time.monotonic()
+        self.awaiting_end = False
+        self.close_when_sent = False
+        # Sequence number the subscriber has been sent changes up to, None for ordinary clients
+        self.subscribed_seq = None
+        self.subscribed_command = None
+        # Absolute row the cursor was on in the last update, so moving it alone is pushed too
+        self.subscribed_cursor = None
+        # Connections that stay open for good, like the link to the broker, are never expired
+        self.persistent = False
+
+    def send(self, data, close=False):
+        self.outbuf += data
+        self.close_when_sent = close
+
+
+REQUEST_HANDLERS = {}
+
+
+def request_handler(op):
+    def register(handler):
+        REQUEST_HANDLERS[op] = handler
+        return handler
+    return register
+
+
+@request_handler('screen')
+def handle_screen(request, term, shell_state):
+    lines = request.get('lines')
+    if lines and lines > 0:
+        text = term.get_last_lines(lines)
+    else:
+        text, _ = term.get_screen_state()
+    return {'seq': term.seq, 'text': text}
+
+
+@request_handler('rows')
+def handle_rows(request, term, shell_state):
+    if 'last' in request:
+        first, rows = term.get_last_rows(int(request['last']))
+    else:
+        first, rows = term.get_rows(int(request.get('start', 0)), request.get('end'))
+    # Rows that continue on the next one: a line longer than the terminal is wide
+    return {'seq': term.seq, 'first': first, 'rows': rows, 'wrapped': term.get_wrapped(first, first + len(rows))}
+
+
+@request_handler('changes')
+def handle_changes(request, term, shell_state):
+    return term.get_changes(int(request.get('since', 0)))
+
+
+@request_handler('commands')
+def handle_commands(request, term, shell_state):
+    limit = int(request.get('limit', 20))
+    records = list(term.commands.records)[-limit:] if limit > 0 else []
+    for record in records:
+        term.read_command_line(record)
+    return {'commands': [record.to_dict() for record in records]}
+
+
+@request_handler('command')
+def handle_command(request, term, shell_state):
+    return {'command': term.get_command(request.get('which', 'last'))}
+
+
+@request_handler('print_count')
+def handle_print_count(request, term, shell_state):
+    return {'count': shell_state['print_count']}
+
+
+@request_handler('search')
+def handle_search(request, term, shell_state):
+    try:
+        matches = term.search(str(request['pattern']), limit=int(request.get('limit', 100)),
+                              context=int(request.get('context', 0)), ignore_case=bool(request.get('ignore_case')))
+    except KeyError:
+        raise ValueError("missing pattern")
+    except re.error as e:
+        raise ValueError(f"bad pattern: {e}")
+    return {'seq': term.seq, 'matches': matches}
+
+
+@request_handler('stats')
+def handle_stats(request, term, shell_state):
+    stats = shell_state.get('stats')
+    if stats is None:
+        raise ValueError("this session doesn't collect stats")
+    if 'profile' in request:
+        stats.set_profiling(request['profile'])
+    return {'stats': stats.to_dict(term, top=int(request.get('top', 20)))}
+
+
+@request_handler('subscribe')
+def handle_subscribe(request, term, shell_state):
+    # The ScreenServer turns the connection into a subscription; the first update carries the changes since `since`
+    commands = term.commands
+    return {
+        'subscribed': True,
+        'seq': int(request.get('since', 0)),
+        'command_id': commands.last_id - (1 if commands.current else 0),
+    }
+
+
+def handle_request(request, term, lock, shell_state):
+    op = request.get('op')
+    handler = REQUEST_HANDLERS.get(op)
+    if handler is None:
+        return {'ok': False, 'error': f"Unknown op: {op}"}
+    start = time.perf_counter()
+    try:
+        with lock:
+            result = handler(request, term, shell_state)
+    except (TypeError, ValueError) as e:
+        return {'ok': False, 'error': f"Invalid request: {e}"}
+    except Exception as e:
+        # Whatever a request does wrong (e.g. an infinite row number), it must not take the session down
+        return {'ok': False, 'error': f"Request failed: {type(e).__name__}: {e}"}
+    finally:
+        record_request(shell_state, op, time.perf_counter() - start)
+    return {'ok': True, **result}
+
+
+def record_request(shell_state, op, seconds):
+    stats = shell_state.get('stats')
+    if stats:
+        stats.record_request(op, seconds)
+
+
+def handle_framed_request(client, term, lock, shell_state):
+    try:
+        version, request, client.inbuf = decode_frame(client.inbuf)
+    except Exception as e:
+        # Not just ProtocolError and bad JSON: a deeply nested payload raises RecursionError
+        client.inbuf = b""
+        client.send(encode_frame({'ok': False, 'error': f"Bad frame: {e}"}), close=True)
+        return True
+    if request is None:
+        return False
+    if version != VERSION:
+        response = {'ok': False, 'error': f"Unsupported protocol version {version}, server speaks {VERSION}"}
+    elif not isinstance(request, dict):
+        response = {'ok': False, 'error': "Request must be a JSON object"}
+    else:
+        response = handle_request(request, term, lock, shell_state)
+        if response.get('subscribed'):
+            client.subscribed_seq = response['seq']
+            client.subscribed_command = response['command_id']
+            return True
+    client.send(encode_frame(response))
+    return True
+
+
+def handle_client_connection(client, term, lock, shell_state):
+    """
+    Answer the request buffered on `client`.
+
+    Returns False if the request is still incomplete and more data is needed.
+    """
+    if client.inbuf[:len(MAGIC)] == MAGIC[:len(client.inbuf)]:
+        return handle_framed_request(client, term, lock, shell_state)
+
+    request = client.inbuf.decode('utf-8', errors='replace')
+    if client.awaiting_end:
+        # The legacy END acknowledgement; nothing is waiting on it any more
+        if request != "END" and "END".startswith(request):
+            return False
+        client.inbuf = b""
+        client.close_when_sent = True
+        return True
+
+    if request not in LEGACY_REQUESTS:
+        if any(known.startswith(request) for known in LEGACY_REQUESTS):
+            return False
+        client.inbuf = b""
+        client.send(b"", close=True)
+        return True
+
+    client.inbuf = b""
+    if request == "GET_SCREEN_STATE":
+        start = time.perf_counter()
+        with lock:
+            screen_state, _ = term.get_screen_state()
+        screen_state_bytes = screen_state.encode('utf-8')
+        length_bytes = len(screen_state_bytes).to_bytes(4, byteorder='big')
+        client.send(length_bytes + screen_state_bytes)
+        client.awaiting_end = True
+        record_request(shell_state, request, time.perf_counter() - start)
+    elif request == "GET_PRINT_COUNT":
+        count = shell_state['print_count']
+        message = f"aishell-print has been called {count} times."
+        client.send(message.encode('utf-8'), close=True)
+    elif request == "GET_STATS":
+        response = handle_request({'op': 'stats'}, term, lock, shell_state)
+        client.send(json.dumps(response).encode('utf-8'), close=True)
+    return True
+
+
+def start_socket_server(socket_file):
+    if os.path.exists(socket_file):
+        os.remove(socket_file)
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(socket_file)
+    server_socket.listen(socket.SOMAXCONN)
+    server_socket.setblocking(False)
+    return server_socket
+
+
+class ScreenServer:
+    """
+    Non-blocking Unix-socket server driven by the `select` loop in `run_shell`.
+
+    Every socket is non-blocking and each client keeps its own input and output
+    buffers, so any number of clients can be served at once and a slow or dead
+    client never holds up forwarding between the user and the shell.
+    """
+    def __init__(self, socket_file, term, lock, shell_state):
+        self.server_socket = start_socket_server(socket_file)
+        self.term = term
+        self.lock = lock
+        self.shell_state = shell_state
+        self.clients = {}
+        if shell_state.get('stats'):
+            shell_state['stats'].server = self
+        self.last_publish = 0.0
+
+    def readers(self):
+        return [self.server_socket, *self.clients]
+
+    def writers(self):
+        return [sock for sock, client in self.clients.items() if client.outbuf]
+
+    def subscribers(self):
+        return [client for client in self.clients.values() if client.subscribed_seq is not None]
+
+    def timeout(self):
+        # Wake up periodically while clients are connected so idle ones can be expired,
+        # and often enough to push updates to subscribers
+        if self.subscribers():
+            return SUBSCRIBE_INTERVAL
+        return 1.0 if self.clients else None
+
+    def process(self, readable, writable):
+        for sock in readable:
+            if sock is self.server_socket:
+                self.accept()
+            elif sock in self.clients:
+                self.read(self.clients[sock])
+        for sock in writable:
+            if sock in self.clients:
+                self.write(self.clients[sock])
+        self.publish()
+        self.expire()
+
+    def publish(self):
+        """Push the rows changed since their last update to subscribers that are keeping up."""
+        now = time.monotonic()
+        if now - self.last_publish < SUBSCRIBE_INTERVAL:
+            return
+        self.last_publish = now
+        for client in self.subscribers():
+            if len(client.outbuf) > SUBSCRIBER_MAX_PENDING:
+                continue
+            with self.lock:
+                changes = None
+                cursor = self.term.screen.dropped + self.term.cursor_row
+                if self.term.seq != client.subscribed_seq or cursor != client.subscribed_cursor:
+                    changes = self.term.get_changes(client.subscribed_seq)
+                finished = self.term.commands.finished_since(client.subscribed_command)
+            if changes:
+                client.subscribed_seq = changes['seq']
+                client.subscribed_cursor = changes['cursor']
+                client.send(encode_frame({'ok': True, 'event': 'changes', **changes}))
+            for record in finished:
+                client.subscribed_command = record.id
+                client.send(encode_frame({'ok': True, 'event': 'command', 'command': record.to_dict()}))
+            if changes or finished:
+                self.write(client)
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            self.clients[sock] = ClientConnection(sock)
+            self.shell_state['print_count'] = self.shell_state.get('print_count', 0) + 1
+
+    def adopt(self, sock):
+        """Serve requests arriving on an already connected socket, such as the link to the broker, until it closes."""
+        sock.setblocking(False)
+        client = ClientConnection(sock)
+        client.persistent = True
+        self.clients[sock] = client
+
+    def read(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close(client)
+            return
+        client.last_active = time.monotonic()
+        client.inbuf += data
+        try:
+            while client.inbuf and handle_client_connection(client, self.term, self.lock, self.shell_state):
+                pass
+        except Exception as e:
+            # A request the handlers didn't expect costs this client its connection, never the session
+            client.inbuf = b""
+            client.send(encode_frame({'ok': False, 'error': f"Request failed: {type(e).__name__}: {e}"}), close=True)
+        self.write(client)
+
+    def write(self, client):
+        if client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.close(client)
+                return
+            del client.outbuf[:sent]
+            client.last_active = time.monotonic()
+        if client.close_when_sent and not client.outbuf:
+            self.close(client)
+
+    def expire(self):
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            if client.subscribed_seq is None and not client.persistent and now - client.last_active > CLIENT_TIMEOUT:
+                self.close(client)
+
+    def close(self, client):
+        self.clients.pop(client.sock, None)
+        client.sock.close()
+
+    def shutdown(self):
+        for client in list(self.clients.values()):
+            self.close(client)
+        self.server_socket.close()
@@ -0,0 +1,156 @@
+"""
+Append-only on-disk log of an AIShell session.
+
+A session log is three files:
+
+- `PATH`: the raw pty output, byte for byte
+- `PATH.lines`: the byte offset just past every newline in `PATH`, as little-endian uint64s
+- `PATH.commands`: one JSON object per finished command, with the byte range of its output
+
+Everything is written with large buffered writes. Readers mmap the files, so any
+line range or command can be read back cheaply without asking the live AIShell
+process, and even after the session has ended.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from .terminal_parser import process_terminal_output
+
+SESSION_LOG_ENV_VAR = "AISHELL_SESSION_LOG"
+DEFAULT_SESSION_LOG_DIR = "~/.aishell/sessions"
+BUFFER_SIZE = 1024 * 1024
+# Buffered data is flushed at least this often (in seconds) while output keeps coming
+FLUSH_INTERVAL = 1.0
+OFFSET = struct.Struct("<Q")
+
+
+def default_session_log_path():
+    directory = os.path.expanduser(DEFAULT_SESSION_LOG_DIR)
+    return os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}.log")
+
+
+def private_opener(path, flags):
+    """`open` opener for files only the user can read: the log holds everything the terminal showed."""
+    fd = os.open(path, flags, 0o600)
+    # A file created before this (or with a looser mode) is tightened too
+    os.fchmod(fd, 0o600)
+    return fd
+
+
+class SessionLog:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        self.log_file = open(path, 'ab', buffering=BUFFER_SIZE, opener=private_opener)
+        self.lines_file = open(path + '.lines', 'ab', buffering=BUFFER_SIZE, opener=private_opener)
+        self.commands_file = open(path + '.commands', 'a', buffering=1, opener=private_opener)
+        self.offset = self.log_file.tell()
+        self.command_starts = {}
+        self.last_flush = time.monotonic()
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            # A view of a reused read buffer
+            data = bytes(data)
+        self.log_file.write(data)
+        newline = data.find(b'\n')
+        if newline != -1:
+            offsets = array('Q')
+            while newline != -1:
+                offsets.append(self.offset + newline + 1)
+                newline = data.find(b'\n', newline + 1)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            self.lines_file.write(offsets.tobytes())
+        self.offset += len(data)
+        now = time.monotonic()
+        if now - self.last_flush > FLUSH_INTERVAL:
+            self.flush()
+
+    def command_event(self, event, record):
+        """CommandHistory listener: remember where commands start and index them when they finish."""
+        if event == 'start':
+            self.command_starts[record.id] = self.offset
+        elif event == 'finish':
+            entry = {**record.to_dict(), 'start': self.command_starts.pop(record.id, self.offset), 'end': self.offset}
+            self.commands_file.write(json.dumps(entry) + '\n')
+            self.flush()
+
+    def flush(self):
+        self.log_file.flush()
+        self.lines_file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        for f in (self.log_file, self.lines_file, self.commands_file):
+            f.close()
+
+
+def map_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SessionLogReader:
+    """
+    Random access to a session log written by SessionLog.
+
+    The maps are taken when the reader is created; create a new reader to see
+    output written since.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.log = map_file(path)
+        self.line_offsets = map_file(path + '.lines')
+        # The index may be ahead of or behind the log if it was read mid-write; only trust complete lines
+        self.line_count = len(self.line_offsets) // OFFSET.size
+        while self.line_count and self.line_end(self.line_count - 1) > len(self.log):
+            self.line_count -= 1
+
+    def line_end(self, number):
+        return OFFSET.unpack_from(self.line_offsets, number * OFFSET.size)[0]
+
+    def line_start(self, number):
+        return self.line_end(number - 1) if number > 0 else 0
+
+    def read_range(self, start, end):
+        """Render the raw output between two byte offsets."""
+        data = bytes(self.log[start:end])
+        return process_terminal_output(data.decode('utf-8', errors='replace'))
+
+    def get_lines(self, start, end=None):
+        """Render log lines `start` up to `end` (exclusive); negative numbers count from the end like slices."""
+        start, end, _ = slice(start, end).indices(self.line_count + 1)
+        if start >= end:
+            return ""
+        end_offset = self.line_end(end - 1) if end <= self.line_count else len(self.log)
+        return self.read_range(self.line_start(start), end_offset)
+
+    def get_last_lines(self, count):
+        return self.get_lines(-count)
+
+    def commands(self):
+        try:
+            with open(self.path + '.commands') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def get_command(self, which='last'):
+        commands = self.commands()
+        if which == 'last_failed':
+            commands = [command for command in commands if command['failed']]
+        elif which != 'last':
+            commands = [command for command in commands if command['id'] == int(which)]
+        if not commands:
+            return None
+        command = commands[-1]
+        return {**command, 'output': self.read_range(command['start'], command['end'])}
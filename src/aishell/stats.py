@@ -0,0 +1,279 @@
+"""
+Runtime metrics of an AIShell session.
+
+The I/O loop, the parser worker and the socket server record into a
+SessionStats, which the `stats` socket request (and legacy GET_STATS) reports:
+bytes forwarded each way, how long parsing takes, how far parsing is behind,
+how much memory the screen holds and how long client requests take. A sampling
+profiler can be started and stopped on the live session through the same
+request, to see where the time goes without restarting the shell.
+
+    aishell-stats [--json] [--profile {start,stop}] [--top N]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Histogram buckets are powers of two of microseconds, from 1 µs to 2**BUCKETS µs (about 17 minutes)
+BUCKETS = 30
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class Histogram:
+    """Count, total, max and a power-of-two histogram of durations."""
+    def __init__(self):
+        self.buckets = [0] * (BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound in seconds of the bucket holding the `fraction` quantile."""
+        if not self.count:
+            return 0.0
+        remaining = fraction * self.count
+        for bucket, count in enumerate(self.buckets):
+            remaining -= count
+            if remaining <= 0:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+            # [upper bound in ms, count] for the buckets that aren't empty
+            'buckets': [[(1 << bucket) / 1000, count] for bucket, count in enumerate(self.buckets) if count],
+        }
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads every `interval` seconds.
+
+    Each function is counted once per sample as "self" when it is the innermost
+    frame, and once as "cumulative" when it is anywhere on the stack.
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+        self.lock = threading.Lock()
+        self.started = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run, name="aishell-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread:
+            thread.join(timeout=1)
+
+    def run(self):
+        me = threading.get_ident()
+        while self.thread is not None:
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == me:
+                        continue
+                    self.samples += 1
+                    self.self_counts[frame_name(frame)] += 1
+                    seen = set()
+                    while frame is not None:
+                        name = frame_name(frame)
+                        if name not in seen:
+                            seen.add(name)
+                            self.cumulative_counts[name] += 1
+                        frame = frame.f_back
+            time.sleep(self.interval)
+
+    def report(self, limit=20):
+        with self.lock:
+            top = [[name, count, self.cumulative_counts[name]] for name, count in self.self_counts.most_common(limit)]
+            return {
+                'running': self.running,
+                'started': self.started,
+                'interval_ms': self.interval * 1000,
+                'samples': self.samples,
+                # [function, self samples, cumulative samples]
+                'top': top,
+            }
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+def screen_memory(screen):
+    """Rows, cells and approximate bytes held by a ScreenBuffer."""
+    if screen is None:
+        return None
+    cells = sum(len(row) for row in screen)
+    # A row is a list of pointers to cached one-character strings; sequence numbers are ints in a deque
+    approx_bytes = sum(sys.getsizeof(row) for row in screen) + len(screen) * 2 * 8
+    return {'rows': len(screen), 'cells': cells, 'approx_bytes': approx_bytes}
+
+
+class SessionStats:
+    def __init__(self):
+        self.started = time.time()
+        # Bytes typed by the user and forwarded to the shell, and shell output forwarded to the terminal
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reads_out = 0
+        # Time the I/O loop spends handing each read of output over to the parser (including any parsing
+        # it does right away), and time spent parsing each chunk, wherever and whenever that happens
+        self.feed = Histogram()
+        self.parse = Histogram()
+        # Handling time of client requests, by op
+        self.requests = {}
+        self.profiler = None
+        # Set by run_shell and the ScreenServer, for reporting how far behind they are
+        self.parse_queue = None
+        self.server = None
+
+    def record_request(self, op, seconds):
+        if op not in self.requests:
+            self.requests[op] = Histogram()
+        self.requests[op].record(seconds)
+
+    def set_profiling(self, action):
+        if action == 'start':
+            if self.profiler is None or not self.profiler.running:
+                self.profiler = SamplingProfiler()
+            self.profiler.start()
+        elif action == 'stop':
+            if self.profiler:
+                self.profiler.stop()
+        else:
+            raise ValueError(f"profile must be 'start' or 'stop', not {action!r}")
+
+    def to_dict(self, term, top=20):
+        backlog = {'pending_text': len(term.pending_text)}
+        if self.parse_queue is not None:
+            queue = self.parse_queue
+            backlog['queued_bytes'] = queue.queued_bytes
+            backlog['skipped_bytes'] = queue.skipped_bytes
+            backlog['parse_errors'] = queue.errors
+            if queue.last_error:
+                backlog['last_parse_error'] = queue.last_error
+        if self.server:
+            clients = list(self.server.clients.values())
+            backlog['clients'] = len(clients)
+            backlog['subscribers'] = sum(client.subscribed_seq is not None for client in clients)
+            backlog['unsent_bytes'] = sum(len(client.outbuf) for client in clients)
+        alternate = term.screen if term.vim_mode else None
+        return {
+            'uptime': time.time() - self.started,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'reads_out': self.reads_out,
+            'feed': self.feed.to_dict(),
+            'parse': self.parse.to_dict(),
+            'backlog': backlog,
+            'screen': {
+                'main': screen_memory(term.main_screen),
+                'alternate': screen_memory(alternate),
+                'scrollback_limit': term.scrollback,
+                'indexed_lines': len(term.search_index) if term.search_index is not None else 0,
+                'commands': len(term.commands.records),
+            },
+            'requests': {op: histogram.to_dict() for op, histogram in self.requests.items()},
+            'profile': self.profiler.report(top) if self.profiler else None,
+        }
+
+
+def format_bytes(count):
+    for unit in ("B", "KiB", "MiB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GiB"
+
+
+def format_histogram(name, histogram):
+    return (f"{name:<24} {histogram['count']:>8} calls  mean {histogram['mean_ms']:8.3f} ms  "
+            f"p50 {histogram['p50_ms']:8.3f} ms  p99 {histogram['p99_ms']:8.3f} ms  max {histogram['max_ms']:8.3f} ms")
+
+
+def format_stats(stats):
+    lines = [
+        f"uptime                   {stats['uptime']:.0f} s",
+        f"forwarded                {format_bytes(stats['bytes_in'])} in, "
+        f"{format_bytes(stats['bytes_out'])} out in {stats['reads_out']} reads",
+        format_histogram("feed (I/O loop)", stats['feed']),
+        format_histogram("parse", stats['parse']),
+        "backlog                  " + ", ".join(f"{key} {value}" for key, value in stats['backlog'].items()),
+    ]
+    for name in ('main', 'alternate'):
+        screen = stats['screen'][name]
+        if screen:
+            lines.append(f"{name + ' screen':<24} {screen['rows']} rows, {screen['cells']} cells, "
+                         f"~{format_bytes(screen['approx_bytes'])}")
+    lines.append(f"{'indexed lines':<24} {stats['screen']['indexed_lines']}")
+    lines.append(f"{'commands':<24} {stats['screen']['commands']}")
+    for op, histogram in sorted(stats['requests'].items()):
+        lines.append(format_histogram(f"request {op}", histogram))
+    profile = stats['profile']
+    if profile:
+        state = "running" if profile['running'] else "stopped"
+        lines.append(f"profile ({state}, {profile['samples']} samples every {profile['interval_ms']:g} ms)")
+        for name, self_count, cumulative_count in profile['top']:
+            lines.append(f"  {self_count / max(profile['samples'], 1):6.1%} self "
+                         f"{cumulative_count / max(profile['samples'], 1):6.1%} cumulative  {name}")
+    return "\n".join(lines)
+
+
+def main():
+    from .get_screen import get_socket_file
+    from .protocol import send_request
+
+    parser = argparse.ArgumentParser(description="Show runtime metrics of the current AIShell session")
+    parser.add_argument("--json", action="store_true", help="Print the raw metrics as JSON")
+    parser.add_argument("--profile", choices=("start", "stop"),
+                        help="Start or stop the sampling profiler in the AIShell process")
+    parser.add_argument("--top", type=int, default=20, help="Number of functions to show from the profile (default: 20)")
+    args = parser.parse_args()
+
+    request = {'op': 'stats', 'top': args.top}
+    if args.profile:
+        request['profile'] = args.profile
+    try:
+        stats = send_request(get_socket_file(), request)['stats']
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(format_stats(stats))
+
+
+if __name__ == "__main__":
+    main()
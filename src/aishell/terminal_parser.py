@@ -1,164 +1,1090 @@
-import json
-import os
+import codecs
 import re
+import unicodedata
+from collections import deque
+from itertools import count, islice
 
-class TerminalParser:
+from .commands import CommandHistory
+from .search import DEFAULT_INDEX_LINES, SearchIndex
+
+DEFAULT_SCROLLBACK = 10000
+DEFAULT_LOG_LIMIT = 1000
+# Longest incomplete escape sequence held back between feed() calls
+MAX_PENDING = 4096
+# Number of recent row changes remembered, so readers can be told what changed without scanning every row
+DAMAGE_LOG_SIZE = 4096
+TAB_WIDTH = 8
+# Largest CSI parameter used; longer numbers are clamped to it before doing any work
+MAX_PARAM = 99999
+# On a screen without a size, the cursor can be moved this many rows past the last one, and to this many columns
+UNSIZED_LIMIT = 4096
+# DEC private modes that switch to the alternate screen
+ALTERNATE_SCREEN_MODES = (47, 1047, 1049)
+
+# Runs of characters that are written to the screen as-is (everything except C0 controls and DEL), along with
+# the SGR (color) and EL (clear to the end of the line) sequences colored output interleaves with them
+TEXT_RUN_REGEX = re.compile(r'(?:[^\x00-\x1f\x7f]+|\x1b\[[0-9;:]*m|\x1b\[0?K)+')
+SGR_REGEX = re.compile(r'\x1b\[[0-9;:]*m')
+OSC_END_BYTES_REGEX = re.compile(rb'\x07|\x1b\\')
+
+
+def to_cells(text):
+    """
+    Return `text` as the screen cells it takes, or `text` itself if each character takes one.
+    A wide character (CJK, most emoji) takes two cells, the second of which holds ''.
+    """
+    east_asian_width = unicodedata.east_asian_width
+    if text.isascii() or not any(east_asian_width(char) in 'WF' for char in text):
+        return text
+    cells = []
+    for char in text:
+        cells.append(char)
+        if east_asian_width(char) in 'WF':
+            cells.append('')
+    return cells
+
+
+class SequenceCounter:
+    """Source of the sequence numbers that stamp changes to the screen buffers of one parser."""
     def __init__(self):
+        self.last = 0
+
+    def next(self):
+        self.last += 1
+        return self.last
+
+
+class ScreenBuffer:
+    """
+    Fixed-capacity ring of row buffers.
+
+    Once `capacity` rows are stored, appending a row evicts the oldest one, so
+    memory use is bounded by the scrollback limit rather than by everything
+    ever printed. `dropped` counts evicted rows, which lets callers turn a row
+    index into an absolute line number (`dropped + index`).
+
+    Every change to a row stamps it with a new sequence number from `counter`
+    (shared by the main and alternate screens of a parser), so readers can ask
+    which rows changed since the last time they looked. Recent changes are also kept in a damage log, so answering that
+    costs time proportional to the number of changes rather than to the size
+    of the buffer. `activated` is stamped whenever the buffer becomes the
+    visible one; readers that last looked before that need a full copy.
+
+    A row that was filled up to the last column and continued on the next one
+    (a line longer than the terminal is wide) is marked in `wrapped`; `lines`
+    joins such rows back into the line that was printed.
+
+    `on_discard`, if set, is called as `on_discard(number, seq, text)` for each
+    row about to be evicted or cleared, with its absolute number and sequence
+    number. A row that starts a line gets the text of the whole line and the
+    latest sequence number of its rows; a row that continues one gets ''.
+    """
+    def __init__(self, capacity=None, counter=None):
+        self.capacity = capacity
+        self.counter = counter or SequenceCounter()
+        self.rows = deque(maxlen=capacity)
+        self.row_seqs = deque(maxlen=capacity)
+        # Whether each row continues on the next one, and whether the first row continues an evicted one
+        self.wrapped = deque(maxlen=capacity)
+        self.top_continued = False
+        self.dropped = 0
+        # `(seq, absolute row)` of the most recent changes, oldest first
+        self.damage = deque(maxlen=DAMAGE_LOG_SIZE)
+        self.on_discard = None
+        # Through append, so the first row is in the damage log like every other
+        self.append([])
+        self.activate()
+
+    @property
+    def last_seq(self):
+        return self.counter.last
+
+    def activate(self):
+        self.activated = self.counter.next()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def __setitem__(self, index, row):
+        self.rows[index] = row
+        self.touch(index)
+
+    def touch(self, index):
+        # Called for every write, so counter.next() is inlined here and in append()
+        counter = self.counter
+        seq = counter.last = counter.last + 1
+        self.row_seqs[index] = seq
+        self.damage.append((seq, self.dropped + index))
+
+    def append(self, row):
+        """Append a row, returning the number of rows evicted to make room (0 or 1)."""
+        rows = self.rows
+        evicted = 0
+        if len(rows) == self.capacity:
+            if self.on_discard:
+                if self.top_continued:
+                    self.on_discard(self.dropped, self.row_seqs[0], '')
+                else:
+                    self.on_discard(self.dropped, *self.line(0))
+            self.top_continued = self.wrapped[0]
+            self.dropped += 1
+            evicted = 1
+        counter = self.counter
+        seq = counter.last = counter.last + 1
+        rows.append(row)
+        self.row_seqs.append(seq)
+        self.wrapped.append(False)
+        self.damage.append((seq, self.dropped + len(rows) - 1))
+        return evicted
+
+    def reserve(self, capacity):
+        """Make room for at least `capacity` rows; a bounded ring never shrinks."""
+        if self.capacity is not None and capacity > self.capacity:
+            self.capacity = capacity
+            self.rows = deque(self.rows, maxlen=capacity)
+            self.row_seqs = deque(self.row_seqs, maxlen=capacity)
+            self.wrapped = deque(self.wrapped, maxlen=capacity)
+
+    def pop(self):
+        self.row_seqs.pop()
+        self.wrapped.pop()
+        return self.rows.pop()
+
+    def set_wrapped(self, index, wraps):
+        """Mark whether row `index` continues on the next row, which changes the lines both belong to."""
+        if self.wrapped[index] != wraps:
+            self.wrapped[index] = wraps
+            self.touch(index)
+            if index + 1 < len(self.rows):
+                self.touch(index + 1)
+
+    def is_continuation(self, index):
+        """Whether row `index` continues the line of the row above it."""
+        return self.wrapped[index - 1] if index else self.top_continued
+
+    def line_start(self, index):
+        """Index of the first row of the line row `index` belongs to (0 if that row was evicted)."""
+        while index and self.wrapped[index - 1]:
+            index -= 1
+        return index
+
+    def line(self, index):
+        """Return `(seq, text)` for the line starting at row `index`: the latest sequence number of its rows and its text."""
+        if not self.wrapped[index]:
+            return self.row_seqs[index], ''.join(self.rows[index]).rstrip()
+        parts = []
+        seq = 0
+        for row, row_seq, wraps in zip(islice(self.rows, index, None), islice(self.row_seqs, index, None),
+                                       islice(self.wrapped, index, None)):
+            parts.append(''.join(row))
+            seq = max(seq, row_seq)
+            if not wraps:
+                break
+        return seq, ''.join(parts).rstrip()
+
+    def lines(self, start=0, end=None):
+        """
+        Yield `(index, text)` for the lines in rows `start` up to `end`, with rows that wrap joined
+        to the rows they continue on. The text is not stripped, and is empty only for empty rows.
+        """
+        parts = []
+        for index, row, wraps in zip(count(start), islice(self.rows, start, end), islice(self.wrapped, start, end)):
+            if not parts:
+                first = index
+            parts.append(''.join(row))
+            if not wraps:
+                yield first, ''.join(parts)
+                parts = []
+        if parts:
+            yield first, ''.join(parts)
+
+    def scroll(self, top, bottom, count):
+        """
+        Scroll rows `top` to `bottom` (inclusive) up by `count` rows, or down if `count` is negative.
+
+        Rows scrolled out of the region are discarded and blank rows come in on the other side;
+        rows outside the region don't move.
+        """
+        if bottom < top:
+            return
+        count = max(-(bottom - top + 1), min(count, bottom - top + 1))
+        continued_below = self.wrapped[bottom]
+        for _ in range(abs(count)):
+            # Remove before inserting, as a full bounded deque refuses inserts
+            if count > 0:
+                del self.rows[top], self.row_seqs[top], self.wrapped[top]
+                self.rows.insert(bottom, [])
+                self.row_seqs.insert(bottom, 0)
+                self.wrapped.insert(bottom, False)
+            else:
+                del self.rows[bottom], self.row_seqs[bottom], self.wrapped[bottom]
+                self.rows.insert(top, [])
+                self.row_seqs.insert(top, 0)
+                self.wrapped.insert(top, False)
+        if count:
+            # Lines don't continue across the edges of the region any more
+            self.wrapped[bottom] = False
+            if top:
+                self.set_wrapped(top - 1, False)
+            if continued_below and bottom + 1 < len(self.rows):
+                self.touch(bottom + 1)
+            for index in range(top, bottom + 1):
+                self.touch(index)
+
+    def clear(self):
+        if self.on_discard:
+            for index in range(len(self.rows)):
+                self.discard(index)
+        self.dropped += len(self.rows)
+        self.rows.clear()
+        self.row_seqs.clear()
+        self.wrapped.clear()
+        self.top_continued = False
+        self.append([])
+        self.activate()
+
+    def discard(self, index):
+        if self.is_continuation(index):
+            self.on_discard(self.dropped + index, self.row_seqs[index], '')
+        else:
+            self.on_discard(self.dropped + index, *self.line(index))
+
+    def changed_since(self, seq):
+        """Yield `(index, row)` for the rows changed after sequence number `seq`, in row order."""
+        damage = self.damage
+        # Once the log is full older changes have been forgotten, and only a full scan can tell
+        if len(damage) == damage.maxlen and seq < damage[0][0] - 1:
+            for index, row_seq in enumerate(self.row_seqs):
+                if row_seq > seq:
+                    yield index, self.rows[index]
+            return
+        changed = set()
+        for change_seq, number in reversed(damage):
+            if change_seq <= seq:
+                break
+            changed.add(number - self.dropped)
+        for index in sorted(changed):
+            if 0 <= index < len(self.rows):
+                yield index, self.rows[index]
+
+
+class TerminalParser:
+    """
+    Emulates enough of a VT100/xterm to know what is on the screen.
+
+    The screen is a `height` x `width` grid at the bottom of the scrollback: rows
+    scrolled off its top stay in the buffer as scrollback, and cursor addressing is
+    relative to the top of the grid. Lines wrap at `width`, and scroll regions,
+    insert/delete of lines and characters and the alternate screen are supported.
+    Attributes (SGR colors and styles) are parsed but not kept, since only the
+    text is ever read back. Without a size (e.g. when replaying a transcript) the
+    screen grows without bound and nothing wraps.
+
+    The last `index_lines` lines of the main screen, including those evicted from
+    the scrollback, are kept in a SearchIndex for `search` (0 turns it off).
+    """
+    def __init__(self, scrollback=DEFAULT_SCROLLBACK, debug=False, log_limit=DEFAULT_LOG_LIMIT, session_log=None,
+                 height=None, width=None, index_lines=DEFAULT_INDEX_LINES):
+        self.scrollback = scrollback
+        self.debug = debug
+        self.height = height or None
+        self.width = width or None
+        # Sequence numbers of screen changes, shared by the main and alternate screens
+        self.counter = SequenceCounter()
         self.screen = self.initialize_screen()
+        self.search_index = None
+        if index_lines:
+            self.search_index = SearchIndex(index_lines)
+            self.screen.on_discard = self.search_index.discard
         self.cursor_row = 0
         self.cursor_col = 0
-        self.log_output = []
+        # Set after writing the last column: the next character goes to the start of the next line
+        self.wrap_pending = False
+        self.autowrap = True
+        # Scroll region as rows relative to the top of the screen, None for the whole screen
+        self.scroll_margins = None
+        self.saved_cursor = (0, 0)
+        # Debug log of processed lines, only kept when `debug` is set and capped at `log_limit` entries
+        self.log_output = deque(maxlen=log_limit)
         self.vim_mode = False # this is not just vim, this flag is for when we are in an alternate screen buffer
         self.pre_vim_screen = None
-        self.csi_regex = re.compile(r'\x1b\[([?]?\d*(?:;\d+)*)([A-Za-z])')
-        self.scs_regex = re.compile(r'\x1b[\(\)][@-~]')  # New regex for SCS sequences
+        self.pre_vim_cursor = None
+        self.commands = CommandHistory()
+        # Optional SessionLog that receives the raw output before it is parsed
+        self.session_log = session_log
+        if session_log:
+            self.commands.listeners.append(session_log.command_event)
+        self.csi_regex = re.compile(r'\x1b\[([0-?]*)([ -/]*)([@-~])')
+        self.csi_partial_regex = re.compile(r'\x1b\[[0-?]*[ -/]*\Z')
+        # Other escape sequences: SCS (fish shell prompts use these), DECSC/DECRC, IND, NEL, RI, RIS, keypad modes, ...
+        self.esc_regex = re.compile(r'\x1b([ -/]*)([0-~])')
+        self.esc_partial_regex = re.compile(r'\x1b[ -/]*\Z')
+        self.osc_end_regex = re.compile(r'\x07|\x1b\\')
+        # Inside a DCS, APC, PM or SOS string whose ST hasn't arrived yet
+        self.in_string = False
+        self.text_run_regex = TEXT_RUN_REGEX
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending_text = ''
+
+    def initialize_screen(self, scrollback=True):
+        screen = ScreenBuffer(self.scrollback if scrollback else None, self.counter)
+        self.fill_screen(screen)
+        return screen
 
-    def initialize_screen(self):
-        return [[]]
+    def fill_screen(self, screen):
+        # A sized screen always has at least `height` rows, the last `height` of which are on the screen,
+        # so the ring has to hold the whole screen even with less scrollback than that
+        if self.height:
+            screen.reserve(self.height)
+            for _ in range(self.height - len(screen)):
+                screen.append([])
+
+    def resize(self, height, width):
+        """Follow a change of the terminal size (SIGWINCH). Rows are not reflowed, as in most terminals."""
+        self.height = height or None
+        self.width = width or None
+        self.scroll_margins = None
+        self.wrap_pending = False
+        if self.height:
+            # When the screen shrinks, drop blank rows below the cursor before pushing rows into the scrollback
+            while len(self.screen) > max(self.height, self.cursor_row + 1) and not self.screen[-1]:
+                self.screen.pop()
+        for screen in (self.screen, self.pre_vim_screen):
+            if screen:
+                self.fill_screen(screen)
+        self.cursor_row = min(max(self.cursor_row, self.screen_top()), len(self.screen) - 1)
+        if self.width:
+            self.cursor_col = min(self.cursor_col, self.width - 1)
+
+    def screen_top(self):
+        """Index of the top row of the screen (everything above it is scrollback)."""
+        return max(0, len(self.screen) - self.height) if self.height else 0
+
+    def scroll_region(self):
+        """Return the `(top, bottom)` row indices of the scroll region, both inclusive."""
+        top = self.screen_top()
+        if self.scroll_margins:
+            return top + self.scroll_margins[0], top + self.scroll_margins[1]
+        return top, len(self.screen) - 1
 
     def screen_to_string(self):
-        return '\n'.join(''.join(row).rstrip() for row in self.screen if row)
+        return '\n'.join(text.rstrip() for _, text in self.screen.lines() if text)
 
     def ensure_cursor_position(self, cursor_row, cursor_col, line_log):
         while len(self.screen) <= cursor_row:
-            line_log.append('<ecp-new-line>')
-            self.screen.append([])
-        while len(self.screen[cursor_row]) <= cursor_col:
-            self.screen[cursor_row].append(' ')
+            if self.debug:
+                line_log.append('<ecp-new-line>')
+            # When the ring is full every append evicts the top row, shifting the target up by one
+            evicted = self.screen.append([])
+            cursor_row -= evicted
+            self.cursor_row -= evicted
+        row = self.screen[cursor_row]
+        if len(row) <= cursor_col:
+            row.extend(' ' * (cursor_col + 1 - len(row)))
+            self.screen.touch(cursor_row)
+
+    def move_cursor(self, row, col):
+        """Move the cursor to `row`, `col` relative to the top left of the screen, clamped to the screen."""
+        top = self.screen_top()
+        row = max(0, min(row, self.height - 1 if self.height else len(self.screen) - 1 + UNSIZED_LIMIT))
+        self.cursor_row = top + row
+        self.cursor_col = max(0, min(col, (self.width or UNSIZED_LIMIT) - 1))
+        self.wrap_pending = False
+        self.ensure_cursor_position(self.cursor_row, -1, [])
+
+    def write_text(self, text, line_log):
+        # Write a run of printable characters at the cursor with one slice assignment per screen line
+        text = to_cells(text)
+        width = self.width
+        screen = self.screen
+        rows = screen.rows
+        while text:
+            if self.wrap_pending:
+                # The line goes on past the last column: mark the row so the two are read back as one line
+                self.wrap_pending = False
+                self.cursor_col = 0
+                screen.set_wrapped(self.cursor_row, True)
+                self.index(line_log)
+            if self.cursor_row >= len(rows):
+                self.ensure_cursor_position(self.cursor_row, -1, line_log)
+            row = rows[self.cursor_row]
+            col = self.cursor_col
+            if width and len(text) >= width - col:
+                # Reaches the last column: the rest wraps to the next line
+                col = min(col, width - 1)
+                chunk = text[:width - col]
+                taken = len(chunk)
+                if taken < len(text) and text[taken] == '' and (taken > 1 or col):
+                    # A wide character that doesn't fit in the last column goes to the next line
+                    chunk = chunk[:-1] + [' ']
+                    taken -= 1
+                if not self.autowrap and taken < len(text):
+                    # Without autowrap the rest of the line overwrites the last column
+                    chunk = chunk[:-1] + (text[-2:-1] if text[-1] == '' else text[-1:])
+                text = text[taken:] if self.autowrap else ''
+            else:
+                chunk = text
+                text = ''
+            if len(row) < col:
+                row.extend(' ' * (col - len(row)))
+            elif col and col < len(row) and row[col] == '':
+                # Overwriting the right half of a wide character blanks its left half
+                row[col - 1] = ' '
+            end = col + len(chunk)
+            if end < len(row) and row[end] == '':
+                # and overwriting its left half blanks its right half
+                row[end] = ' '
+            row[col:end] = chunk
+            screen.touch(self.cursor_row)
+            if self.debug:
+                line_log.append(f'<write {self.cursor_row}:{col} {len(chunk)}>')
+            col = end
+            if width and col >= width:
+                self.cursor_col = width - 1
+                self.wrap_pending = self.autowrap
+            else:
+                self.cursor_col = col
+
+    def write_run(self, run, line_log):
+        """Write a text run with SGR and EL sequences in it: colors aren't kept, and each EL clears at the cursor."""
+        text = SGR_REGEX.sub('', run)
+        if '\x1b' not in text:
+            self.write_text(text, line_log)
+            return
+        pieces = text.replace('\x1b[0K', '\x1b[K').split('\x1b[K')
+        text = ''.join(pieces)
+        if not self.wrap_pending and (not self.width or self.cursor_col + len(to_cells(text)) < self.width):
+            # Nothing wraps, so the clears in between are overwritten or covered by a clear at the end
+            self.write_text(text, line_log)
+            self.clear_to_end_of_line(line_log)
+            return
+        for piece in pieces[:-1]:
+            if piece:
+                self.write_text(piece, line_log)
+            self.clear_to_end_of_line(line_log)
+        if pieces[-1]:
+            self.write_text(pieces[-1], line_log)
+
+    def clear_to_end_of_line(self, line_log):
+        # Colored output (gcc, grep) sends this after nearly every color change
+        self.wrap_pending = False
+        row = self.screen[self.cursor_row]
+        if len(row) > self.cursor_col:
+            del row[self.cursor_col:]
+            self.screen.touch(self.cursor_row)
+            self.screen.set_wrapped(self.cursor_row, False)
+        if self.debug:
+            line_log.append('<CSI-K clear line to the right>')
+
+    def feed(self, data, final=False):
+        """
+        Parse a chunk of raw pty output.
+
+        Multibyte characters and escape sequences split across chunks are held back
+        until the rest arrives, so chunks can be fed exactly as they are read. `data`
+        can be any bytes-like object, such as a view of a reused read buffer; it isn't kept.
+        """
+        if self.session_log:
+            # The session log records where commands start and end at the log's offset when their OSC 133
+            # marker is parsed, so output after a marker is only logged once the marker has been parsed
+            data = bytes(data)
+            start = 0
+            marker = data.find(b'\x1b]133;')
+            while marker != -1:
+                end = OSC_END_BYTES_REGEX.search(data, marker)
+                if not end or end.end() == len(data):
+                    break
+                self.parse_chunk(data[start:end.end()])
+                start = end.end()
+                marker = data.find(b'\x1b]133;', start)
+            if start:
+                data = data[start:]
+        self.parse_chunk(data, final)
+
+    def parse_chunk(self, data, final=False):
+        if self.session_log:
+            self.session_log.write(data)
+        text = self.pending_text + self.decoder.decode(data, final)
+        consumed = self.process_text(text, final)
+        self.pending_text = text[consumed:]
+        if len(self.pending_text) > MAX_PENDING:
+            # A runaway sequence (e.g. an OSC that is never terminated): stop waiting for its end
+            self.process_text(self.pending_text)
+            self.pending_text = ''
+
+    def skip_output(self, data):
+        """
+        Account for raw pty output that is not parsed, because parsing fell too far behind.
+
+        It still goes to the session log. Whatever was held back (a split character or
+        escape sequence) is dropped, and if the skipped output ended a line, so does the screen.
+        """
+        if self.session_log:
+            self.session_log.write(data)
+        self.decoder.reset()
+        self.pending_text = ''
+        self.in_string = False
+        if b'\n' in data:
+            self.newline([])
 
     def process_line(self, line):
+        self.process_text(line + '\n')
+
+    def process_text(self, text, final=True):
+        """
+        Process decoded output, returning the number of characters consumed.
+
+        Unless `final` is set, processing stops before an incomplete escape sequence at the end of `text`.
+        """
         line_log = []
-        i = 0
-        while i < len(line):
-            if line[i] == '\x1b':  # ESC character
-                if i + 1 < len(line) and line[i + 1] == '[':
+        consumed = self.scan(text, final, line_log)
+        if self.debug and line_log:
+            self.log_output.append(''.join(line_log))
+        return consumed
+
+    def scan(self, line, final, line_log):
+        match_text = self.text_run_regex.match
+        match_csi = self.csi_regex.match
+        length = len(line)
+        i = self.skip_string(line, 0) if self.in_string else 0
+        while i < length:
+            match = match_text(line, i)
+            if match:
+                run = match.group()
+                if '\x1b' in run:
+                    self.write_run(run, line_log)
+                else:
+                    self.write_text(run, line_log)
+                i = match.end()
+                continue
+            char = line[i]
+            if char == '\n':
+                self.newline(line_log)
+            elif char == '\r':
+                self.cursor_col = 0
+                self.wrap_pending = False
+            elif char == '\x1b':  # ESC character
+                if i + 1 == length:
+                    if not final:
+                        return i
+                elif line[i + 1] == '[':
                     # CSI sequence
-                    match = self.csi_regex.match(line[i:])
+                    match = match_csi(line, i)
                     if match:
-                        line_log.append('<CSI>')
-                        params, command = match.groups()
-                        sequence = match.group()
-                        if sequence == '\x1b[?1049h':
-                            # Vim enter alternate screen
-                            line_log.append('<Vim enter alternate screen>')
-                            self.vim_mode = True
-                            self.pre_vim_screen = [row[:] for row in self.screen]
-                            self.screen = self.initialize_screen()
-                            self.cursor_row = self.cursor_col = 0
-                        elif sequence == '\x1b[?1049l':
-                            # Vim exit alternate screen
-                            line_log.append('<Vim exit alternate screen>')
-                            self.vim_mode = False
-                            if self.pre_vim_screen:
-                                self.screen = self.pre_vim_screen
-                            else:
-                                self.screen = self.initialize_screen()
-                            self.cursor_row = len(self.screen) - 1
-                            self.cursor_col = len(self.screen[-1])
-                        elif command == 'H':  # \x1b[{row};{col}H
-                            # Set cursor position
-                            parts = params.split(';')
-                            self.cursor_row = int(parts[0]) - 1 if parts[0] else 0
-                            self.cursor_col = int(parts[1]) - 1 if len(parts) > 1 else 0
-                            self.ensure_cursor_position(self.cursor_row, self.cursor_col, line_log)
-                            line_log.append(f'<CSI-H {self.cursor_row} {self.cursor_col}>')
-                        elif command == 'J':  # \x1b[{n}J
-                            # Clear screen
-                            n = params or '0'
-                            if n == '0':
-                                self.screen[self.cursor_row] = self.screen[self.cursor_row][:self.cursor_col]
-                                self.screen = self.screen[:self.cursor_row+1]
-                                line_log.append('<CSI-J clear till end>')
-                            elif n == '1':
-                                for row in range(self.cursor_row):
-                                    self.screen[row] = []
-                                self.screen[self.cursor_row] = [' '] * self.cursor_col + self.screen[self.cursor_row][self.cursor_col:]
-                                line_log.append('<CSI-J1 clear till beginning>')
-                            elif n == '2':
-                                self.screen = self.initialize_screen()
-                                self.cursor_row = self.cursor_col = 0
-                                line_log.append('<CSI-J2 clear all>')
-                        elif command == 'K':  # \x1b[{n}K
-                            # Clear line
-                            n = params or '0'
-                            if n == '0':
-                                self.screen[self.cursor_row] = self.screen[self.cursor_row][:self.cursor_col]
-                                line_log.append('<CSI-K clear line to the right>')
-                            elif n == '1':
-                                self.screen[self.cursor_row] = [' '] * self.cursor_col + self.screen[self.cursor_row][self.cursor_col:]
-                                line_log.append('<CSI-K1 clear line to the left>')
-                            elif n == '2':
-                                self.screen[self.cursor_row] = []
-                                line_log.append('<CSI-K2 clear line>')
-                        elif command == 'A':  # \x1b[{n}A
-                            # Move cursor up
-                            n = int(params) if params else 1
-                            self.cursor_row = max(0, self.cursor_row - n)
-                            line_log.append(f'<CSI-A move up {n}, {self.cursor_row}/{len(self.screen)}>')
-                        elif command == 'B':  # \x1b[{n}B
-                            # Move cursor down
-                            n = int(params) if params else 1
-                            self.cursor_row = min(len(self.screen) - 1, self.cursor_row + n)
-                        elif command == 'C':  # \x1b[{n}C
-                            # Move cursor forward
-                            n = int(params) if params else 1
-                            self.cursor_col = min(len(self.screen[self.cursor_row]), self.cursor_col + n)
-                        elif command == 'D':  # \x1b[{n}D
-                            # Move cursor backward
-                            n = int(params) if params else 1
-                            self.cursor_col = max(0, self.cursor_col - n)
-                        i += len(sequence)
+                        # SGR, most of the sequences in colored output, changes nothing that is kept
+                        if match.group(3) != 'm':
+                            if self.debug:
+                                line_log.append('<CSI>')
+                            self.handle_csi(*match.groups(), line_log)
+                        i = match.end()
                         continue
-                elif i + 1 < len(line) and line[i + 1] in '()':
-                    # SCS sequence: fish shell prompt uses this
-                    # we ignore it for now
-                    match = self.scs_regex.match(line[i:])
+                    elif not final and self.csi_partial_regex.match(line, i):
+                        return i
+                elif line[i + 1] == ']':
+                    # OSC sequence, terminated by BEL or ST
+                    match = self.osc_end_regex.search(line, i + 2)
+                    if not match and not final:
+                        return i
+                    if self.debug:
+                        line_log.append('<OSI>')
+                    self.handle_osc(line[i + 2:match.start() if match else len(line)])
+                    i = match.end() if match else len(line)
+                    continue
+                elif line[i + 1] in 'P_^X':
+                    # DCS, APC, PM and SOS: strings terminated by ST, whose payload never reaches the screen
+                    if self.debug:
+                        line_log.append('<string>')
+                    i = self.skip_string(line, i + 2)
+                    continue
+                else:
+                    match = self.esc_regex.match(line, i)
                     if match:
-                        line_log.append('<SCS>')
-                        i += len(match.group())
+                        self.handle_esc(*match.groups(), line_log)
+                        i = match.end()
                         continue
+                    elif not final and self.esc_partial_regex.match(line, i):
+                        return i
+            elif char == '\b':
+                self.cursor_col = max(0, self.cursor_col - 1)
+                self.wrap_pending = False
+            elif char == '\t':
+                self.cursor_col = (self.cursor_col // TAB_WIDTH + 1) * TAB_WIDTH
+                if self.width:
+                    self.cursor_col = min(self.cursor_col, self.width - 1)
+            elif char in '\x0b\x0c':
+                # VT and FF move down like LF, but keep the column
+                self.index(line_log)
+            # other control characters (BEL, SI/SO, ...) don't occupy a cell and are dropped
+            i += 1
+        return i
 
-                elif i + 1 < len(line) and line[i + 1] == ']':
-                    line_log.append('<OSI>')
-                    # OSC sequence
-                    j = i + 2
-                    while j < len(line) and line[j] != '\x07':  # BEL character
-                        j += 1
-                    i = j + 1 if j < len(line) else len(line)
-                    continue
-            elif line[i] == '\r':
+    def skip_string(self, line, start):
+        """Skip a DCS, APC, PM or SOS payload from `start` up to its ST, returning where parsing resumes."""
+        end = line.find('\x1b\\', start)
+        if end >= 0:
+            self.in_string = False
+            return end + 2
+        # The payload can be large (sixel images), so it is dropped as it arrives rather than held back
+        self.in_string = True
+        # except for an ESC at the end, which may start the ST
+        return len(line) - 1 if line.endswith('\x1b') else len(line)
+
+    def handle_csi(self, params, intermediates, command, line_log):
+        if command == 'm' or intermediates or params[:1] in '<=>' and params:
+            # SGR (colors and styles aren't kept), cursor style, soft reset, device attribute queries, ...
+            return
+        if command == 'K' and params in ('', '0'):
+            self.clear_to_end_of_line(line_log)
+            return
+        private = params.startswith('?')
+        values = [min(int(value[:6]), MAX_PARAM) if value.isdigit() else 0 for value in params.lstrip('?').split(';')]
+
+        def arg(index=0, default=1):
+            # Missing and zero parameters both mean the default
+            return values[index] if index < len(values) and values[index] else default
+
+        self.wrap_pending = False
+        if private:
+            if command in 'hl':
+                for mode in values:
+                    self.set_private_mode(mode, command == 'h', line_log)
+        elif command in 'Hf':  # \x1b[{row};{col}H
+            # Set cursor position, relative to the top left of the screen
+            self.move_cursor(arg(0) - 1, arg(1) - 1)
+            if self.debug:
+                line_log.append(f'<CSI-H {self.cursor_row} {self.cursor_col}>')
+        elif command == 'J':  # \x1b[{n}J
+            # Clear screen
+            n = arg(0, 0)
+            if n == 0:
+                self.screen[self.cursor_row] = self.screen[self.cursor_row][:self.cursor_col]
+                for row in range(self.cursor_row + 1, len(self.screen)):
+                    if self.screen[row]:
+                        self.screen[row] = []
+                for row in range(self.cursor_row, len(self.screen)):
+                    self.screen.set_wrapped(row, False)
+                if self.debug:
+                    line_log.append('<CSI-J clear till end>')
+            elif n == 1:
+                for row in range(self.screen_top(), self.cursor_row):
+                    self.screen[row] = []
+                    self.screen.set_wrapped(row, False)
+                self.screen[self.cursor_row] = [' '] * (self.cursor_col + 1) + self.screen[self.cursor_row][self.cursor_col + 1:]
+                if self.debug:
+                    line_log.append('<CSI-J1 clear till beginning>')
+            elif n == 2:
+                # Unlike a real terminal, this also drops the scrollback: what was on the screen before is gone for good
+                self.screen.clear()
+                self.fill_screen(self.screen)
+                self.cursor_row = self.cursor_col = 0
+                if self.debug:
+                    line_log.append('<CSI-J2 clear all>')
+        elif command == 'K':  # \x1b[{n}K
+            # Clear line
+            # (0, to the right, is handled above)
+            n = arg(0, 0)
+            if n == 1:
+                self.screen[self.cursor_row] = [' '] * (self.cursor_col + 1) + self.screen[self.cursor_row][self.cursor_col + 1:]
+                if self.debug:
+                    line_log.append('<CSI-K1 clear line to the left>')
+            elif n == 2:
+                self.screen[self.cursor_row] = []
+                self.screen.set_wrapped(self.cursor_row, False)
+                if self.debug:
+                    line_log.append('<CSI-K2 clear line>')
+        elif command in 'AF':  # \x1b[{n}A
+            # Move cursor up, stopping at the top of the scroll region when inside it
+            region_top, region_bottom = self.scroll_region()
+            limit = region_top if region_top <= self.cursor_row <= region_bottom else self.screen_top()
+            self.cursor_row = max(limit, self.cursor_row - arg())
+            if command == 'F':
                 self.cursor_col = 0
-            elif line[i] == '\b':
-                self.cursor_col = max(0, self.cursor_col - 1)
-            else:
-                self.ensure_cursor_position(self.cursor_row, self.cursor_col, line_log)
-                line_log.append(f'<ecp {self.cursor_row}/{len(self.screen)}:{self.cursor_col}/{len(self.screen[self.cursor_row])}>')
-                if self.cursor_col == len(self.screen[self.cursor_row]) - 1:
-                    line_log.append(f'<write {line[i]}>')
+            if self.debug:
+                line_log.append(f'<CSI-A move up, {self.cursor_row}/{len(self.screen)}>')
+        elif command in 'BEe':  # \x1b[{n}B
+            # Move cursor down, stopping at the bottom of the scroll region when inside it
+            region_top, region_bottom = self.scroll_region()
+            limit = region_bottom if region_top <= self.cursor_row <= region_bottom else len(self.screen) - 1
+            self.cursor_row = min(limit, self.cursor_row + arg())
+            if command == 'E':
+                self.cursor_col = 0
+        elif command in 'Ca':  # \x1b[{n}C
+            # Move cursor forward
+            self.cursor_col = max(self.cursor_col, min(self.cursor_col + arg(), (self.width or UNSIZED_LIMIT) - 1))
+        elif command == 'D':  # \x1b[{n}D
+            # Move cursor backward
+            self.cursor_col = max(0, self.cursor_col - arg())
+        elif command in 'G`':  # \x1b[{col}G
+            # Move cursor to column
+            self.move_cursor(self.cursor_row - self.screen_top(), arg() - 1)
+        elif command == 'd':  # \x1b[{row}d
+            # Move cursor to row
+            self.move_cursor(arg() - 1, self.cursor_col)
+        elif command in 'LM':  # \x1b[{n}L, \x1b[{n}M
+            # Insert or delete lines at the cursor, moving the rest of the scroll region down or up
+            region_top, region_bottom = self.scroll_region()
+            if region_top <= self.cursor_row <= region_bottom:
+                self.screen.scroll(self.cursor_row, region_bottom, arg() if command == 'M' else -arg())
+                self.cursor_col = 0
+        elif command in 'ST':  # \x1b[{n}S, \x1b[{n}T
+            # Scroll the scroll region up or down
+            self.screen.scroll(*self.scroll_region(), arg() if command == 'S' else -arg())
+        elif command in '@PX':  # \x1b[{n}@, \x1b[{n}P, \x1b[{n}X
+            # Insert blanks, delete characters or erase characters at the cursor
+            row = self.screen[self.cursor_row][:]
+            col = self.cursor_col
+            if len(row) > col:
+                # Never more than reach the end of the line, so a huge count costs nothing
+                n = min(arg(), (self.width or len(row)) - col)
+                if command == '@':
+                    row[col:col] = ' ' * n
+                    if self.width:
+                        del row[self.width:]
+                elif command == 'P':
+                    del row[col:col + n]
                 else:
-                    line_log.append(f'<ecp-insert {line[i]}>')
-                self.screen[self.cursor_row][self.cursor_col] = line[i]
-                self.cursor_col += 1
-            i += 1
+                    row[col:col + n] = ' ' * min(n, len(row) - col)
+                self.screen[self.cursor_row] = row
+        elif command == 'r':  # \x1b[{top};{bottom}r
+            # Set the scroll region
+            if self.height:
+                region_top, region_bottom = arg(0) - 1, min(arg(1, self.height), self.height) - 1
+                if region_top < region_bottom:
+                    full = region_top == 0 and region_bottom == self.height - 1
+                    self.scroll_margins = None if full else (region_top, region_bottom)
+                    self.move_cursor(0, 0)
+        elif command == 's':
+            self.save_cursor()
+        elif command == 'u':
+            self.restore_cursor()
+
+    def handle_esc(self, intermediates, final, line_log):
+        if intermediates:
+            # SCS (character set selection) and friends
+            if self.debug:
+                line_log.append('<SCS>')
+            return
+        if final == '7':
+            self.save_cursor()
+        elif final == '8':
+            self.restore_cursor()
+        elif final == 'D':
+            self.index(line_log)
+        elif final == 'E':
+            self.newline(line_log)
+        elif final == 'M':
+            self.reverse_index()
+        elif final == 'c':
+            self.reset()
+
+    def set_private_mode(self, mode, enable, line_log):
+        if mode in ALTERNATE_SCREEN_MODES:
+            if enable and not self.vim_mode:
+                if self.debug:
+                    line_log.append('<Vim enter alternate screen>')
+                self.enter_alternate_screen()
+            elif not enable and self.vim_mode:
+                if self.debug:
+                    line_log.append('<Vim exit alternate screen>')
+                self.exit_alternate_screen()
+        elif mode == 7:
+            self.autowrap = enable
+
+    def enter_alternate_screen(self):
+        # The main screen is set aside as is, so switching screens costs the same however long the scrollback is
+        self.vim_mode = True
+        self.pre_vim_screen = self.screen
+        self.pre_vim_cursor = (self.cursor_row, self.cursor_col)
+        self.screen = self.initialize_screen(scrollback=False)
+        self.cursor_row = self.cursor_col = 0
+        self.scroll_margins = None
+        self.wrap_pending = False
+
+    def exit_alternate_screen(self):
+        self.vim_mode = False
+        self.screen = self.pre_vim_screen
+        self.screen.activate()
+        self.cursor_row, self.cursor_col = self.pre_vim_cursor
+        self.cursor_row = min(self.cursor_row, len(self.screen) - 1)
+        self.pre_vim_screen = self.pre_vim_cursor = None
+        self.scroll_margins = None
+        self.wrap_pending = False
+
+    def save_cursor(self):
+        self.saved_cursor = (self.cursor_row - self.screen_top(), self.cursor_col)
+
+    def restore_cursor(self):
+        self.move_cursor(*self.saved_cursor)
+
+    def reset(self):
+        if self.vim_mode:
+            self.exit_alternate_screen()
+        self.screen.clear()
+        self.fill_screen(self.screen)
+        self.cursor_row = self.cursor_col = 0
+        self.scroll_margins = None
+        self.autowrap = True
+        self.wrap_pending = False
 
-        # Handle newline at the end of each input line
-        if not self.vim_mode:
+    def index(self, line_log):
+        """Move the cursor down a row, scrolling at the bottom of the scroll region."""
+        self.wrap_pending = False
+        screen = self.screen
+        # Without margins the region ends at the last row; that is the common case, run on every line feed
+        bottom = self.scroll_region()[1] if self.scroll_margins else len(screen.rows) - 1
+        if self.cursor_row == bottom:
+            if self.scroll_margins is None and not (self.vim_mode and self.height):
+                # Scrolling the whole main screen moves the top row into the scrollback (an unsized screen just grows)
+                self.cursor_row += 1 - screen.append([])
+                if self.debug:
+                    line_log.append('<my new line>')
+            else:
+                screen.scroll(self.scroll_region()[0], bottom, 1)
+        elif self.cursor_row < len(screen.rows) - 1:
             self.cursor_row += 1
-            self.cursor_col = 0
-            self.screen.append([])
-            line_log.append('<my new line>')
 
-        self.log_output.append(''.join(line_log))
+    def reverse_index(self):
+        """Move the cursor up a row, scrolling down at the top of the scroll region."""
+        self.wrap_pending = False
+        top, bottom = self.scroll_region()
+        if self.cursor_row == top:
+            self.screen.scroll(top, bottom, -1)
+        else:
+            self.cursor_row = max(self.screen_top(), self.cursor_row - 1)
+
+    def newline(self, line_log):
+        # Output reaching the pty normally has "\r\n" line endings; a bare LF also returns to the first column
+        self.cursor_col = 0
+        self.index(line_log)
+
+        if self.debug:
+            self.log_output.append(''.join(line_log))
+        line_log.clear()
+
+    @property
+    def seq(self):
+        """Sequence number of the most recent change to the screen."""
+        return self.counter.last
+
+    @staticmethod
+    def render_row(row):
+        return ''.join(row).rstrip()
+
+    def get_last_lines(self, count):
+        """Return the last `count` non-empty lines of the screen, as `get_screen_state` would show them."""
+        screen = self.screen
+        lines = []
+        parts = []
+        for index in range(len(screen) - 1, -1, -1):
+            if len(lines) >= count:
+                break
+            parts.append(''.join(screen[index]))
+            if index and screen.wrapped[index - 1]:
+                # Continues the row above: keep collecting the line
+                continue
+            text = ''.join(reversed(parts))
+            parts = []
+            if text:
+                lines.append(text.rstrip())
+        return '\n'.join(reversed(lines))
+
+    def get_rows(self, start, end=None, screen=None):
+        """
+        Return `(first, rows)` for absolute row numbers `start` up to `end` (exclusive).
+
+        Rows that have already been dropped from the scrollback are skipped; `first` is the
+        absolute number of the first row returned. Trailing spaces are only kept on rows
+        that continue on the next one, where they are part of the line.
+        """
+        screen = screen or self.screen
+        dropped = screen.dropped
+        total = dropped + len(screen)
+        start = max(start, dropped)
+        end = total if end is None else min(end, total)
+        rows = []
+        for index in range(start - dropped, end - dropped):
+            text = ''.join(screen[index])
+            rows.append(text if screen.wrapped[index] else text.rstrip())
+        return start, rows
+
+    def get_lines(self, start, end=None, screen=None):
+        """Like `get_rows`, but rows that wrap are joined with the rows they continue on, into the lines that were printed."""
+        screen = screen or self.screen
+        dropped = screen.dropped
+        start = max(start, dropped)
+        end = len(screen) if end is None else max(min(end - dropped, len(screen)), start - dropped)
+        return start, [text.rstrip() for _, text in screen.lines(start - dropped, end)]
+
+    def get_wrapped(self, start, end):
+        """Absolute numbers of the rows from `start` up to `end` that continue on the next row."""
+        screen = self.screen
+        dropped = screen.dropped
+        start = max(start, dropped)
+        return [number for number, wraps in zip(count(start), islice(screen.wrapped, start - dropped, max(end - dropped, 0)))
+                if wraps]
+
+    def get_last_rows(self, count):
+        """Return `(first, rows)` for the last `count` rows, leaving out trailing empty rows."""
+        end = self.screen.dropped + len(self.screen)
+        while end > self.screen.dropped and not self.screen[end - self.screen.dropped - 1]:
+            end -= 1
+        return self.get_rows(end - count, end)
+
+    @property
+    def main_screen(self):
+        """The normal screen buffer, even while a full-screen app has the alternate screen."""
+        if self.vim_mode and self.pre_vim_screen:
+            return self.pre_vim_screen
+        return self.screen
+
+    def absolute_row(self):
+        return self.screen.dropped + self.cursor_row
+
+    def handle_osc(self, payload):
+        if payload.startswith('133;') and not self.vim_mode:
+            self.handle_shell_integration(payload[4:])
+
+    def handle_shell_integration(self, params):
+        # OSC 133 semantic prompt markers: A prompt start, B command input start, C output start, D;status command finished
+        commands = self.commands
+        commands.shell_integration = True
+        kind, _, args = params.partition(';')
+        row = self.absolute_row()
+        if kind == 'A':
+            commands.finish(row if self.cursor_col == 0 else row + 1)
+        elif kind == 'B':
+            commands.input_start = (row, self.cursor_col)
+        elif kind == 'C':
+            commands.finish(row)
+            command = ''
+            if commands.input_start:
+                input_row, input_col = commands.input_start
+                first, rows = self.get_lines(input_row, row if self.cursor_col == 0 else row + 1)
+                if rows and first == input_row:
+                    rows[0] = rows[0][input_col:]
+                command = '\n'.join(rows).strip()
+                commands.input_start = None
+            commands.start(command, row)
+        elif kind == 'D':
+            status = args.split(';')[0]
+            commands.finish(row if self.cursor_col == 0 else row + 1, int(status) if status.lstrip('-').isdigit() else None)
+
+    def mark_command_submitted(self):
+        """Heuristic command boundary for shells without OSC 133 markers: Enter was pressed on the current row."""
+        commands = self.commands
+        if commands.shell_integration or self.vim_mode:
+            return
+        row = self.absolute_row()
+        if commands.current:
+            self.read_command_line(commands.current)
+            _, output = self.get_lines(commands.current.output_start, row)
+            commands.finish(row, output=output)
+        commands.start(None, row + 1)
+
+    def read_command_line(self, record):
+        if record.command is None:
+            screen = self.main_screen
+            row = record.output_start - 1
+            if 0 <= row - screen.dropped < len(screen):
+                # A command line too long for the terminal wraps: read it from the row it starts on
+                row = screen.dropped + screen.line_start(row - screen.dropped)
+            _, line = self.get_lines(row, record.output_start, screen=screen)
+            record.command = self.commands.strip_prompt(line[0]) if line else ''
+
+    def get_command(self, which='last'):
+        """Return a command record (see CommandHistory.get) with its output, or None."""
+        record = self.commands.get(which)
+        if record is None:
+            return None
+        self.read_command_line(record)
+        end = record.output_end
+        if end is None and not self.vim_mode:
+            # Still running: its output reaches the cursor, but leave out a fresh prompt the cursor sits on
+            end = self.absolute_row()
+            _, line = self.get_rows(end, end + 1)
+            if line and line[0] and not self.commands.is_bare_prompt(line[0]):
+                end += 1
+        first, output = self.get_lines(record.output_start, end, screen=self.main_screen)
+        return {**record.to_dict(), 'output': '\n'.join(output), 'output_truncated': first > record.output_start}
+
+    def get_changes(self, since=0):
+        """
+        Return the rows changed after sequence number `since`.
+
+        The result holds the current `seq` to pass as `since` next time, the absolute numbers
+        of the first and one-past-last row on the screen, the absolute number of the row the
+        cursor is on, and `rows` as `[number, text]` pairs. `full` is set when the whole screen
+        was sent because it was cleared or swapped since.
+        """
+        screen = self.screen
+        full = since < screen.activated
+        changed = screen.changed_since(-1 if full else since)
+        return {
+            'seq': self.seq,
+            'first': screen.dropped,
+            'total': screen.dropped + len(screen),
+            'cursor': screen.dropped + self.cursor_row,
+            'full': full,
+            'rows': [[screen.dropped + index, self.render_row(row)] for index, row in changed],
+        }
+
+    def reachable_lines(self):
+        """How many of the latest lines of output can be read back, from the scrollback or the search index; None for all of them."""
+        if self.scrollback is None:
+            return None
+        lines = max(self.scrollback, self.height or 0)
+        if self.search_index is not None:
+            lines = max(lines, self.search_index.max_lines)
+        return lines
+
+    def search_index_behind(self):
+        """Whether output is waiting to be added to the search index."""
+        return self.search_index is not None and self.search_index.behind(self.main_screen)
+
+    def catch_up_search_index(self):
+        """Index a batch of the waiting output, returning whether more is waiting."""
+        return self.search_index is not None and self.search_index.catch_up(self.main_screen)
+
+    def search(self, pattern, limit=100, context=0, ignore_case=False):
+        """
+        Find the rows of the main screen and scrollback matching the regular expression `pattern`, newest first.
+
+        Returns up to `limit` matches as dicts with the absolute `row`, its `line`, and
+        `context` lines `before` and `after` it. A line that wrapped is matched as a whole,
+        at the row it starts on. With the index, lines evicted from the scrollback are
+        searched too; without it, every line is checked.
+        """
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        screen = self.main_screen
+        if self.search_index is not None:
+            self.search_index.update(screen)
+            return self.search_index.search(regex, limit=limit, context=context)
+        matches = []
+        for index, text in reversed(list(screen.lines())):
+            if len(matches) >= limit:
+                break
+            line = text.rstrip()
+            if line and regex.search(line):
+                matches.append(self.search_match(screen, index, line, context))
+        return matches
+
+    def search_match(self, screen, index, line, context):
+        row = screen.dropped + index
+        _, before = self.get_rows(row - context, row, screen=screen)
+        _, after = self.get_rows(row + 1, row + 1 + context, screen=screen)
+        return {'row': row, 'line': line, 'before': before, 'after': after}
 
     def get_screen_state(self):
-        # Remove trailing empty lines
-        while self.screen and not self.screen[-1]:
-            self.screen.pop()
         return self.screen_to_string(), '\n'.join(self.log_output)
 
 def process_terminal_output(raw_output):
-    parser = TerminalParser()
-    lines = raw_output.split('\n')
-    for line in lines:
-        parser.process_line(line)
-    return parser.get_screen_dump()
+    parser = TerminalParser(index_lines=0)
+    parser.process_text(raw_output)
+    screen_state, _ = parser.get_screen_state()
+    return screen_state
@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import deque
+
+# Output is coalesced into buffers of up to this many bytes, the most the parser is handed at once
+CHUNK_BYTES = 64 * 1024
+# Output waiting to be parsed beyond this is skipped, oldest first, even if it could still be read back
+MAX_QUEUED_BYTES = 64 * 1024 * 1024
+
+
+class ParseQueue:
+    """
+    Output and parser calls waiting to be applied to a TerminalParser, in order.
+
+    Adding never blocks and never parses: consecutive output is coalesced into
+    buffers of up to CHUNK_BYTES. Once the output waiting holds twice as many
+    lines as the parser lets anyone read back (`term.reachable_lines()`, through
+    the scrollback or the search index), the oldest of it is skipped: it would
+    scroll out of both before anyone could read it. Past `max_bytes` the oldest
+    output is skipped regardless, up to the end of a line, rather than letting
+    the backlog grow without bound. Skipped output was already echoed, and still
+    goes to the session log.
+
+    `take` removes events and `apply` runs them against the parser; an exception
+    from the parser is counted and the rest of the events still run.
+    """
+    def __init__(self, term, max_bytes=MAX_QUEUED_BYTES, parse_times=None):
+        self.term = term
+        self.max_bytes = max_bytes
+        # Optional stats Histogram that receives the time spent parsing each chunk
+        self.parse_times = parse_times
+        # bytearrays of output and `(callable, *args)` calls
+        self.events = deque()
+        self.queued_bytes = 0
+        self.queued_lines = 0
+        # Lines of output worth parsing, the rest is skipped; None to keep them all
+        self.keep_lines = term.reachable_lines()
+        self.skipped_bytes = 0
+        self.errors = 0
+        self.last_error = None
+
+    def __bool__(self):
+        return bool(self.events)
+
+    def feed(self, data):
+        # `data` may be a view of the I/O loop's read buffer, which is reused for the next read
+        events = self.events
+        if events and type(events[-1]) is bytearray and len(events[-1]) < CHUNK_BYTES:
+            buffer = events[-1]
+            buffer += data
+        else:
+            buffer = bytearray(data)
+            events.append(buffer)
+        self.queued_bytes += len(data)
+        self.queued_lines += buffer.count(b'\n', len(buffer) - len(data))
+        if self.queued_bytes > self.max_bytes:
+            # Skip to half the limit, so this doesn't happen again on the next read
+            self.skip(self.max_bytes // 2)
+        elif self.keep_lines is not None and self.queued_lines > 2 * self.keep_lines:
+            self.skip(self.max_bytes, self.keep_lines)
+
+    # Calls are queued in order with the output, so a command boundary lands on the right row
+    # and a resize applies to the output that follows it
+
+    def mark_command_submitted(self):
+        self.events.append((self.term.mark_command_submitted,))
+
+    def resize(self, height, width):
+        self.events.append((self.term.resize, height, width))
+
+    def skip(self, max_bytes, keep_lines=None):
+        """
+        Skip the oldest output until no more than `max_bytes` are waiting, and while what
+        follows it still holds `keep_lines` lines, then to the end of the line.
+        """
+        events = self.events
+        start = self.queued_bytes
+        count = 0
+        for event in events:
+            if type(event) is bytearray:
+                lines = event.count(b'\n')
+                if self.queued_bytes <= max_bytes and (keep_lines is None or self.queued_lines - lines < keep_lines):
+                    break
+                self.queued_bytes -= len(event)
+                self.queued_lines -= lines
+            count += 1
+        if self.queued_bytes == start:
+            return
+        skipped = bytearray()
+        calls = []
+        for _ in range(count):
+            event = events.popleft()
+            if type(event) is bytearray:
+                skipped += event
+            elif event[0] == self.term.skip_output:
+                # Output skipped before, which the parser hasn't got to yet
+                skipped += event[1]
+            else:
+                # Resizes and command marks still apply
+                calls.append(event)
+        if events and type(events[0]) is bytearray:
+            end = events[0].find(b'\n') + 1
+            skipped += events[0][:end]
+            del events[0][:end]
+            self.queued_bytes -= end
+            self.queued_lines -= 1 if end else 0
+        events.extendleft(reversed(calls))
+        events.appendleft((self.term.skip_output, bytes(skipped)))
+        self.skipped_bytes += start - self.queued_bytes
+
+    def take(self, max_bytes):
+        """Remove and return the oldest events, with up to `max_bytes` of output (at least one event)."""
+        events = self.events
+        taken = []
+        size = 0
+        while events and (not taken or size < max_bytes):
+            event = events.popleft()
+            if type(event) is bytearray:
+                size += len(event)
+                self.queued_bytes -= len(event)
+                self.queued_lines -= event.count(b'\n')
+            taken.append(event)
+        return taken
+
+    def apply(self, events):
+        term = self.term
+        for event in events:
+            try:
+                if type(event) is bytearray:
+                    start = time.perf_counter()
+                    term.feed(event)
+                    if self.parse_times:
+                        self.parse_times.record(time.perf_counter() - start)
+                else:
+                    event[0](*event[1:])
+            except Exception as e:
+                # Output the parser chokes on must not stop it from parsing what follows
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+
+
+class ParserWorker:
+    """
+    Run a TerminalParser on a background thread.
+
+    The I/O loop echoes pty output first and then hands the bytes over through a
+    ParseQueue, so parsing never sits between the shell and the user's terminal:
+    handing over never blocks, and when parsing falls far behind (a burst of
+    output faster than it can be parsed) the oldest output is skipped instead.
+    """
+    def __init__(self, term, max_bytes=MAX_QUEUED_BYTES, parse_times=None):
+        self.term = term
+        self.queue = ParseQueue(term, max_bytes, parse_times)
+        # Held while a chunk is parsed; take it to read a consistent snapshot of the parser
+        self.lock = threading.Lock()
+        # Guards the queue, which the I/O loop adds to while the worker takes from it
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="aishell-parser", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the worker and wait for it to exit. Output it hasn't got to is skipped rather
+        than parsed, but still reaches the session log before this returns.
+        """
+        with self.condition:
+            self.stopping = True
+            self.queue.skip(0)
+            self.condition.notify()
+        self.thread.join()
+
+    def feed(self, data):
+        with self.condition:
+            self.queue.feed(data)
+            self.condition.notify()
+
+    def mark_command_submitted(self):
+        with self.condition:
+            self.queue.mark_command_submitted()
+            self.condition.notify()
+
+    def resize(self, height, width):
+        with self.condition:
+            self.queue.resize(height, width)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                events = self.queue.take(CHUNK_BYTES)
+            with self.lock:
+                self.queue.apply(events)
+            # Let the I/O loop have the GIL right away if it is waiting for it
+            time.sleep(0)
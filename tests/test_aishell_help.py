@@ -0,0 +1,73 @@
+import pytest
+
+from aishell.aishell_help import SYSTEM_PROMPT, chat, is_help_command
+from aishell.backends import FakeBackend
+from aishell.cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def fake_backend_env(monkeypatch):
+    monkeypatch.setenv("AISHELL_BACKEND", "fake")
+    monkeypatch.delenv("AISHELL_MODEL", raising=False)
+
+
+def test_chat_prints_the_answer(capsys):
+    backend = FakeBackend(response="Missing semicolon on line 3.")
+    chat("$ make\nerror: expected ';'", interactive=False, backend=backend)
+    assert capsys.readouterr().out == "Missing semicolon on line 3.\n"
+    assert backend.requests == [[
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "$ make\nerror: expected ';'"},
+    ]]
+
+
+def test_chat_continues_the_conversation(capsys, monkeypatch):
+    backend = FakeBackend()
+    prompts = iter(["why?"])
+
+    def ask(prompt):
+        try:
+            return next(prompts)
+        except StopIteration:
+            raise EOFError
+    monkeypatch.setattr("builtins.input", ask)
+    chat("hello", backend=backend)
+    assert capsys.readouterr().out == "You said: hello\nYou said: why?\n\nExiting chat...\n"
+    assert len(backend.requests) == 2
+    assert [message['content'] for message in backend.requests[-1][1:4]] == ["hello", "You said: hello", "why?"]
+
+
+def test_chat_creates_the_backend_only_when_needed(capsys):
+    created = []
+
+    def backend():
+        created.append(FakeBackend(response="ok"))
+        return created[-1]
+    chat("hi", interactive=False, backend=backend)
+    assert len(created) == 1 and capsys.readouterr().out == "ok\n"
+
+
+def test_chat_answers_from_the_cache_without_a_backend(capsys, tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    chat("screen at 12:00", interactive=False, backend=FakeBackend(response="Run make clean."),
+         cache=cache, cache_subject="the failed command")
+    capsys.readouterr()
+
+    def no_backend():
+        raise AssertionError("the backend should not be needed")
+    chat("screen at 12:05", interactive=False, backend=no_backend, cache=cache, cache_subject="the failed command")
+    assert capsys.readouterr().out == "Run make clean.\n"
+
+
+@pytest.mark.parametrize('command, expected', [
+    ("aishell-help", True),
+    ("aishell-quick-help", True),
+    ("/usr/local/bin/aishell-help --no-interactive", True),
+    ("AISHELL_MODEL=gpt-4o aishell-help", True),
+    ("make", False),
+    ("echo aishell-help", False),
+    ("", False),
+    (None, False),
+])
+def test_is_help_command(command, expected):
+    assert is_help_command(command) is expected
@@ -0,0 +1,103 @@
+import os
+import select
+import socket
+import time
+
+import pytest
+
+from aishell import broker as broker_module
+from aishell.broker import Broker
+from aishell.protocol import FrameReader, encode_frame
+
+
+@pytest.fixture
+def broker(tmp_path):
+    directory = tmp_path / "run"
+    directory.mkdir(mode=0o700)
+    broker = Broker(str(directory / "broker.sock"))
+    yield broker
+    broker.shutdown()
+
+
+def pump(broker, rounds=3):
+    """Run a few rounds of the broker's select loop."""
+    for _ in range(rounds):
+        writers = [sock for sock, client in broker.clients.items() if client.outbuf]
+        readable, writable, _ = select.select([broker.server_socket, *broker.clients], writers, [], 0.01)
+        for sock in readable:
+            if sock is broker.server_socket:
+                broker.accept()
+            elif sock in broker.clients:
+                broker.read(broker.clients[sock])
+        for sock in writable:
+            if sock in broker.clients:
+                broker.write(broker.clients[sock])
+        broker.expire_fan_outs()
+
+
+class Peer:
+    """A client or a session connected to the broker."""
+    def __init__(self, broker):
+        self.broker = broker
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(1)
+        self.sock.connect(broker.socket_file)
+        self.reader = FrameReader(self.sock)
+
+    def send(self, message):
+        self.sock.sendall(encode_frame(message))
+        pump(self.broker)
+
+    def read(self):
+        pump(self.broker)
+        return self.reader.read()
+
+    def request(self, message):
+        self.send(message)
+        return self.read()
+
+
+def session(broker, session_id):
+    peer = Peer(broker)
+    assert peer.request({'op': 'register', 'session': session_id, 'started': time.time()})['ok']
+    return peer
+
+
+def test_requests_are_routed_to_the_named_session(broker):
+    sessions = {session_id: session(broker, session_id) for session_id in ("a", "b")}
+    client = Peer(broker)
+    assert [info['session'] for info in client.request({'op': 'sessions'})['sessions']] == ["a", "b"]
+    client.send({'op': 'screen', 'lines': 5, 'session': "b"})
+    assert sessions["b"].read() == {'op': 'screen', 'lines': 5}
+    sessions["b"].send({'ok': True, 'text': "B"})
+    assert client.read() == {'ok': True, 'text': "B"}
+    assert client.request({'op': 'screen', 'session': "c"}) == {'ok': False, 'error': "No session c"}
+    assert not client.request({'op': 'subscribe', 'session': "a"})['ok']
+    assert session(broker, "c") and not Peer(broker).request({'op': 'register', 'session': "a"})['ok']
+
+
+def test_search_fans_out_and_times_out_slow_sessions(broker, monkeypatch):
+    monkeypatch.setattr(broker_module, "FAN_OUT_TIMEOUT", 0.5)
+    fast, slow = session(broker, "fast"), session(broker, "slow")
+    client = Peer(broker)
+    client.send({'op': 'search', 'pattern': "error"})
+    assert fast.read() == slow.read() == {'op': 'search', 'pattern': "error"}
+    fast.send({'ok': True, 'matches': [{'row': 3, 'line': "error: x"}]})
+    time.sleep(0.5)
+    results = client.read()['results']
+    assert [(result['session'], result['ok']) for result in results] == [("fast", True), ("slow", False)]
+    assert results[1]['error'] == 'timeout'
+    # A late answer is dropped, and the next request gets its own answer
+    slow.send({'ok': True, 'matches': []})
+    client.send({'op': 'sessions'})
+    assert len(client.read()['sessions']) == 2
+
+
+def test_requests_waiting_on_a_session_that_ends_are_answered(broker):
+    gone = session(broker, "gone")
+    client = Peer(broker)
+    client.send({'op': 'screen', 'session': "gone"})
+    gone.read()
+    gone.sock.close()
+    assert client.read() == {'ok': False, 'error': "Session gone ended"}
+    assert client.request({'op': 'sessions'})['sessions'] == []
@@ -0,0 +1,49 @@
+import os
+import time
+
+from aishell import cache as cache_module
+from aishell.cache import ResponseCache
+
+
+def age(cache, key, seconds):
+    """Make the entry for `key` look last used `seconds` ago."""
+    when = time.time() - seconds
+    os.utime(cache.path(key), (when, when))
+
+
+def test_entries_round_trip_under_a_normalized_key(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    key = cache.key("$ make\nerror  \n\n", "prompt", "model")
+    assert key == cache.key("$ make\nerror", "prompt", "model")
+    assert key != cache.key("$ make\nerror", "prompt", "other model")
+    assert cache.get(key) is None
+    cache.put(key, "Fix the error.")
+    assert cache.get(key) == "Fix the error."
+
+
+def test_expired_entries_are_not_served(tmp_path, monkeypatch):
+    cache = ResponseCache(directory=str(tmp_path), ttl=60)
+    cache.put("k", "old answer")
+    now = time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 61)
+    assert cache.get("k") is None
+    assert not os.path.exists(cache.path("k"))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    age(cache, "a", 100)
+    age(cache, "b", 50)
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert [cache.get(key) for key in "abc"] == ["A", None, "C"]
+
+
+def test_entries_are_evicted_to_fit_the_size_limit(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), max_bytes=3000)
+    for i, key in enumerate("abcd"):
+        cache.put(key, key * 1000)
+        age(cache, key, 100 - i)
+    assert [key for key in "abcd" if cache.get(key)] == ["c", "d"]
@@ -0,0 +1,51 @@
+from aishell.commands import CommandHistory
+from aishell.terminal_parser import TerminalParser
+
+PROMPT = b"\x1b]133;A\x07$ \x1b]133;B\x07"
+
+
+def shell(*steps):
+    """Feed output, calling mark_command_submitted for each None step (Enter typed at the terminal)."""
+    term = TerminalParser(height=10, width=40)
+    for step in steps:
+        if step is None:
+            term.mark_command_submitted()
+        else:
+            term.feed(step)
+    return term
+
+
+def test_shell_integration_marks_commands_and_exit_statuses():
+    term = shell(PROMPT, b"make\r\n\x1b]133;C\x07cc main.c\r\nerror: x\r\n\x1b]133;D;2\x07",
+                 PROMPT, b"true\r\n\x1b]133;C\x07\x1b]133;D;0\x07", PROMPT)
+    last = term.get_command('last')
+    assert (last['command'], last['output'], last['exit_status'], last['failed']) == ('true', '', 0, False)
+    failed = term.get_command('last_failed')
+    assert (failed['command'], failed['output'], failed['exit_status']) == ('make', 'cc main.c\nerror: x', 2)
+    assert (failed['output_start'], failed['output_end']) == (1, 3)
+
+
+def test_enter_marks_commands_without_shell_integration():
+    term = shell(b"$ ls", None, b"\r\na  b\r\n$ ", b"cat nope", None, b"\r\ncat: nope: No such file or directory\r\n$ ")
+    first = term.get_command('1')
+    assert (first['command'], first['output'], first['failed']) == ('ls', 'a  b', False)
+    assert term.get_command('last')['command'] == 'cat nope'
+    # Still running: its output so far, without the prompt the cursor sits on
+    assert term.get_command('last')['output'] == 'cat: nope: No such file or directory'
+    term.mark_command_submitted()
+    assert term.get_command('last_failed')['command'] == 'cat nope'
+
+
+def test_enter_is_ignored_once_the_shell_sends_markers():
+    term = shell(PROMPT, None, b"ls\r\n\x1b]133;C\x07a\r\n\x1b]133;D;0\x07", PROMPT)
+    assert [record.command for record in term.commands.records] == ['ls']
+
+
+def test_history_keeps_the_latest_records():
+    history = CommandHistory(limit=2)
+    for i in range(3):
+        history.start(f"cmd {i}", i)
+        history.finish(i + 1, exit_status=1 if i == 0 else 0)
+    assert [record.command for record in history.records] == ['cmd 1', 'cmd 2']
+    assert history.get('1') is None and history.get('last_failed') is None
+    assert [record.command for record in history.finished_since(2)] == ['cmd 2']
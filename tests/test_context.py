@@ -0,0 +1,37 @@
+from aishell.context import build_context, compress_lines, estimate_tokens
+
+
+def test_everything_that_fits_is_kept_in_order():
+    lines = ["$ ls", "a  b", "", "$ "]
+    assert build_context(lines, budget=100) == "$ ls\na  b\n$"
+
+
+def test_runs_of_similar_lines_collapse():
+    lines = ["$ wget x"] + [f"{i}% [{'=' * (i // 10)}>]" for i in range(0, 101, 10)] + ["done"]
+    assert compress_lines(lines, max_line_chars=80) == [
+        (0, "$ wget x"), (1, "0% [>]"), (2, "[... 9 similar lines ...]"), (11, "100% [==========>]"), (12, "done")]
+
+
+def test_focused_command_and_errors_are_kept_first():
+    lines = [f"noise {i}" for i in range(50)] + ["error: disk full"] + [f"noise {i}" for i in range(50, 80)]
+    lines += ["$ make", "cc -c main.c", "main.c:3: error: expected ';'", "$ "]
+    context = build_context(lines, budget=30, focus=(81, 84))
+    assert sum(estimate_tokens(line) for line in context.split("\n") if "omitted" not in line) <= 30
+    assert context.startswith("[... 50 lines omitted ...]\nerror: disk full\n")
+    assert context.endswith("$ make\ncc -c main.c\nmain.c:3: error: expected ';'\n$")
+
+
+def wget_then_make():
+    lines = ["$ wget x"] + [f"{i}% [{'=' * (i // 10)}>]" for i in range(0, 101, 10)]
+    return lines + [f"unrelated output {i}" for i in range(10)] + ["$ make", "error: stop", "", ""]
+
+
+def test_omitted_markers_count_the_original_lines():
+    # 22 lines before `$ make`, collapsed into 7 entries
+    assert build_context(wget_then_make(), budget=6, focus=(22, 24)).split("\n") == [
+        "[... 22 lines omitted ...]", "$ make", "error: stop"]
+
+
+def test_lines_omitted_after_the_last_kept_one_are_marked():
+    assert build_context(wget_then_make(), budget=4, focus=(22, 24)).split("\n")[-2:] == [
+        "$ make", "[... 1 lines omitted ...]"]
@@ -0,0 +1,34 @@
+from aishell import get_screen
+from aishell.get_screen import follow_screen
+from aishell.terminal_parser import TerminalParser
+
+
+def follow(monkeypatch, outputs, line_limit=None):
+    """Run follow_screen against a parser fed `outputs`, one pushed update after each."""
+    term = TerminalParser(height=6, width=40)
+
+    def subscribe(socket_file, request):
+        seq = request['since']
+        for data in outputs:
+            term.feed(data)
+            changes = term.get_changes(seq)
+            seq = changes['seq']
+            yield {'ok': True, 'event': 'changes', **changes}
+    monkeypatch.setenv("AISHELL_SOCKET", "unused")
+    monkeypatch.setattr(get_screen, 'subscribe', subscribe)
+    return list(follow_screen(line_limit))
+
+
+def test_follow_screen_yields_rows_once_the_cursor_leaves_them(monkeypatch):
+    outputs = [b"$ ", b"echo hi", b"\r\nhi\r\n$ ", b"ls", b"\r\na  b\r\n$ "]
+    assert follow(monkeypatch, outputs) == ['$ echo hi', 'hi', '$ ls', 'a  b']
+
+
+def test_follow_screen_after_clearing_the_screen(monkeypatch):
+    outputs = [b"$ make\r\nok\r\n$ ", b"clear", b"\r\n", b"\x1b[H\x1b[2J\x1b[3J$ ", b"echo h", b"i", b"\r\nhi\r\n$ "]
+    assert follow(monkeypatch, outputs) == ['$ make', 'ok', '$ clear', '$ echo hi', 'hi']
+
+
+def test_follow_screen_starts_with_the_last_lines(monkeypatch):
+    outputs = [b"one\r\ntwo\r\nthree\r\n$ ", b"x\r\n"]
+    assert follow(monkeypatch, outputs, line_limit=2) == ['two', 'three', '$ x']
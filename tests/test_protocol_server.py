@@ -0,0 +1,212 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from aishell.get_screen import join_wrapped_rows
+from aishell.protocol import HEADER, MAGIC, MAX_PAYLOAD, VERSION, ProtocolError, decode_frame, encode_frame
+from aishell.server import ClientConnection, ScreenServer, handle_framed_request, handle_request
+from aishell.terminal_parser import TerminalParser
+
+
+@pytest.fixture
+def term():
+    term = TerminalParser(height=5, width=40)
+    term.feed(b"$ make\r\nerror: missing ;\r\n$ ")
+    return term
+
+
+def request(term, message):
+    return handle_request(message, term, threading.Lock(), {'print_count': 0})
+
+
+def framed(term, data):
+    client = ClientConnection(sock=None)
+    client.inbuf = data
+    handled = handle_framed_request(client, term, threading.Lock(), {'print_count': 0})
+    response = decode_frame(bytes(client.outbuf))[1] if client.outbuf else None
+    return handled, client, response
+
+
+@pytest.fixture
+def server(tmp_path, term):
+    server = ScreenServer(str(tmp_path / "aishell.sock"), term, threading.Lock(), {'print_count': 0})
+    yield server
+    server.shutdown()
+
+
+def connect(server):
+    """Return our end of a connection the server serves, like the link to the broker."""
+    ours, theirs = socket.socketpair()
+    server.adopt(theirs)
+    return ours, theirs
+
+
+def received(sock):
+    """Decode the frames waiting on `sock`."""
+    sock.setblocking(False)
+    data = b""
+    messages = []
+    while True:
+        version, message, rest = decode_frame(data)
+        if message is not None:
+            messages.append(message)
+            data = rest
+            continue
+        try:
+            chunk = sock.recv(65536)
+        except BlockingIOError:
+            return messages
+        if not chunk:
+            return messages
+        data += chunk
+
+
+def publish(server):
+    server.last_publish = 0.0
+    server.publish()
+
+
+def subscribe(server, term):
+    """Subscribe from the current state, returning the socket with the first update read."""
+    ours, theirs = connect(server)
+    ours.sendall(encode_frame({'op': 'subscribe', 'since': term.seq}))
+    server.process([theirs], [])
+    publish(server)
+    received(ours)
+    return ours
+
+
+def test_frames_round_trip():
+    message = {'op': 'screen', 'lines': 3}
+    data = encode_frame(message) + encode_frame({'op': 'stats'})
+    version, decoded, rest = decode_frame(data)
+    assert (version, decoded) == (VERSION, message)
+    assert decode_frame(rest)[1] == {'op': 'stats'}
+
+
+def test_incomplete_frame_waits_for_more_data():
+    data = encode_frame({'op': 'screen'})
+    for end in (3, HEADER.size, len(data) - 1):
+        assert decode_frame(data[:end]) == (None, None, data[:end])
+
+
+def test_bad_frames_raise_protocol_error():
+    with pytest.raises(ProtocolError):
+        decode_frame(b"NOPE" + bytes(HEADER.size))
+    with pytest.raises(ProtocolError):
+        decode_frame(HEADER.pack(MAGIC, VERSION, MAX_PAYLOAD + 1))
+
+
+def test_request_answers_from_the_screen(term):
+    response = request(term, {'op': 'screen'})
+    assert response['ok']
+    assert response['text'].startswith('$ make\nerror: missing ;')
+
+
+def test_unknown_op_is_an_error(term):
+    assert request(term, {'op': 'nope'}) == {'ok': False, 'error': "Unknown op: nope"}
+
+
+@pytest.mark.parametrize('message', [
+    {'op': 'rows', 'start': 'x'},
+    {'op': 'rows', 'start': float('inf')},
+    {'op': 'rows', 'last': None},
+    {'op': 'search'},
+    {'op': 'search', 'pattern': '('},
+    {'op': 'changes', 'since': [1]},
+    {'op': 'stats'},
+])
+def test_bad_requests_are_answered_with_an_error(term, message):
+    response = request(term, message)
+    assert response['ok'] is False
+    assert response['error']
+
+
+def test_deeply_nested_payload_closes_only_that_client(term):
+    payload = ('[' * 100000 + ']' * 100000).encode()
+    handled, client, response = framed(term, HEADER.pack(MAGIC, VERSION, len(payload)) + payload)
+    assert handled
+    assert response['ok'] is False and response['error'].startswith("Bad frame")
+    assert client.close_when_sent
+
+
+def test_non_finite_numbers_are_answered_with_an_error(term):
+    payload = b'{"op": "rows", "start": Infinity}'
+    handled, client, response = framed(term, HEADER.pack(MAGIC, VERSION, len(payload)) + payload)
+    assert response['ok'] is False
+    assert not client.close_when_sent
+
+
+def test_framed_request_rejects_other_versions_and_non_objects(term):
+    assert framed(term, encode_frame({'op': 'screen'}, version=VERSION + 1))[2]['ok'] is False
+    payload = json.dumps(['screen']).encode()
+    assert framed(term, HEADER.pack(MAGIC, VERSION, len(payload)) + payload)[2] == {
+        'ok': False, 'error': "Request must be a JSON object"}
+
+
+def test_incomplete_framed_request_is_not_handled_yet(term):
+    handled, client, response = framed(term, encode_frame({'op': 'screen'})[:-1])
+    assert not handled and response is None
+
+
+def test_rows_report_which_rows_wrapped():
+    term = TerminalParser(height=5, width=20)
+    term.feed(b"$ grep -n foo\r\nmain.c: a reference to foo\r\n$ ")
+    response = request(term, {'op': 'rows', 'start': 0})
+    assert response['wrapped'] == [1]
+    assert join_wrapped_rows(response['first'], response['rows'], response['wrapped']) == (
+        [0, 1, 3, 4], ['$ grep -n foo', 'main.c: a reference to foo', '$', ''])
+
+
+def test_subscriber_is_pushed_cursor_moves(server, term):
+    sock = subscribe(server, term)
+    term.feed(b"\r\n")
+    publish(server)
+    [event] = received(sock)
+    assert event['event'] == 'changes' and event['rows'] == []
+    assert event['cursor'] == term.screen.dropped + term.cursor_row == 3
+    publish(server)
+    assert received(sock) == []
+
+
+def test_slow_client_does_not_hold_up_the_others(server, term):
+    term.feed(b"".join(b"line %d of a long listing\r\n" % i for i in range(10000)))
+    slow, slow_end = connect(server)
+    slow.sendall(encode_frame({'op': 'screen'}) * 10)
+    start = time.perf_counter()
+    server.process([slow_end], [])
+    assert time.perf_counter() - start < 2
+    assert server.clients[slow_end].outbuf
+    fast, fast_end = connect(server)
+    fast.sendall(encode_frame({'op': 'rows', 'last': 1}))
+    server.process([fast_end], [])
+    assert received(fast)[0]['rows'] == ['line 9999 of a long listing']
+
+
+def test_subscriber_gets_only_the_rows_that_changed(server, term):
+    sock = subscribe(server, term)
+    term.feed(b"make")
+    publish(server)
+    [event] = received(sock)
+    assert event['rows'] == [[2, '$ make']] and not event['full']
+    term.feed(b"\r\n\x1b[2J")
+    publish(server)
+    [event] = received(sock)
+    assert event['full'] and len(event['rows']) == 5
+
+
+def test_updates_wait_while_a_subscriber_is_behind(server, term, monkeypatch):
+    monkeypatch.setattr('aishell.server.SUBSCRIBER_MAX_PENDING', 0)
+    sock = subscribe(server, term)
+    client = next(client for client in server.clients.values() if client.subscribed_seq is not None)
+    client.outbuf += b"unread"
+    term.feed(b"a")
+    publish(server)
+    assert client.outbuf == bytearray(b"unread")
+    client.outbuf.clear()
+    term.feed(b"b")
+    publish(server)
+    assert [event['rows'] for event in received(sock)] == [[[2, '$ ab']]]
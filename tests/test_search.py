@@ -0,0 +1,79 @@
+import re
+
+import pytest
+
+from aishell.search import SEGMENT_ROWS, SearchIndex, required_trigrams, trigrams
+from aishell.terminal_parser import TerminalParser
+
+
+@pytest.mark.parametrize('pattern, required', [
+    ('error', trigrams('error')),
+    ('Error', trigrams('error')),
+    ('ab', set()),
+    (r'\x20abc', trigrams('abc')),
+    (r'\u00e9abc', trigrams('abc')),
+    (r'\N{BULLET} abc', trigrams(' abc')),
+    (r'\101bcd', trigrams('bcd')),
+    (r'\d+ failed', trigrams(' failed')),
+    (r'a\.bc', trigrams('a.bc')),
+    ('ab?cde', trigrams('cde')),
+    ('ab{2,3}cde', trigrams('cde')),
+    ('[a-z]+foo', trigrams('foo')),
+    ('[]abc]xyz', trigrams('xyz')),
+    (r'[\]]xyz', trigrams('xyz')),
+    ('^make: .*Error', trigrams('make: ') | trigrams('error')),
+    ('foo|bar', set()),
+    ('(foo)bar', set()),
+])
+def test_required_trigrams(pattern, required):
+    assert required_trigrams(pattern) == required
+
+
+@pytest.mark.parametrize('pattern', [
+    'error', r'\x20abc', r'\d+ failed', 'ab?cde', '[a-z]+foo', 'foo|bar', '^line 1', r'line \d\d$',
+])
+def test_matching_lines_contain_the_required_trigrams(pattern):
+    lines = ["error: x", " abc", "3 failed", "acde", "abcde", "xfoo", "bar", "line 12", "line 1"]
+    for line in lines:
+        if re.search(pattern, line):
+            assert required_trigrams(pattern) <= trigrams(line), line
+
+
+def parsed(data, index_lines):
+    term = TerminalParser(height=5, width=30, scrollback=50, index_lines=index_lines)
+    term.feed(data)
+    return term
+
+
+@pytest.mark.parametrize('pattern', ['line 1', r'line \d5$', 'ERROR', 'x|y', 'nothing'])
+def test_index_finds_what_a_scan_of_the_screen_finds(pattern):
+    data = b"".join(b"line %d%s\r\n" % (i, b" ERROR" if i % 7 == 0 else b"") for i in range(40))
+    indexed = parsed(data, index_lines=1000).search(pattern)
+    scanned = parsed(data, index_lines=0).search(pattern)
+    assert [match['line'] for match in indexed] == [match['line'] for match in scanned]
+    assert [match['row'] for match in indexed] == [match['row'] for match in scanned]
+
+
+def test_index_keeps_lines_evicted_from_the_scrollback():
+    term = parsed(b"".join(b"line %d\r\n" % i for i in range(200)), index_lines=1000)
+    assert term.search(r'^line 3$')[0]['row'] == 3
+    assert parsed(b"".join(b"line %d\r\n" % i for i in range(200)), index_lines=0).search(r'^line 3$') == []
+
+
+def test_rewritten_rows_are_found_by_their_latest_text():
+    term = parsed(b"downloading 10%\rdownloading 99%\r\ndone", index_lines=1000)
+    term.search('done')
+    term.feed(b"\x1b[1;1Hfinished 100%  \x1b[K")
+    assert [match['line'] for match in term.search('100%')] == ['finished 100%']
+    assert term.search('downloading') == []
+
+
+def test_postings_stay_bounded_while_a_row_is_rewritten():
+    index = SearchIndex()
+    for i in range(20 * SEGMENT_ROWS):
+        index.add(0, f"progress {i}")
+        index.flush()
+    segment = index.segments[0]
+    assert len(segment.postings) < 2000
+    assert all(len(blocks) <= SEGMENT_ROWS for blocks in segment.postings.values())
+    assert [match['line'] for match in index.search(re.compile('progress'))] == [f"progress {20 * SEGMENT_ROWS - 1}"]
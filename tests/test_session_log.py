@@ -0,0 +1,47 @@
+import os
+import stat
+
+from aishell.session_log import OFFSET, SessionLog, SessionLogReader
+from aishell.terminal_parser import TerminalParser
+
+PROMPT = b"\x1b]133;A\x07$ \x1b]133;B\x07"
+
+
+def record_session(path, *outputs):
+    log = SessionLog(str(path))
+    term = TerminalParser(height=5, width=40, session_log=log)
+    for data in outputs:
+        term.feed(memoryview(data))
+    log.close()
+    return SessionLogReader(str(path))
+
+
+def test_lines_and_commands_read_back_from_disk(tmp_path):
+    reader = record_session(
+        tmp_path / "session.log",
+        PROMPT, b"ls\r\n\x1b]133;C\x07a  b\r\n\x1b]133;D;0\x07",
+        PROMPT, b"make\r\n\x1b]133;C\x07\x1b[31merror: x\x1b[0m\r\n\x1b]133;D;2\x07", PROMPT)
+    assert reader.line_count == 4
+    assert reader.get_lines(0, 2) == "$ ls\na  b"
+    assert reader.get_last_lines(1) == "$"
+    last = reader.get_command('last')
+    assert (last['command'], last['output'], last['exit_status']) == ('make', 'error: x', 2)
+    assert reader.get_command('last_failed')['id'] == last['id']
+    assert reader.get_command('1')['output'] == 'a  b'
+    assert reader.get_command('7') is None
+
+
+def test_log_files_are_private(tmp_path):
+    record_session(tmp_path / "logs" / "session.log", b"secret\r\n")
+    for name in ("session.log", "session.log.lines", "session.log.commands"):
+        assert stat.S_IMODE(os.stat(tmp_path / "logs" / name).st_mode) == 0o600
+
+
+def test_reader_only_trusts_lines_that_reached_the_log(tmp_path):
+    path = tmp_path / "session.log"
+    record_session(path, b"one\r\ntwo\r\n")
+    with open(str(path) + ".lines", "ab") as f:
+        f.write(OFFSET.pack(1000))
+    reader = SessionLogReader(str(path))
+    assert reader.line_count == 2
+    assert reader.get_lines(0) == "one\ntwo"
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from aishell.server import handle_request
+from aishell.stats import Histogram, SessionStats, format_stats
+from aishell.terminal_parser import TerminalParser
+from aishell.worker import ParseQueue
+
+
+def test_histogram_reports_bucketed_percentiles():
+    histogram = Histogram()
+    for seconds in [0.001] * 98 + [0.5, 2.0]:
+        histogram.record(seconds)
+    report = histogram.to_dict()
+    assert report['count'] == 100 and report['max_ms'] == 2000
+    assert 1 <= report['p50_ms'] <= 2.048
+    assert 500 <= report['p99_ms'] <= 1048.576
+    assert sum(count for _, count in report['buckets']) == 100
+
+
+def test_stats_op_reports_the_session():
+    term = TerminalParser(height=5, width=40, scrollback=100)
+    stats = SessionStats()
+    stats.parse_queue = ParseQueue(term, parse_times=stats.parse)
+    stats.parse_queue.feed(b"$ ls\r\na  b\r\n")
+    stats.parse_queue.apply(stats.parse_queue.take(1024))
+    stats.parse_queue.feed(b"more\r\n")
+    stats.record_request('screen', 0.002)
+    response = handle_request({'op': 'stats'}, term, threading.Lock(), {'stats': stats})
+    report = response['stats']
+    assert report['parse']['count'] == 1
+    assert report['backlog']['queued_bytes'] == 6
+    assert report['screen']['main']['rows'] == 5 and report['screen']['scrollback_limit'] == 100
+    assert report['requests']['screen']['count'] == 1
+    text = format_stats(report)
+    assert "queued_bytes 6" in text and "request screen" in text
+
+
+def test_profiler_samples_the_other_threads():
+    stats = SessionStats()
+    stats.set_profiling('start')
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline and not stats.profiler.samples:
+        sum(range(10000))
+    stats.set_profiling('stop')
+    report = stats.profiler.report()
+    assert not report['running'] and report['samples'] > 0 and report['top']
+    with pytest.raises(ValueError):
+        stats.set_profiling('restart')
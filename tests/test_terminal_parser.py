@@ -0,0 +1,184 @@
+import pytest
+
+from aishell.terminal_parser import MAX_PENDING, TerminalParser
+
+
+def rows(term):
+    return [''.join(row) for row in term.screen]
+
+
+def parse(data, height=3, width=10, chunk=None):
+    term = TerminalParser(height=height, width=width)
+    data = data.encode() if isinstance(data, str) else data
+    step = chunk or len(data) or 1
+    for i in range(0, len(data), step):
+        term.feed(data[i:i + step])
+    return term
+
+
+def test_text_wraps_at_the_last_column():
+    term = parse("abcdefghijKL")
+    assert rows(term) == ['abcdefghij', 'KL', '']
+    assert (term.cursor_row, term.cursor_col) == (1, 2)
+
+
+def test_line_ending_right_after_the_last_column_does_not_add_a_blank_line():
+    assert rows(parse("abcdefghij\r\nx")) == ['abcdefghij', 'x', '']
+
+
+def test_without_autowrap_the_last_column_is_overwritten():
+    assert rows(parse("\x1b[?7labcdefghijKL")) == ['abcdefghiL', '', '']
+
+
+def test_scrolling_stays_inside_the_scroll_region():
+    term = parse("top\x1b[5;1Hbottom\x1b[2;4r\x1b[2;1Ha\r\nb\r\nc\r\nd", height=5)
+    assert rows(term) == ['top', 'b', 'c', 'd', 'bottom']
+
+
+def test_scrolling_the_whole_screen_moves_rows_into_the_scrollback():
+    term = parse("1\r\n2\r\n3\r\n4\r\n5")
+    assert rows(term) == ['1', '2', '3', '4', '5']
+    assert term.screen_top() == 2
+    assert term.get_screen_state()[0].split('\n')[-3:] == ['3', '4', '5']
+
+
+def test_insert_characters_is_clamped_to_the_line():
+    term = parse("abcdef\x1b[1;3H\x1b[999999999@")
+    assert rows(term)[0] == 'ab        '
+
+
+def test_delete_and_erase_characters_are_clamped_to_the_line():
+    assert rows(parse("abcdef\x1b[1;3H\x1b[999999999P"))[0] == 'ab'
+    assert rows(parse("abcdef\x1b[1;3H\x1b[999999999X"))[0] == 'ab    '
+
+
+def test_cursor_position_is_clamped_to_the_screen():
+    term = parse("\x1b[999999999;999999999H")
+    assert (term.cursor_row, term.cursor_col) == (2, 9)
+    assert len(term.screen) == 3
+
+
+def test_cursor_position_on_an_unsized_screen_is_bounded():
+    term = TerminalParser()
+    term.feed(b"\x1b[999999999;5Hx")
+    assert len(term.screen) < 10000
+    assert ''.join(term.screen[-1]).strip() == 'x'
+
+
+def test_characters_and_escapes_split_across_chunks():
+    term = parse("café \x1b[31mred\x1b[0m \x1b]0;title\x07done", width=20, chunk=1)
+    assert rows(term)[0] == 'café red done'
+    assert term.pending_text == ''
+
+
+def test_unterminated_sequence_is_not_held_back_forever():
+    term = parse("\x1b]0;" + "x" * (MAX_PENDING + 10))
+    assert len(term.pending_text) <= MAX_PENDING
+
+
+def test_alternate_screen_leaves_the_main_screen_untouched():
+    term = parse("main\x1b[?1049hvim\x1b[?1049l")
+    assert rows(term) == ['main', '', '']
+
+
+def test_changes_after_a_screen_switch_include_every_row():
+    term = parse("main")
+    seq = term.seq
+    term.feed(b"\x1b[?1049h")
+    changes = term.get_changes(seq)
+    assert changes['full']
+    assert [number for number, _ in changes['rows']] == list(range(changes['first'], changes['total']))
+
+
+
+def test_sequence_numbers_belong_to_each_parser():
+    first = parse("one")
+    seq = first.seq
+    parse("two\r\nthree")
+    assert first.seq == seq
+    assert first.get_changes(seq)['rows'] == []
+
+
+def test_colored_text_with_clears_in_between():
+    term = parse("0123456789\r\x1b[01;35m\x1b[Kab\x1b[m\x1b[K cd\x1b[0K")
+    assert rows(term)[0] == 'ab cd'
+    # Clearing at the last column cancels the pending wrap, as in xterm
+    assert rows(parse("abcdefgh\x1b[31mij\x1b[Kk\x1b[0m"))[:2] == ['abcdefghik', '']
+
+
+def test_scrollback_smaller_than_the_screen_holds_the_whole_screen():
+    term = TerminalParser(scrollback=10, height=24, width=80)
+    term.feed(b"\x1b[2;20r\x1b[20;1H\n\n\x1b[3S\x1b[5L\x1b[5M\x1b[r")
+    assert len(term.screen) == 24
+    term.resize(40, 80)
+    term.feed(b"\x1b[2;39r\x1b[39;1H\n\n\x1b[3T")
+    assert len(term.screen) == 40
+
+
+def test_wrapped_lines_are_read_back_whole():
+    term = parse("$ grep -n foo\r\nmain.c: a reference to foo\r\n$ ", height=5, width=20)
+    assert rows(term)[1:3] == ['main.c: a reference ', 'to foo']
+    assert term.get_lines(0) == (0, ['$ grep -n foo', 'main.c: a reference to foo', '$', ''])
+    assert term.get_wrapped(0, 5) == [1]
+    assert term.screen_to_string() == "$ grep -n foo\nmain.c: a reference to foo\n$"
+    for index_lines in (0, 1000):
+        term = TerminalParser(height=5, width=20, index_lines=index_lines)
+        term.feed(b"$ grep -n foo\r\nmain.c: a reference to foo\r\n$ ")
+        assert [(match['row'], match['line']) for match in term.search('reference to foo')] == [
+            (1, 'main.c: a reference to foo')]
+
+
+def test_overwriting_a_wrapped_line_splits_it():
+    term = parse("abcdefghijKL\x1b[1;5H\x1b[K", height=3, width=10)
+    assert term.get_lines(0) == (0, ['abcd', 'KL', ''])
+    assert term.get_wrapped(0, 3) == []
+
+
+def test_index_keeps_wrapped_lines_evicted_from_the_scrollback():
+    term = TerminalParser(height=3, width=10, scrollback=4, index_lines=1000)
+    term.feed(b"first line that wraps\r\n")
+    term.search('x')
+    term.feed(b"".join(b"line %d\r\n" % i for i in range(10)))
+    assert [(match['row'], match['line']) for match in term.search('that wraps')] == [
+        (0, 'first line that wraps')]
+    assert term.search('^that') == []
+
+
+@pytest.mark.parametrize('sequence', [
+    "\x1bP+q544e\x1b\\", "\x1b_Gf=100;AAAA\x1b\\", "\x1b^private\x1b\\", "\x1bXstring\x1b\\",
+])
+@pytest.mark.parametrize('chunk', [None, 1, 3])
+def test_string_sequences_are_skipped_up_to_st(sequence, chunk):
+    assert rows(parse("ab" + sequence + "cd", chunk=chunk))[0] == 'abcd'
+
+
+def test_long_string_sequence_is_dropped_as_it_arrives():
+    term = parse("ab\x1bPq" + "#0;2;0;0;0" * 10000, chunk=4096)
+    assert len(term.pending_text) <= 1
+    term.feed(b"\x1b\\cd")
+    assert rows(term)[0] == 'abcd'
+
+
+def test_wide_characters_take_two_cells():
+    term = parse("你好!", width=10)
+    assert rows(term)[0] == '你好!'
+    assert (term.cursor_row, term.cursor_col) == (0, 5)
+    assert len(term.screen[0]) == 5
+
+
+def test_wide_character_that_does_not_fit_wraps_whole():
+    term = parse("abcdefghi\U0001f600x", width=10)
+    assert rows(term)[:2] == ['abcdefghi ', '\U0001f600x']
+    assert term.get_lines(0)[1][0] == 'abcdefghi \U0001f600x'
+
+
+def test_overwriting_half_of_a_wide_character_blanks_the_other_half():
+    assert rows(parse("你好\x1b[1;2Hx"))[0] == ' x好'
+    assert rows(parse("你好\x1b[1;3Hx"))[0] == '你x '
+
+
+def test_skipped_output_drops_partial_sequences():
+    term = parse("before\x1b[3")
+    term.skip_output(b"lost\r\n")
+    term.feed(b"after")
+    assert rows(term)[:2] == ['before', 'after']
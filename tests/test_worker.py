@@ -0,0 +1,90 @@
+from aishell.terminal_parser import TerminalParser
+from aishell.worker import CHUNK_BYTES, ParseQueue, ParserWorker
+
+
+def lines(first, count, width=1000):
+    return b"".join(b"%-*d\r\n" % (width - 2, i) for i in range(first, first + count))
+
+
+def rows(term):
+    return [''.join(row).rstrip() for row in term.screen]
+
+
+class RecordingLog:
+    """Stands in for a SessionLog, keeping what is written to it."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def command_event(self, event, record):
+        pass
+
+
+def test_output_is_coalesced_between_calls():
+    term = TerminalParser(height=5, width=40)
+    queue = ParseQueue(term)
+    for data in (b"ab", b"cd\r\n", b"x" * CHUNK_BYTES, b"ef"):
+        queue.feed(memoryview(data))
+    queue.resize(5, 30)
+    queue.feed(b"gh")
+    events = list(queue.events)
+    assert [bytes(event) for event in events[:2]] == [b"abcd\r\n" + b"x" * CHUNK_BYTES, b"ef"]
+    assert events[2] == (term.resize, 5, 30)
+    assert events[3] == bytearray(b"gh")
+    assert (queue.queued_bytes, queue.queued_lines) == (CHUNK_BYTES + 10, 1)
+
+
+def test_output_that_can_still_be_read_back_is_kept():
+    term = TerminalParser(height=5, width=1000, scrollback=100, index_lines=0)
+    queue = ParseQueue(term)
+    assert queue.keep_lines == 100
+    data = lines(0, 1000)
+    for i in range(0, len(data), 4096):
+        queue.feed(data[i:i + 4096])
+    assert 0 < queue.skipped_bytes < len(data) - 100 * 1000
+    assert queue.queued_lines >= 100
+    queue.apply(queue.take(len(data)))
+    everything = TerminalParser(height=5, width=1000, scrollback=100, index_lines=0)
+    everything.feed(data)
+    assert rows(term) == rows(everything)
+
+
+def test_output_is_kept_when_every_line_can_be_read_back():
+    term = TerminalParser(height=5, width=1000, scrollback=None)
+    queue = ParseQueue(term)
+    assert queue.keep_lines is None
+    queue.feed(lines(0, 1000))
+    assert queue.skipped_bytes == 0 and queue.queued_lines == 1000
+
+
+def test_backlog_past_the_byte_limit_is_skipped_to_a_line_end():
+    term = TerminalParser(height=5, width=1000, scrollback=None)
+    queue = ParseQueue(term, max_bytes=100 * 1000)
+    queue.feed(b"$ cat big\r\n")
+    queue.mark_command_submitted()
+    data = lines(0, 200)
+    for i in range(0, len(data), 3000):
+        queue.feed(data[i:i + 3000])
+    assert queue.queued_bytes <= 100 * 1000
+    events = list(queue.events)
+    assert events[0][0] == term.skip_output and events[1] == (term.mark_command_submitted,)
+    assert events[2].startswith(b"%-998d" % int(events[2][:998]))
+    assert queue.skipped_bytes + queue.queued_bytes == len(data) + len(b"$ cat big\r\n")
+    queue.apply(queue.take(len(data)))
+    assert rows(term)[-2] == '199'
+
+
+def test_stopped_worker_has_logged_all_the_output():
+    log = RecordingLog()
+    term = TerminalParser(height=5, width=1000, session_log=log)
+    worker = ParserWorker(term)
+    worker.start()
+    data = lines(0, 5000)
+    for i in range(0, len(data), 4096):
+        worker.feed(data[i:i + 4096])
+    worker.stop()
+    assert not worker.thread.is_alive()
+    assert log.data == data
+    assert not worker.queue